@@ -1,2 +1,16 @@
 from detect_vec import detect_vec
 from detect_ts import detect_ts
+from series_store import SeriesStore
+from batch import detect_many
+from detect_async import detect_ts_async, detect_many_async
+from window_cache import DirectoryWindowCache
+from baseline import BaselineModel
+from decomposition import register_backend, get_backend
+from partitioned import PartitionedSeries, detect_partitioned
+from sketch import QuantileSketch, daily_max_sketch
+from hierarchy import detect_hierarchy
+from backtest import backtest
+from arrow import ArrowSeries, detect_arrow, result_table
+from shard import ShardSpec, shard_of
+from esd import EarlyStop
+from workspace import Workspace
@@ -0,0 +1,4 @@
+import sys
+from anomaly.cli import main
+
+sys.exit(main())
@@ -0,0 +1,259 @@
+import numpy as np
+from pandas import DataFrame
+from date_utils import parse_timestamps
+from results import DetectionResult
+
+# Arrow and Parquet input and output, with pyarrow as an optional dependency. Columns are mapped to
+# NumPy arrays straight from the Arrow buffers, without pandas: timestamp[ns] and float64 columns
+# without nulls (in a single chunk) become read-only views, anything else is converted once.
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+TIME_UNIT_NS = {'s': 10**9, 'ms': 10**6, 'us': 10**3, 'ns': 1}
+
+OUTPUT_COLUMNS = ['series', 'timestamp', 'anoms']
+
+
+def _require():
+    if pa is None:
+        raise ImportError("Arrow and Parquet support needs pyarrow")
+
+
+def is_arrow(data):
+    """Whether data is a pyarrow Table or RecordBatch."""
+    return pa is not None and isinstance(data, (pa.Table, pa.RecordBatch))
+
+
+def _column(data, column):
+    # a Table's ChunkedArray or a RecordBatch's Array, by name or position
+    if not isinstance(column, (int, long)):
+        index = data.schema.get_field_index(column)
+        if index < 0:
+            raise ValueError("no %s column" % column)
+        column = index
+    column = data.column(column)
+    # Table.column returned a Column before pyarrow 0.15
+    if hasattr(pa, 'Column') and isinstance(column, pa.Column):
+        column = column.data
+    return column
+
+
+def _valid(chunk):
+    # validity bitmap of an Arrow array as booleans
+    bitmap = np.frombuffer(chunk.buffers()[0], dtype=np.uint8)
+    bits = np.unpackbits(bitmap[:, None], axis=1)[:, ::-1].ravel()
+    return bits[chunk.offset:chunk.offset + len(chunk)].astype(bool)
+
+
+def _primitive(chunk, dtype):
+    # a view of the data buffer of a fixed width array
+    data = np.frombuffer(chunk.buffers()[1], dtype=dtype)[chunk.offset:chunk.offset + len(chunk)]
+    # Arrow data is immutable
+    data.flags.writeable = False
+    return data
+
+
+def _numpy(column, dtype, fill):
+    chunks = column.chunks if hasattr(column, 'chunks') else [column]
+    parts = []
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        values = _primitive(chunk, dtype)
+        if chunk.null_count:
+            values = np.where(_valid(chunk), values, fill)
+        parts.append(values)
+    if not parts:
+        return np.empty(0, dtype=dtype)
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def arrow_timestamps(column):
+    """
+    int64 nanosecond timestamps of an Arrow column: timestamp columns of any
+    unit (a view for ns), integer epoch seconds, or strings.
+    """
+    kind = column.type
+    if pa.types.is_timestamp(kind):
+        missing = np.iinfo(np.int64).min
+        timestamps = _numpy(column, np.int64, missing)
+        unit = TIME_UNIT_NS[kind.unit]
+        if unit == 1:
+            return timestamps
+        # nulls keep the missing sentinel, scaling it would overflow
+        return np.where(timestamps != missing, timestamps * unit, missing)
+    if pa.types.is_integer(kind) or pa.types.is_floating(kind):
+        return parse_timestamps(_numpy(column, kind.to_pandas_dtype(), 0))
+    return parse_timestamps(np.array(column.to_pylist(), dtype=object))
+
+
+def arrow_values(column):
+    """float64 values of a numeric Arrow column, a view for float64; nulls are NaN."""
+    kind = column.type
+    if not (pa.types.is_integer(kind) or pa.types.is_floating(kind)):
+        raise ValueError("values must be numeric, not %s" % kind)
+    values = _numpy(column, kind.to_pandas_dtype(), np.nan)
+    return values if values.dtype == np.float64 else values.astype(np.float64)
+
+
+class ArrowSeries(object):
+    """
+    A <timestamp, count> series from an Arrow table or record batch, which
+    detect_ts reads like a SeriesStore. Columns are views of the Arrow buffers
+    where their types allow; a series that isn't sorted by time is sorted
+    into a copy.
+
+    timestamps, values : numpy.ndarray
+    """
+
+    def __init__(self, timestamps, values):
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(timestamps) != len(values):
+            raise ValueError("timestamps and values must be the same length")
+        if np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind='mergesort')
+            timestamps, values = timestamps[order], values[order]
+        self.timestamps = timestamps
+        self.values = values
+
+    @classmethod
+    def from_arrow(cls, data, timestamp_column=0, value_column=1):
+        _require()
+        return cls(arrow_timestamps(_column(data, timestamp_column)),
+                   arrow_values(_column(data, value_column)))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+def split_series(data, series_column, timestamp_column='timestamp', value_column='count'):
+    """
+    ArrowSeries by name from a long-format table or record batch, with one row
+    per series and timestamp.
+    """
+    _require()
+    names = _column(data, series_column)
+    if hasattr(names, 'chunks'):
+        names = pa.concat_arrays(names.chunks) if names.num_chunks != 1 else names.chunk(0)
+    encoded = names.dictionary_encode()
+    codes = _numpy(encoded.indices, encoded.indices.type.to_pandas_dtype(), -1)
+    timestamps = arrow_timestamps(_column(data, timestamp_column))
+    values = arrow_values(_column(data, value_column))
+
+    # grouped by series, in time order within each
+    order = np.lexsort((timestamps, codes))
+    codes = codes[order]
+    bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+    dictionary = encoded.dictionary.to_pylist()
+    series = {}
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if codes[lo] < 0:
+            raise ValueError("%s has nulls" % series_column)
+        rows = order[lo:hi]
+        series[dictionary[codes[lo]]] = ArrowSeries(timestamps[rows], values[rows])
+    return series
+
+
+def read_parquet_series(path, timestamp_column='timestamp', value_column='count'):
+    """
+    (timestamps, values) of a Parquet file, reading only those two columns.
+    Like cli.load_series, a file of exactly two columns is read positionally.
+    """
+    _require()
+    names = pq.ParquetFile(path).schema.names
+    if timestamp_column not in names or value_column not in names:
+        if len(names) != 2:
+            raise ValueError("%s has no %s and %s columns" % (path, timestamp_column, value_column))
+        timestamp_column, value_column = names
+    series = ArrowSeries.from_arrow(pq.read_table(path, columns=[timestamp_column, value_column]),
+                                    timestamp_column, value_column)
+    return series.timestamps, series.values
+
+
+def result_table(result, series=None, e_value=None):
+    """
+    A DetectionResult (or timestamps, values, expected) as an Arrow table of
+    series, timestamp and anoms, plus expected_value with ``e_value`` (by
+    default, when the result has them).
+    """
+    _require()
+    if isinstance(result, DetectionResult):
+        if e_value is None:
+            e_value = result.e_value
+        result = (result.timestamps, result.values, result.expected_values)
+    timestamps, values, expected = result
+    columns = [pa.array([series] * len(timestamps), type=pa.string()),
+               pa.array(np.asarray(timestamps, dtype=np.int64), type=pa.timestamp('ns')),
+               pa.array(np.asarray(values, dtype=np.float64))]
+    names = list(OUTPUT_COLUMNS)
+    if e_value:
+        columns.append(pa.array(np.asarray(expected, dtype=np.float64)))
+        names.append('expected_value')
+    return pa.Table.from_arrays(columns, names)
+
+
+def read_parquet_anomalies(path):
+    """The anomalies of a ParquetAnomalyWriter output as a DataFrame."""
+    _require()
+    table = pq.read_table(path)
+    names = [name for name in table.schema.names if name in OUTPUT_COLUMNS + ['expected_value']]
+    data = {'series': np.array(_column(table, 'series').to_pylist(), dtype=object),
+            'timestamp': arrow_timestamps(_column(table, 'timestamp')).view('M8[ns]')}
+    for name in names[2:]:
+        data[name] = arrow_values(_column(table, name))
+    return DataFrame(data, columns=names)
+
+
+class ParquetAnomalyWriter(object):
+    """
+    Streams anomalies to a Parquet file, one row group per write. The file is
+    only readable once closed.
+    """
+
+    def __init__(self, path, e_value=False):
+        _require()
+        self.e_value = e_value
+        schema = result_table((np.empty(0), np.empty(0), np.empty(0)), e_value=e_value).schema
+        self._writer = pq.ParquetWriter(path, schema)
+
+    def write(self, series, result):
+        """Write a DetectionResult, or (timestamps, values, expected)."""
+        if isinstance(result, DetectionResult):
+            result = (result.timestamps, result.values, result.expected_values)
+        if len(result[0]):
+            self._writer.write_table(result_table(result, series, e_value=self.e_value))
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def detect_arrow(data, series_column=None, timestamp_column='timestamp', value_column='count',
+                 max_workers=None, **kwargs):
+    """
+    Run detect_ts over an Arrow table or record batch.
+
+    With ``series_column`` the data is in long format and each series in it
+    is detected on, concurrently as in detect_many; otherwise it is a single
+    series.
+
+    returns
+
+    result : DetectionResult, or a dict of them by series
+    """
+    from detect_ts import detect_ts
+    from batch import detect_many
+    if series_column is None:
+        return detect_ts(ArrowSeries.from_arrow(data, timestamp_column, value_column), **kwargs)
+    return detect_many(split_series(data, series_column, timestamp_column, value_column),
+                       max_workers, **kwargs)
@@ -0,0 +1,186 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pandas import DataFrame
+from date_utils import format_timestamp, timestamps_to_ns, HOUR_NS, DAY_NS
+from detect_ts import detect_ts
+from workspace import ThreadWorkspaces
+
+# Replays a series as if detect_ts(..., only_last=step) had run at the end of every hour (or day),
+# on the data that had arrived by then. Every step is a real detect_ts call, so the alerts are the
+# ones production would have raised. What carries over between steps is what doesn't change their
+# results: the series is parsed and sorted once; steps without new data are skipped; with longterm,
+# only the windows that reach into the reporting hour are detected on, so a step costs one or two
+# windows rather than the whole history; ESD's critical values, which only depend on window lengths,
+# are memoized; and the steps each thread runs share one Workspace. The decomposition (and with it
+# the remainder ESD sorts) changes with every new observation, so it is recomputed for those windows.
+
+STEP_NS = {'hr': HOUR_NS, 'day': DAY_NS}
+
+ALERT_COLUMNS = ['step', 'timestamp', 'anoms']
+
+
+class BacktestResult(object):
+    """
+    The alerts of a backtest and how it went.
+
+    alerts : pandas.DataFrame
+        One row per alert: the step (evaluation time) it fired at, the
+        anomaly's timestamp and value.
+    steps : int
+        Number of evaluation points.
+    elapsed : float
+        Seconds spent detecting.
+    observations : int
+        Observations detected on over all the steps.
+    windows_run : int
+        detect_anoms runs over all the steps.
+    precision, recall : float or None
+        Against the label column, if one was given: the share of alerts on
+        labelled points, and of labelled points in the replayed span that
+        fired an alert.
+    """
+
+    def __init__(self, alerts, steps, elapsed, observations, windows_run, precision=None, recall=None):
+        self.alerts = alerts
+        self.steps = steps
+        self.elapsed = elapsed
+        self.observations = observations
+        self.windows_run = windows_run
+        self.precision = precision
+        self.recall = recall
+
+    @property
+    def throughput(self):
+        """Steps per second."""
+        return self.steps / self.elapsed if self.elapsed else float('inf')
+
+    def __repr__(self):
+        return '<BacktestResult: %d alerts over %d steps, %.1f steps/s>' % (
+            len(self.alerts), self.steps, self.throughput)
+
+
+def _step(timestamps, values, stop, lookback_start, step, workspace, kwargs):
+    lo = np.searchsorted(timestamps, lookback_start, side='right') if lookback_start is not None else 0
+    frame = DataFrame({'timestamp': timestamps[lo:stop].view('M8[ns]'), 'count': values[lo:stop]},
+                      columns=['timestamp', 'count'])
+    return detect_ts(frame, only_last=step, workspace=workspace, **kwargs)
+
+
+def backtest(df, step='hr', start=None, history=None, label_column=None, max_workers=1, **kwargs):
+    """
+    Replay detect_ts over a series, evaluating at the end of every ``step``.
+
+    df : pandas.DataFrame
+        Timestamps and values like detect_ts takes, plus the label column if
+        ``label_column`` is given.
+
+    step : 'hr' | 'day'
+        How often detection runs; it reports the anomalies of the last step,
+        like ``only_last``.
+
+    start : timestamp
+        The first evaluation point, by default a week into the series. Rounded
+        up to a whole step.
+
+    history : pandas.Timedelta or int
+        How far back (nanoseconds for an int) each step looks; all of the
+        series so far by default.
+
+    label_column : str
+        A column of df that is true for anomalies, to score the alerts against.
+
+    max_workers : int
+        Steps run on a thread pool of this size.
+
+    kwargs
+        Passed through to detect_ts, e.g. max_anoms, direction, longterm.
+
+    returns
+
+    result : BacktestResult
+    """
+    if step not in STEP_NS:
+        raise ValueError("step must be either 'hr' or 'day'")
+    if 'only_last' in kwargs:
+        raise ValueError("the backtest sets only_last to the step")
+    if 'workspace' in kwargs:
+        raise ValueError("the backtest gives each thread its own workspace")
+    step_ns = STEP_NS[step]
+
+    labels = None
+    if label_column is not None:
+        if label_column not in df.columns:
+            raise ValueError("no %s column" % label_column)
+        labels = np.asarray(df[label_column], dtype=bool)
+        df = df.drop(label_column, axis=1)
+    if not isinstance(df, DataFrame) or len(df.columns) != 2:
+        raise ValueError("data must be a 2 column data.frame, plus the label column")
+    if not (df.dtypes[0].type is np.datetime64):
+        df = format_timestamp(df)
+
+    # parsed and sorted once for every step
+    timestamps = timestamps_to_ns(df.iloc[:, 0])
+    values = np.asarray(df.iloc[:, 1], dtype=np.float64)
+    order = np.argsort(timestamps, kind='mergesort')
+    timestamps, values = timestamps[order], values[order]
+    if labels is not None:
+        labels = labels[order]
+
+    if start is None:
+        start = timestamps[0] + 7 * DAY_NS
+    else:
+        start = int(np.asarray(start, dtype='M8[ns]').view('i8'))
+    first = -(-start // step_ns) * step_ns
+    evaluations = np.arange(first, timestamps[-1] + step_ns, step_ns, dtype=np.int64)
+    # a step sees the data up to and including its evaluation time
+    stops = np.searchsorted(timestamps, evaluations, side='right')
+
+    if history is not None:
+        history = int(np.asarray(history, dtype='m8[ns]').view('i8'))
+
+    workspaces = ThreadWorkspaces()
+
+    def run(i):
+        # nothing arrived, so nothing can fire
+        if i and stops[i] == stops[i - 1]:
+            return None
+        lookback = None if history is None else evaluations[i] - history
+        return _step(timestamps, values, stops[i], lookback, step, workspaces.workspace, kwargs)
+
+    began = time.time()
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(run, range(len(evaluations))))
+    else:
+        results = [run(i) for i in range(len(evaluations))]
+    elapsed = time.time() - began
+
+    alert_steps, alert_timestamps, alert_values = [], [], []
+    windows_run = observations = 0
+    for evaluation, result in zip(evaluations, results):
+        if result is None:
+            continue
+        # data that arrived in an earlier step is reported there
+        fired = result.timestamps > evaluation - step_ns
+        alert_steps.append(np.full(fired.sum(), evaluation, dtype=np.int64))
+        alert_timestamps.append(result.timestamps[fired])
+        alert_values.append(result.values[fired])
+        windows_run += len(result.window_stats)
+        observations += int(result.window_stats['num_obs'].sum())
+
+    alert_steps = np.concatenate(alert_steps) if alert_steps else np.empty(0, dtype=np.int64)
+    alert_timestamps = np.concatenate(alert_timestamps) if alert_timestamps else np.empty(0, dtype=np.int64)
+    alert_values = np.concatenate(alert_values) if alert_values else np.empty(0)
+    alerts = DataFrame({'step': alert_steps.view('M8[ns]'), 'timestamp': alert_timestamps.view('M8[ns]'),
+                        'anoms': alert_values}, columns=ALERT_COLUMNS)
+
+    precision = recall = None
+    if labels is not None:
+        replayed = timestamps > first - step_ns
+        labelled = set(timestamps[labels & replayed])
+        hits = len(labelled.intersection(alert_timestamps))
+        precision = hits / float(len(alert_timestamps)) if len(alert_timestamps) else None
+        recall = hits / float(len(labelled)) if labelled else None
+
+    return BacktestResult(alerts, len(evaluations), elapsed, observations, windows_run, precision, recall)
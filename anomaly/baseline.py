@@ -0,0 +1,173 @@
+import json
+from collections import namedtuple
+import numpy as np
+from date_utils import as_ns_array
+from esd import MAD_SCALE, critical_values
+
+FORMAT_VERSION = 1
+
+Scores = namedtuple('Scores', ['expected', 'statistic', 'anomalous'])
+
+
+class BaselineModel(object):
+    """
+    Seasonal baseline fitted from the last window of a detection run, for
+    scoring new observations between full S-H-ESD runs.
+
+    expected(t) = seasonal profile at t's phase + trend extrapolated linearly
+    from the end of the window. The score of an observation is its robust
+    z-score against that expectation, i.e. the deviation from the median
+    residual divided by the MAD of the residuals, with the anomalies the run
+    found left out. It is oriented like the ESD statistic for the run's
+    direction. An observation is anomalous when its score exceeds the ESD
+    critical value for one more anomaly than the run reported (and, with a
+    threshold, when it is also at or above the threshold value).
+
+    Scoring is a handful of vectorized NumPy operations. The baseline drifts
+    away from the data as the trend bends, so it is meant to be refitted on
+    every full detection run.
+
+    Build one with ``detect_ts(..., baseline=True).baseline``, or load a
+    saved one with ``BaselineModel.load``.
+    """
+
+    def __init__(self, origin, step, profile, trend_time, trend_level, trend_slope,
+                 center, scale, cutoff, one_tail=True, upper_tail=True, threshold=None):
+        # int64 nanoseconds of the profile's first phase and between observations
+        self.origin = int(origin)
+        self.step = int(step)
+        self.profile = np.asarray(profile, dtype=np.float64)
+        # trend(t) = trend_level + trend_slope * (t - trend_time), slope per nanosecond
+        self.trend_time = int(trend_time)
+        self.trend_level = float(trend_level)
+        self.trend_slope = float(trend_slope)
+        self.center = float(center)
+        self.scale = float(scale)
+        self.cutoff = float(cutoff)
+        self.one_tail = bool(one_tail)
+        self.upper_tail = bool(upper_tail)
+        self.threshold = None if threshold is None else float(threshold)
+
+    @classmethod
+    def fit(cls, timestamps, counts, seasonal, trend, anomalies, period, max_outliers,
+            alpha=0.05, one_tail=True, upper_tail=True, threshold=None):
+        """
+        Fit a baseline to one window of detect_anoms output.
+
+        timestamps : int64 nanoseconds of the regularly spaced (resampled) window
+        counts, seasonal, trend : the window's values and STL components
+        anomalies : positions in the window that S-H-ESD reported
+        period : observations per seasonal period
+        max_outliers : the ESD test's maximum number of anomalies for the window
+        """
+        timestamps = as_ns_array(timestamps)
+        counts = np.asarray(counts, dtype=np.float64)
+        seasonal = np.asarray(seasonal, dtype=np.float64)
+        trend = np.asarray(trend, dtype=np.float64)
+        n = len(timestamps)
+        if n < 2 * period:
+            raise ValueError("a baseline needs at least 2 periods worth of data")
+
+        step = int(timestamps[1] - timestamps[0])
+
+        # the seasonal component of the last full period, indexed by phase
+        origin = timestamps[n - period]
+        profile = seasonal[n - period:]
+
+        # least squares line through the trend of the last period
+        t = (timestamps[n - period:] - timestamps[-1]).astype(np.float64)
+        y = trend[n - period:]
+        finite = np.isfinite(y)
+        if finite.sum() > 1:
+            trend_slope, trend_level = np.polyfit(t[finite], y[finite], 1)
+        else:
+            trend_slope, trend_level = 0.0, np.nanmedian(trend)
+
+        clean = np.ones(n, dtype=bool)
+        clean[np.asarray(anomalies, dtype=np.int64)] = False
+        residual = (counts - seasonal - trend)[clean]
+        residual = residual[np.isfinite(residual)]
+        center = np.median(residual)
+        scale = np.median(np.abs(residual - center)) / MAD_SCALE
+
+        num_anoms = len(anomalies)
+        cutoff = critical_values(n, min(num_anoms, max_outliers - 1) + 1, alpha, one_tail)[-1]
+
+        return cls(origin, step, profile, timestamps[-1], trend_level, trend_slope,
+                   center, scale, cutoff, one_tail=one_tail, upper_tail=upper_tail,
+                   threshold=threshold)
+
+    def expected(self, timestamps):
+        """Seasonal profile plus extrapolated trend at each timestamp."""
+        timestamps = as_ns_array(timestamps)
+        phase = ((timestamps - self.origin) // self.step) % len(self.profile)
+        trend = self.trend_level + self.trend_slope * (timestamps - self.trend_time)
+        return self.profile[phase] + trend
+
+    def score(self, timestamps, values):
+        """
+        Score observations against the baseline.
+
+        returns
+
+        scores : Scores
+            ``expected`` values, the oriented robust z-score ``statistic`` and
+            the boolean ``anomalous`` flags, one per observation.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        expected = self.expected(timestamps)
+        deviation = values - expected - self.center
+
+        if not self.one_tail:
+            deviation = np.abs(deviation)
+        elif not self.upper_tail:
+            deviation = -deviation
+
+        if self.scale > 0:
+            statistic = deviation / self.scale
+        else:
+            # a constant history, anything off the baseline is infinitely unusual
+            statistic = np.where(deviation > 0, np.inf, 0.0)
+
+        anomalous = statistic > self.cutoff
+        if self.threshold is not None:
+            anomalous &= values >= self.threshold
+        return Scores(expected, statistic, anomalous)
+
+    def to_dict(self):
+        return {
+            'version': FORMAT_VERSION,
+            'origin': self.origin,
+            'step': self.step,
+            'profile': self.profile.tolist(),
+            'trend_time': self.trend_time,
+            'trend_level': self.trend_level,
+            'trend_slope': self.trend_slope,
+            'center': self.center,
+            'scale': self.scale,
+            'cutoff': self.cutoff,
+            'one_tail': self.one_tail,
+            'upper_tail': self.upper_tail,
+            'threshold': self.threshold
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        if d.get('version') != FORMAT_VERSION:
+            raise ValueError("unsupported baseline version %s" % d.get('version'))
+        d = dict(d)
+        del d['version']
+        return cls(**d)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def __repr__(self):
+        return '<BaselineModel period=%d step=%ds cutoff=%.3f>' % (
+            len(self.profile), self.step // 10**9, self.cutoff)
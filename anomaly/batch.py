@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from detect_ts import detect_ts
+from shard import as_shard
+from workspace import ThreadWorkspaces
+
+
+def preload(decomposition='r_stl'):
+    # import the detection stack, load the decomposition backend (starting R for r_stl) and the
+    # compiled kernels once, e.g. in the initializer of a worker process
+    import detect_anoms
+    import kernels
+    from decomposition import get_backend
+    get_backend(decomposition).load()
+    kernels.warm()
+
+
+def detect_many(series, max_workers=None, shard=None, **kwargs):
+    """
+    Run detect_ts over many series concurrently on a thread pool.
+
+    detect_ts never writes to its input, so the same DataFrame (or SeriesStore)
+    can appear several times in ``series`` or be read by other threads while
+    detection runs. The NumPy parts of the pipeline release the GIL; calls into
+    R are serialised by r_stl. Each thread reuses one Workspace for all the
+    series it detects on.
+
+    series : dict or sequence
+        DataFrames or SeriesStores, optionally keyed by a series id.
+
+    max_workers : int
+        Size of the thread pool, defaults to the number of CPUs.
+
+    shard : ShardSpec, 'index/count' or (index, count)
+        Only detect on the series whose ids hash to this shard, see
+        shard.shard_of. ``series`` must then be a dict.
+
+    kwargs
+        Passed through to detect_ts.
+
+    returns
+
+    results : dict or list
+        detect_ts results keyed like ``series``, or in input order.
+    """
+    if max_workers is None:
+        max_workers = cpu_count()
+    if 'workspace' in kwargs:
+        raise ValueError("detect_many gives each thread its own workspace")
+
+    shard = as_shard(shard)
+    if shard is not None:
+        if not isinstance(series, dict):
+            raise ValueError("sharding needs series keyed by id")
+        series = dict((key, item) for key, item in series.items() if key in shard)
+
+    if isinstance(series, dict):
+        keys = list(series.keys())
+        items = [series[key] for key in keys]
+    else:
+        keys = None
+        items = list(series)
+
+    workspaces = ThreadWorkspaces()
+
+    def detect(item):
+        return detect_ts(item, workspace=workspaces.workspace, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(detect, item) for item in items]
+        results = [future.result() for future in futures]
+
+    if keys is None:
+        return results
+    return dict(zip(keys, results))
@@ -0,0 +1,581 @@
+import argparse
+import copy
+import csv
+import glob
+import json
+import os
+import sys
+from concurrent.futures import as_completed
+from multiprocessing import Process, cpu_count
+
+import numpy as np
+import pandas as pd
+
+from date_utils import parse_timestamps
+from detect_ts import detect_ts
+from batch import preload
+from window_cache import DirectoryWindowCache
+from decomposition import backends, as_seasonal_periods
+from resample import GAP_FILL
+from partitioned import DEFAULT_BUDGET, Partitions, open_partitioned, group_partitions
+from arrow import ParquetAnomalyWriter, read_parquet_series, read_parquet_anomalies
+from shard import ShardSpec, shard_path
+from esd import EarlyStop, EARLY_STOP_MARGIN
+from worker_pool import WorkerPool
+
+INPUT_EXTENSIONS = ('.csv', '.npy', '.parquet')
+
+OUTPUT_COLUMNS = ['series', 'timestamp', 'anoms']
+
+
+def find_inputs(patterns):
+    """
+    Expand files, directories and glob patterns into a sorted list of CSV/NPY/Parquet paths.
+
+    Directories are searched recursively. Patterns that match nothing raise
+    ValueError rather than silently running on less data than asked for.
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                for name in files:
+                    if name.lower().endswith(INPUT_EXTENSIONS):
+                        paths.add(os.path.join(root, name))
+            continue
+
+        matches = glob.glob(pattern)
+        if not matches:
+            raise ValueError("no input files match %s" % pattern)
+        paths.update(path for path in matches if os.path.isfile(path))
+    return sorted(paths)
+
+
+def load_series(path, timestamp_column='timestamp', value_column='count'):
+    """
+    Read a CSV, NPY or Parquet file into (timestamps, values) arrays.
+
+    CSV and Parquet files need ``timestamp_column`` and ``value_column``, or
+    exactly two columns. NPY files hold either a structured array with those
+    fields, or a two-column array of epoch seconds and values.
+    """
+    if path.lower().endswith('.parquet'):
+        return read_parquet_series(path, timestamp_column, value_column)
+    if path.lower().endswith('.npy'):
+        data = np.load(path)
+        if data.dtype.names:
+            if timestamp_column not in data.dtype.names or value_column not in data.dtype.names:
+                raise ValueError("%s has no %s and %s fields" % (path, timestamp_column, value_column))
+            timestamps, values = data[timestamp_column], data[value_column]
+        elif data.ndim == 2 and data.shape[1] == 2:
+            timestamps, values = data[:, 0], data[:, 1]
+        else:
+            raise ValueError("%s must be a structured array or have two columns" % path)
+    else:
+        df = pd.read_csv(path)
+        if timestamp_column in df.columns and value_column in df.columns:
+            timestamps, values = df[timestamp_column].values, df[value_column].values
+        elif len(df.columns) == 2:
+            timestamps, values = df.iloc[:, 0].values, df.iloc[:, 1].values
+        else:
+            raise ValueError("%s has no %s and %s columns" % (path, timestamp_column, value_column))
+
+    return parse_timestamps(timestamps), np.asarray(values, dtype=np.float64)
+
+
+def read_records(stream):
+    """
+    Read newline-delimited JSON records into (series, timestamps, values) tuples.
+
+    A record is either a whole series, ``{"series": ..., "timestamps": [...],
+    "values": [...]}``, yielded as soon as it is read, or one observation,
+    ``{"series": ..., "timestamp": ..., "value": ...}``. Observations are
+    grouped by series and yielded at the end of the input.
+    """
+    observations = {}
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            series = record['series']
+            if 'values' in record:
+                yield series, record['timestamps'], record['values']
+            else:
+                timestamps, values = observations.setdefault(series, ([], []))
+                timestamps.append(record['timestamp'])
+                values.append(record['value'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError("bad record on line %d: %s" % (line_number, e))
+
+    for series in sorted(observations):
+        timestamps, values = observations[series]
+        yield series, timestamps, values
+
+
+def _detect(task):
+    # runs in a worker; returns the error instead of raising so one bad series can't stop the job
+    series, source, params, columns = task
+    try:
+        if isinstance(source, Partitions):
+            series_source = open_partitioned(source.paths, source.budget, *columns, **params)
+            result = detect_ts(series_source, **params)
+            return series, 'done', (result.timestamps, result.values, result.expected_values)
+        if isinstance(source, basestring):
+            timestamps, values = load_series(source, *columns)
+        else:
+            timestamps, values = parse_timestamps(source[0]), np.asarray(source[1], dtype=np.float64)
+        if len(timestamps) != len(values):
+            raise ValueError("timestamps and values must be the same length")
+
+        df = pd.DataFrame({'timestamp': timestamps.view('M8[ns]'), 'count': values},
+                          columns=['timestamp', 'count'])
+        result = detect_ts(df, **params)
+        return series, 'done', (result.timestamps, result.values, result.expected_values)
+    except Exception as e:
+        return series, 'error', '%s: %s' % (type(e).__name__, e)
+
+
+def read_manifest(path):
+    """Names of the series a manifest records as done."""
+    done = set()
+    if path is None or not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut short by an interrupted run
+                continue
+            if entry.get('status') == 'done':
+                done.add(entry['series'])
+    return done
+
+
+def _sync(f):
+    f.flush()
+    try:
+        os.fsync(f.fileno())
+    except (AttributeError, OSError, ValueError):
+        # not a real file, e.g. a pipe or an in-memory stream
+        pass
+
+
+class AnomalyWriter(object):
+    """
+    Appends the anomalies of each finished series to a CSV, then records the
+    series in the manifest.
+
+    Rows are flushed to disk before the manifest entry, so a series is only
+    skipped on resume once its anomalies are safely written. A run killed
+    between the two writes repeats that one series.
+
+    An output ending in .parquet is written as a row group per series
+    instead. A Parquet file can't be appended to or read before it is closed,
+    so it must not exist yet, and the manifest entries are held back until it
+    is closed.
+
+    The manifest of a ``shard`` starts with an entry naming the shard and
+    the output, relative to the manifest, for merge_shards to find.
+    """
+
+    def __init__(self, output, manifest=None, e_value=False, shard=None):
+        self.e_value = e_value
+        self.columns = OUTPUT_COLUMNS + (['expected_value'] if e_value else [])
+        self._parquet = None
+        self._pending = []
+
+        if output is not None and output.lower().endswith('.parquet'):
+            if os.path.exists(output):
+                raise ValueError("%s exists, and Parquet output can't be appended to" % output)
+            self._parquet = ParquetAnomalyWriter(output, e_value=e_value)
+            self._output = None
+            self._close_output = False
+        elif output is None or output == '-':
+            self._output = sys.stdout
+            self._close_output = False
+            write_header = True
+        else:
+            write_header = not os.path.exists(output) or os.path.getsize(output) == 0
+            self._output = open(output, 'ab')
+            self._close_output = True
+
+        if self._output is not None:
+            self._csv = csv.writer(self._output)
+            if write_header:
+                self._csv.writerow(self.columns)
+                _sync(self._output)
+
+        self._manifest = open(manifest, 'a') if manifest else None
+        if shard is not None and self._manifest is not None:
+            output = os.path.relpath(output, os.path.dirname(os.path.abspath(manifest)))
+            self._manifest.write(json.dumps({'status': 'started', 'shard': str(shard), 'output': output}) + '\n')
+            _sync(self._manifest)
+
+    def write(self, series, status, payload):
+        if status == 'done' and self._parquet is not None:
+            self._parquet.write(series, payload)
+            entry = {'series': series, 'status': status, 'anoms': len(payload[0])}
+        elif status == 'done':
+            timestamps, values, expected = payload
+            timestamps = pd.DatetimeIndex(timestamps)
+            # sub-second series keep their fractions, or merging would collapse anomalies within the same second
+            fmt = '%Y-%m-%d %H:%M:%S.%f' if np.any(timestamps.asi8 % 10**9) else '%Y-%m-%d %H:%M:%S'
+            rows = zip(
+                [series] * len(timestamps),
+                timestamps.strftime(fmt),
+                # repr keeps every digit, the csv module's str() rounds to 12
+                [repr(float(v)) for v in values]
+            )
+            if self.e_value:
+                rows = [row + (repr(float(e)),) for row, e in zip(rows, expected)]
+            self._csv.writerows(rows)
+            _sync(self._output)
+            entry = {'series': series, 'status': status, 'anoms': len(timestamps)}
+        else:
+            entry = {'series': series, 'status': status, 'error': payload}
+
+        if self._parquet is not None:
+            self._pending.append(entry)
+        elif self._manifest is not None:
+            self._manifest.write(json.dumps(entry) + '\n')
+            _sync(self._manifest)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            if self._manifest is not None:
+                self._manifest.writelines(json.dumps(entry) + '\n' for entry in self._pending)
+                _sync(self._manifest)
+        if self._close_output:
+            self._output.close()
+        if self._manifest is not None:
+            self._manifest.close()
+
+
+def run(tasks, writer, workers=1, log=None, decomposition='r_stl'):
+    """
+    Run (series, source, params, columns) tasks, writing each one as it finishes.
+    Worker processes load the ``decomposition`` backend when they start. A
+    series whose worker dies (e.g. R crashing on it) fails, and the run goes on.
+
+    Returns the number of series that failed.
+    """
+    failures = 0
+    pool = None
+    if workers > 1:
+        pool = WorkerPool(workers, initializer=preload, initargs=(decomposition,))
+        results = _completed(pool, tasks)
+    else:
+        results = (_detect(task) for task in tasks)
+
+    try:
+        for series, status, payload in results:
+            writer.write(series, status, payload)
+            if status != 'done':
+                failures += 1
+                if log is not None:
+                    log.write('%s failed: %s\n' % (series, payload))
+            elif log is not None:
+                log.write('%s: %d anomalies\n' % (series, len(payload[0])))
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    else:
+        if pool is not None:
+            pool.shutdown()
+    return failures
+
+
+def _completed(pool, tasks):
+    # results of the tasks on pool as they finish; a series whose worker died is an error like any other
+    futures = dict((pool.submit(_detect, task), task) for task in tasks)
+    for future in as_completed(futures):
+        error = future.exception()
+        if error is None:
+            yield future.result()
+        else:
+            yield futures[future][0], 'error', '%s: %s' % (type(error).__name__, error)
+
+
+def read_shard_manifest(path):
+    """
+    (shard, output, statuses) of a shard's manifest: its ShardSpec, the path
+    of its output, and the status of each series it ran, either 'done' or
+    the error. A series that was done once stays done.
+    """
+    shard = output = None
+    statuses = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('status') == 'started':
+                # a resumed shard starts again
+                shard = ShardSpec.parse(entry['shard'])
+                output = os.path.join(os.path.dirname(os.path.abspath(path)), entry['output'])
+            elif statuses.get(entry['series']) != 'done':
+                statuses[entry['series']] = 'done' if entry['status'] == 'done' else entry['error']
+    if shard is None:
+        raise ValueError("%s is not the manifest of a shard" % path)
+    return shard, output, statuses
+
+
+def read_anomalies(path):
+    """The rows of a CSV or Parquet output of detect as a DataFrame."""
+    if path.lower().endswith('.parquet'):
+        return read_parquet_anomalies(path)
+    df = pd.read_csv(path, dtype={'series': object})
+    df['timestamp'] = parse_timestamps(df['timestamp'].values).view('M8[ns]')
+    return df
+
+
+def merge_shards(manifests, output, manifest=None):
+    """
+    Combine the outputs of the shards of a run into one output, and manifest.
+
+    Every shard of the run must be there. Only the anomalies of series their
+    shard's manifest records as done are kept, once each, so the rows a
+    resumed shard repeated or left behind are dropped. Series are written in
+    order, and ``output`` and ``manifest`` are replaced whole, so merging
+    again after resuming a shard is safe.
+
+    Returns the number of series that failed.
+    """
+    shards = {}
+    for path in manifests:
+        shard, shard_output, statuses = read_shard_manifest(path)
+        if shard in shards:
+            raise ValueError("more than one manifest is of shard %s" % shard)
+        shards[shard] = (shard_output, statuses)
+    counts = sorted(set(shard.count for shard in shards))
+    if len(counts) != 1:
+        raise ValueError("the manifests are of runs split %s ways" % ', '.join(map(str, counts)))
+    missing = sorted(set(range(counts[0])) - set(shard.index for shard in shards))
+    if missing:
+        raise ValueError("missing shards %s of %d" % (', '.join(map(str, missing)), counts[0]))
+
+    frames, statuses = [], {}
+    for shard in sorted(shards):
+        shard_output, shard_statuses = shards[shard]
+        done = set(series for series, status in shard_statuses.items() if status == 'done')
+        df = read_anomalies(shard_output)
+        frames.append(df[df['series'].isin(done)])
+        statuses.update(shard_statuses)
+    anomalies = pd.concat(frames, ignore_index=True)
+    e_value = all('expected_value' in df.columns for df in frames)
+    anomalies = anomalies.drop_duplicates(['series', 'timestamp'], keep='last')
+    anomalies = anomalies.sort_values(['series', 'timestamp'])
+    rows = dict(iter(anomalies.groupby('series')))
+
+    # written aside and moved into place, so a failed merge leaves the last one as it was
+    partial = ['%s.partial%s' % os.path.splitext(output), manifest + '.partial' if manifest else None]
+    for path in partial:
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+    writer = AnomalyWriter(partial[0], manifest=partial[1], e_value=e_value)
+    failures = 0
+    try:
+        for series in sorted(statuses):
+            if statuses[series] != 'done':
+                writer.write(series, 'error', statuses[series])
+                failures += 1
+                continue
+            df = rows.get(series, anomalies.iloc[:0])
+            writer.write(series, 'done', (df['timestamp'].values.view('i8'), df['anoms'].values,
+                                          df['expected_value'].values if e_value else None))
+    finally:
+        writer.close()
+    os.rename(partial[0], output)
+    if manifest:
+        os.rename(partial[1], manifest)
+    return failures
+
+
+def _shard_main(args):
+    sys.exit(detect_command(args))
+
+
+def detect_shards(args, workers):
+    """
+    Run detect as ``args.shards`` local processes, each one a shard like a
+    node of a multi-node run, and merge their outputs into ``args.output``.
+    Shard outputs and manifests are kept beside the merged ones, so a rerun
+    resumes each shard.
+    """
+    if args.output is None or args.output == '-':
+        raise ValueError("--shards needs an --output file")
+    if args.shard:
+        raise ValueError("--shard and --shards can't be combined")
+    if not args.inputs or args.inputs == ['-']:
+        raise ValueError("--shards can't read stdin")
+    manifest = args.manifest or args.output + '.manifest'
+
+    processes, manifests = [], []
+    for index in range(args.shards):
+        shard = ShardSpec(index, args.shards)
+        shard_args = copy.copy(args)
+        shard_args.shard = str(shard)
+        shard_args.shards = None
+        shard_args.output = shard_path(args.output, shard)
+        shard_args.manifest = shard_path(manifest, shard)
+        shard_args.workers = max(1, workers // args.shards)
+        manifests.append(shard_args.manifest)
+        processes.append(Process(target=_shard_main, args=(shard_args,)))
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    failures = merge_shards(manifests, args.output, args.manifest)
+    return 1 if failures or any(process.exitcode for process in processes) else 0
+
+
+def detect_command(args):
+    params = {
+        'max_anoms': args.max_anoms,
+        'direction': args.direction,
+        'alpha': args.alpha,
+        'only_last': args.only_last,
+        'threshold': args.threshold,
+        'e_value': args.e_value,
+        'longterm': args.longterm,
+        'piecewise_median_period_weeks': args.piecewise_median_period_weeks,
+        'decomposition': args.decomposition,
+        'max_gap': args.max_gap,
+        'gap_fill': args.gap_fill,
+        'period': args.period,
+        'approximate': args.approximate,
+        'early_stop': args.early_stop,
+        'seasonal_periods': args.seasonal_periods
+    }
+    if args.window_cache:
+        params['cache'] = DirectoryWindowCache(args.window_cache)
+    columns = (args.timestamp_column, args.value_column)
+    workers = args.workers or cpu_count()
+    if args.shards:
+        return detect_shards(args, workers)
+    shard = ShardSpec.parse(args.shard) if args.shard else None
+    if shard is not None and (args.output is None or args.output == '-' or args.manifest is None):
+        raise ValueError("--shard needs an --output file and a --manifest, to merge")
+    done = read_manifest(args.manifest)
+
+    if not args.inputs or args.inputs == ['-']:
+        sources = ((series, (timestamps, values))
+                   for series, timestamps, values in read_records(sys.stdin))
+    elif args.partitioned:
+        budget = args.memory_budget * 2**20 // workers
+        sources = ((series, Partitions(paths, budget))
+                   for series, paths in sorted(group_partitions(find_inputs(args.inputs)).items()))
+    else:
+        sources = ((path, path) for path in find_inputs(args.inputs))
+
+    # read every input up front, so a bad record fails the run before any work starts
+    tasks = [(series, source, params, columns)
+             for series, source in sources
+             if series not in done and (shard is None or series in shard)]
+
+    writer = AnomalyWriter(args.output, manifest=args.manifest, e_value=args.e_value, shard=shard)
+    try:
+        failures = run(tasks, writer, workers=workers,
+                       log=sys.stderr if args.verbose else None,
+                       decomposition=args.decomposition)
+    finally:
+        writer.close()
+    return 1 if failures else 0
+
+
+def merge_command(args):
+    return 1 if merge_shards(args.manifests, args.output, args.manifest) else 0
+
+
+def serve_command(args):
+    import service
+    return service.main(args.service_args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='anomaly', description='Seasonal hybrid ESD anomaly detection')
+    commands = parser.add_subparsers(dest='command')
+
+    detect = commands.add_parser('detect', help='detect anomalies in many series',
+                                 description='Detect anomalies in CSV/NPY/Parquet files, or in newline-delimited '
+                                             'JSON records read from stdin.')
+    detect.add_argument('inputs', nargs='*',
+                        help="files, directories or glob patterns; omit or use - to read stdin")
+    detect.add_argument('-o', '--output', default=None,
+                        help='CSV file the anomalies are appended to (default: stdout), or a new .parquet file')
+    detect.add_argument('--manifest', default=None,
+                        help='file recording finished series; rerunning with it skips them')
+    detect.add_argument('-j', '--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    detect.add_argument('--timestamp-column', default='timestamp')
+    detect.add_argument('--value-column', default='count')
+    detect.add_argument('--max-anoms', type=float, default=0.10)
+    detect.add_argument('--direction', choices=['pos', 'neg', 'both'], default='pos')
+    detect.add_argument('--alpha', type=float, default=0.05)
+    detect.add_argument('--only-last', choices=['day', 'hr'], default=None)
+    detect.add_argument('--threshold', choices=['med_max', 'p95', 'p99'], default=None)
+    detect.add_argument('--e-value', action='store_true')
+    detect.add_argument('--longterm', action='store_true')
+    detect.add_argument('--piecewise-median-period-weeks', type=int, default=2)
+    detect.add_argument('--decomposition', choices=backends(), default='r_stl',
+                        help='seasonal decomposition backend (default: r_stl)')
+    detect.add_argument('--max-gap', type=int, default=0,
+                        help='interpolate runs of up to this many missing observations')
+    detect.add_argument('--gap-fill', choices=GAP_FILL, default='linear')
+    detect.add_argument('--period', type=lambda v: v if v == 'auto' else int(v), default=None,
+                        help="observations per seasonal period, or 'auto'; analyses the series at "
+                             "its own sampling interval")
+    detect.add_argument('--seasonal-periods', type=as_seasonal_periods, default=None,
+                        help="remove several seasonal cycles in one MSTL decomposition: 'weekly' for the daily "
+                             "period and a week of it, or comma separated periods in observations")
+    detect.add_argument('--approximate', action='store_true',
+                        help='locate the ESD median and MAD from a sample, for series of millions of points')
+    detect.add_argument('--early-stop', type=EarlyStop.parse, default=None, metavar='PATIENCE[:MARGIN]',
+                        help='stop S-H-ESD after PATIENCE steps in a row with the test statistic MARGIN (default '
+                             '%g) below its critical value; faster, but not the exact generalized ESD test'
+                             % EARLY_STOP_MARGIN)
+    detect.add_argument('--partitioned', action='store_true',
+                        help='each directory of input files is one series, split into partitions (e.g. a file '
+                             'per day) that are read a window at a time')
+    detect.add_argument('--memory-budget', type=int, default=DEFAULT_BUDGET // 2**20,
+                        help='MiB of memory for --partitioned series, shared between the workers')
+    detect.add_argument('--window-cache', default=None,
+                        help='directory caching per-window results, so reruns only detect changed windows')
+    detect.add_argument('--shard', default=None,
+                        help="only detect on the series of shard index/count (e.g. 0/4), by a hash of their "
+                             "names; needs --output and --manifest, and 'anomaly merge' combines the shards")
+    detect.add_argument('--shards', type=int, default=None,
+                        help='split the run into this many shards run as local processes, then merge them')
+    detect.add_argument('--verbose', action='store_true')
+    detect.set_defaults(run=detect_command)
+
+    merge = commands.add_parser('merge', help='merge the outputs of a sharded run',
+                                description='Combine the outputs of every shard of a detect --shard run, '
+                                            'found through their manifests, into one output.')
+    merge.add_argument('manifests', nargs='+', help='manifests of the shards')
+    merge.add_argument('-o', '--output', required=True,
+                       help='CSV or .parquet file of the merged anomalies, replaced if it exists')
+    merge.add_argument('--manifest', default=None, help='merged manifest, replaced if it exists')
+    merge.set_defaults(run=merge_command)
+
+    serve = commands.add_parser('serve', help='run the local HTTP detection service',
+                                add_help=False)
+    serve.add_argument('service_args', nargs=argparse.REMAINDER)
+    serve.set_defaults(run=serve_command)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.run(args)
+    except ValueError as e:
+        parser.exit(2, 'anomaly: error: %s\n' % e)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
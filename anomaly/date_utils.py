@@ -3,6 +3,11 @@ from re import match
 from heapq import nlargest
 import pytz
 import numpy as np
+from pandas import DatetimeIndex
+
+MINUTE_NS = 60 * 10**9
+HOUR_NS = 60 * MINUTE_NS
+DAY_NS = 24 * HOUR_NS
 
 def datetimes_from_ts(column):
     return column.map(
@@ -12,37 +17,46 @@ def date_format(column, format):
     return column.map(lambda datestring: datetime.strptime(datestring, format))
 
 def format_timestamp(indf, index=0):
+    # returns a new frame with the timestamp column parsed, indf itself is left untouched
     if indf.dtypes[0].type is np.datetime64:
         return indf
 
     column = indf.iloc[:,index]
 
     if match("^\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}:\\d{2} \\+\\d{4}$",
-             column[0]):
+             column.iloc[0]):
         column = date_format(column, "%Y-%m-%d %H:%M:%S")
-    elif match("^\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}:\\d{2}$", column[0]):
+    elif match("^\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}:\\d{2}$", column.iloc[0]):
         column = date_format(column, "%Y-%m-%d %H:%M:%S")
-    elif match("^\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}$", column[0]):
+    elif match("^\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}$", column.iloc[0]):
         column = date_format(column, "%Y-%m-%d %H:%M")
-    elif match("^\\d{2}/\\d{2}/\\d{2}$", column[0]):
+    elif match("^\\d{2}/\\d{2}/\\d{2}$", column.iloc[0]):
         column = date_format(column, "%m/%d/%y")
-    elif match("^\\d{2}/\\d{2}/\\d{4}$", column[0]):
+    elif match("^\\d{2}/\\d{2}/\\d{4}$", column.iloc[0]):
         column = date_format(column, "%Y%m%d")
-    elif match("^\\d{4}\\d{2}\\d{2}$", column[0]):
+    elif match("^\\d{4}\\d{2}\\d{2}$", column.iloc[0]):
         column = date_format(column, "%Y/%m/%d/%H")
-    elif match("^\\d{10}$", column[0]):
+    elif match("^\\d{10}$", column.iloc[0]):
         column = datetimes_from_ts(column)
 
-    indf.iloc[:,index] = column
+    outdf = indf.copy()
+    outdf.iloc[:,index] = column
 
-    return indf
+    return outdf
 
 def get_gran(tsdf, index=0):
     col = tsdf.iloc[:,index]
     n = len(col)
 
     largest, second_largest = nlargest(2, col)
-    gran = int(round((largest - second_largest) / np.timedelta64(1, 's')))
+    return _gran_from_seconds((largest - second_largest) / np.timedelta64(1, 's'))
+
+def get_gran_ns(timestamps):
+    # same as get_gran for sorted int64 nanosecond timestamps
+    return _gran_from_seconds((timestamps[-1] - timestamps[-2]) / 1e9)
+
+def _gran_from_seconds(seconds):
+    gran = int(round(seconds))
 
     if gran >= 86400:
         return "day"
@@ -54,3 +68,25 @@ def get_gran(tsdf, index=0):
         return "sec"
     else:
         return "ms"
+
+def timestamps_to_ns(column):
+    # int64 nanoseconds since the epoch, the representation used by the array paths
+    return np.asarray(DatetimeIndex(column).asi8, dtype=np.int64)
+
+def parse_timestamps(timestamps):
+    # int64 nanoseconds from external input: numbers are epoch seconds, anything else is parsed as dates
+    timestamps = np.asarray(timestamps)
+    if timestamps.dtype.kind in 'iuf':
+        return (timestamps * 10**9).astype(np.int64)
+    if timestamps.dtype.kind == 'M':
+        return timestamps.astype('M8[ns]').view(np.int64)
+    return timestamps_to_ns(timestamps)
+
+def as_ns_array(timestamps):
+    # int64 nanoseconds from internal input: integers are already nanoseconds
+    timestamps = np.asarray(timestamps)
+    if timestamps.dtype.kind == 'i':
+        return timestamps.astype(np.int64, copy=False)
+    if timestamps.dtype.kind == 'M':
+        return timestamps.astype('M8[ns]').view(np.int64)
+    return timestamps_to_ns(timestamps)
@@ -1,9 +1,14 @@
 ## Decompose.py
 ## produce a time series decomposition
+##
+## Every step works on whole arrays: the series is laid out as a cycles x period matrix (one column per
+## position in the seasonal cycle), the seasonal smoothers are weighted sums of shifted rows of that matrix,
+## and the Henderson moving average is a convolution plus a matrix of end weights. There are no per-period or
+## per-element Python loops, only loops over the handful of filter weights.
 
 import pandas as pd
 import numpy as np
-from Henderson import Henderson
+from math import pi
 
 
 # --- A selection of seasonal smoothing weights, from which you can select
@@ -79,187 +84,301 @@ def Decompose(s, periods=None, model='multiplicative',
     # --- sanity checks
     if periods is None:
         raise ValueError('The periods parameter is an integer or a Series of integers')
-    if not isinstance(s, pd.core.frame.Series):
+    if not isinstance(s, pd.Series):
         raise TypeError('The s parameter should be a pandas Series')
     if not(s.index.is_monotonic and s.index.is_unique):
         raise ValueError('The index for the s parameter should be unique and sorted')
     if any(s.isnull()) or not all(np.isfinite(s)):
         raise ValueError('The s parameter contains NA or infinite values')
-
-    # --- initialise
-    result = pd.DataFrame(s)
-    result.columns = ['Original']
+    if model not in ('multiplicative', 'additive'):
+        raise ValueError("The model parameter should be 'multiplicative' or 'additive'")
 
     # --- determine the period
-    if isinstance(periods, pd.core.frame.Series):
+    if isinstance(periods, pd.Series):
         if not (len(s) == len(periods) and all(s.index == periods.index)) :
             raise ValueError('The s and periods parameters must have the same index')
-        result['period'] = periods
+        labels = np.asarray(periods)
         periods = len(periods.unique())
     else:
         periods = int(periods)
-        result['period'] = pd.Series(range(len(result)), index=s.index) % periods
+        labels = np.arange(len(s)) % max(periods, 1)
     if periods < 2:
         raise ValueError('The periods parameter should be >= 2')
     if len(s) < (periods * 2) + 1:
         raise ValueError('The s parameter is not long enough to decompose')
 
+    columns = _decompose(np.asarray(s, dtype=np.float64), labels, periods, model,
+                         constantSeasonal, seasonalSmoother)
+    columns['period'] = labels
+
+    result = pd.DataFrame(columns, index=s.index, columns=[
+        'Original', 'period', '1stTrendEst', '1stSeasonalEst', '2ndSeasonalEst',
+        '3rdSeasonalEst', '1stSeasAdjEst', '2ndTrendEst', '4thSeasonalEst', 'Seasonal',
+        'SeasAdj', 'Trend', 'Irregular'])
+    return (result)
+
+
+def _decompose(x, labels, periods, model, constantSeasonal, seasonalSmoother):
+    # the decomposition proper, on arrays, returning a dict of the step by step columns
+    if model == 'multiplicative':
+        remove = np.divide
+    else:
+        remove = np.subtract
+
+    cycles = _Cycles(labels)
+
     # --- settle the length of the Henderson moving average
     h = max(periods, 7) # ABS uses 13-term HMA for monthly and 7-term for quarterly
     if h % 2 == 0 :
         h += 1 # we need an odd number
 
     ### --- On to the decomposition process --- ###
+    c = {'Original': x}
 
     # --- 1 - derive an initial estimate for the trend component
-    result['1stTrendEst'] = pd.rolling_mean(s, window=periods+1,
-        min_periods=periods+1, center=True)
-    # Note: rolling mean leaves NA values at the start/end of the trend estimate.
+    c['1stTrendEst'] = _centred_mean(x, periods + 1)
+    # Note: the moving average leaves NA values at the start/end of the trend estimate.
 
     # --- 2 - preliminary estimate of the seasonal component
-    if model == 'multiplicative':
-        result['1stSeasonalEst'] = result['Original'] / result['1stTrendEst']
-    else:
-        result['1stSeasonalEst'] = result['Original'] - result['1stTrendEst']
+    c['1stSeasonalEst'] = remove(x, c['1stTrendEst'])
 
     # --- 3 - smooth the seasonal
-    result = _smoothSeasonalComponent(result, periods=periods,
-        constantSeasonal=constantSeasonal, seasonalSmoother=seasonalSmoother,
-        columnToBeSmoothed='1stSeasonalEst', newColumn='2ndSeasonalEst')
+    c['2ndSeasonalEst'] = cycles.unstack(_smooth_seasonal(
+        cycles.stack(c['1stSeasonalEst']), constantSeasonal, seasonalSmoother))
 
     # --- 4 - extend the smoothed seasonal estimate to full scale
-    if any(result['2ndSeasonalEst'].isnull()) :
-        result = _extendSeries(result, periods=periods,
-            columnToBeExtended='2ndSeasonalEst', newColumn='3rdSeasonalEst')
+    if np.isnan(c['2ndSeasonalEst']).any():
+        c['3rdSeasonalEst'] = cycles.unstack(_extend(cycles.stack(c['2ndSeasonalEst'])))
     else:
-        result['3rdSeasonalEst'] = result['2ndSeasonalEst']
+        c['3rdSeasonalEst'] = c['2ndSeasonalEst']
 
     # --- 5 - preliminary estimate of the seasonally adjusted data
-    if model == 'multiplicative':
-        result['1stSeasAdjEst'] = result['Original'] / result['3rdSeasonalEst']
-    else:
-        result['1stSeasAdjEst'] = result['Original'] - result['3rdSeasonalEst']
+    c['1stSeasAdjEst'] = remove(x, c['3rdSeasonalEst'])
 
     # --- 6 - a better estimate of the trend
-    result['2ndTrendEst'] =  Henderson(result['1stSeasAdjEst'], h)
+    c['2ndTrendEst'] = henderson(c['1stSeasAdjEst'], h)
 
     # --- 7 - final estimate of the seasonal component
-    if model == 'multiplicative':
-        result['4thSeasonalEst'] = result['Original'] / result['2ndTrendEst']
-    else:
-        result['4thSeasonalEst'] = result['Original'] - result['2ndTrendEst']
-
-    result = _smoothSeasonalComponent(result, periods=periods,
-        constantSeasonal=constantSeasonal, seasonalSmoother=seasonalSmoother,
-        columnToBeSmoothed='4thSeasonalEst', newColumn='Seasonal')
+    c['4thSeasonalEst'] = remove(x, c['2ndTrendEst'])
+    c['Seasonal'] = cycles.unstack(_smooth_seasonal(
+        cycles.stack(c['4thSeasonalEst']), constantSeasonal, seasonalSmoother))
 
     # --- 8 - final estimate of the seasonally adjusted series
-    if model == 'multiplicative':
-        result['SeasAdj'] = result['Original'] / result['Seasonal']
-    else:
-        result['SeasAdj'] = result['Original'] - result['Seasonal']
+    c['SeasAdj'] = remove(x, c['Seasonal'])
 
     # --- 9 - final trend estimate
-    result['Trend'] =  Henderson(result['SeasAdj'], h)
+    c['Trend'] = henderson(c['SeasAdj'], h)
 
     # --- 10 - final irregular
-    if model == 'multiplicative':
-        result['Irregular'] = result['SeasAdj'] / result['Trend']
-    else:
-        result['Irregular'] = result['SeasAdj'] - result['Trend']
+    c['Irregular'] = remove(c['SeasAdj'], c['Trend'])
 
     # --- 11 - our job here is done
-    return (result)
-
-
-# --- apply seasonal smoother
-def _smoothSeasonalComponent(result, periods, constantSeasonal, seasonalSmoother,
-    columnToBeSmoothed, newColumn):
-
-    # get the key smoothing constants
-    if not constantSeasonal:
-        kS = len(seasonalSmoother)
-        lenS = (len(seasonalSmoother) * 2) -1
-        centralS = seasonalSmoother[len(seasonalSmoother)-1]
-
-    # establish an empty return column ...
-    result[newColumn] = np.repeat(np.nan, len(result))
-
-    # populate the return column ...
-    for u in result['period'].unique() :
-
-        # get each of of the seasonals
-        thisSeason = result[result['period'] == u][columnToBeSmoothed]
-
-        # smooth to a constant seasonal value
-        if constantSeasonal:
-            thisSeasonSmoothed = pd.Series(np.repeat(thisSeason.mean(skipna=True),
-                len(thisSeason)), index=thisSeason.index)
-
-        # smooth to a slowly changing seasonal value
-        else:
-            # drop NA values which result from step 1 in the decomp process
-            thisSeason = thisSeason.dropna()
+    return c
 
-            # apply the seasonalSmoother
-            thisSeasonSmoothed = pd.rolling_apply(thisSeason, window=lenS,
-                func=lambda x: (x * centralS).sum(), min_periods=lenS, center=True)
 
-            # for short series the above process results in no data ... find a simple mean
-            if all(thisSeasonSmoothed.isnull()) :
-                # same treatment as constant seasonal value above
-                thisSeasonSmoothed = pd.Series(np.repeat(thisSeason.mean(skipna=True),
-                    len(thisSeason)), index=thisSeason.index)
-
-            # handle the end-point problem ...
-            for i in range(kS-1) :
-                if np.isnan(thisSeasonSmoothed.iat[i]) :
-                    thisSeasonSmoothed.iat[i] = (thisSeason.iloc[0: i+kS] *
-                        (seasonalSmoother[i][::-1])).sum() # note: reversed order at start
-
-            for i in range(len(thisSeason)-1, len(thisSeason)-kS, -1) :
-                if np.isnan(thisSeasonSmoothed.iat[i]) :
-                    thisSeasonSmoothed.iat[i] = (
-                        thisSeason.iloc[i-(kS-1):len(thisSeason)] *
-                        seasonalSmoother[len(thisSeason)-1-i]).sum()
-
-        # package up season by season ...
-        result[newColumn] = result[newColumn].where(result[newColumn].notnull(),
-            other=thisSeasonSmoothed)
-
-    return (result)
-
-
-# --- extend seasonal components to the full length of series
-def _extendSeries(result, periods, columnToBeExtended, newColumn):
-
-    result[newColumn] = result[columnToBeExtended].copy()
-
-    def fillup(result, fill, startPoint, endPoint):
-        i = startPoint
-        while True:
-            p = result.index[i]
-            result[newColumn].iat[i] = fill[newColumn].at[result['period'].iat[i]]
-            if p >= endPoint:
-                break
-            i += 1
-
-    # back-cast
-    if np.isnan(result.iat[0, result.columns.get_loc(newColumn)]):
-        fill = pd.DataFrame(result[newColumn].dropna().iloc[0:periods])
-        fill['period'] = result['period'][fill.index[0]:fill.index[len(fill)-1]]
-        endPoint = fill.index[0] - 1
-        fill.index = fill['period']
-        fillup(result=result, fill=fill, startPoint=0, endPoint=endPoint)
-
-    # forward-cast
-    if np.isnan(result.iat[len(result)-1, result.columns.get_loc(newColumn)]):
-        fill = result[newColumn].dropna()
-        fill = pd.DataFrame(fill[len(fill)-periods:len(fill)])
-        fill['period'] = result['period'][fill.index[0]:fill.index[len(fill)-1]]
-        startPoint = result.index.get_loc(fill.index[len(fill)-1] + 1)
-        fill.index = fill['period']
-        endPoint = result.index[len(result)-1]
-        fillup(result=result, fill=fill, startPoint=startPoint, endPoint=endPoint)
-
-    return (result)
+def stl(data, ns='periodic', np=None, model='additive', seasonalSmoother=s3x5):
+    """
+    Decompose() with the call signature and output of r_stl.stl, so detect_anoms
+    can use it in place of R's STL.
+
+    data : pandas.Series
+        Without NAs.
+
+    ns : 'periodic' or anything else
+        'periodic' keeps the seasonal component constant across cycles, like
+        STL's s.window="periodic". Otherwise it is smoothed across cycles with
+        ``seasonalSmoother``.
+
+    np : int
+        Number of observations per period.
+
+    returns
+
+    data : pandas.DataFrame
+        The seasonal, trend, and remainder components
+    """
+    period = np
+    if period is None:
+        raise ValueError("must supply period length for time series decomposition")
+
+    result = Decompose(data, periods=period, model=model,
+                       constantSeasonal=(ns == 'periodic'), seasonalSmoother=seasonalSmoother)
+    return pd.DataFrame({
+        'seasonal': result['Seasonal'],
+        'trend': result['Trend'],
+        'remainder': result['Irregular']
+    }, index=data.index, columns=['seasonal', 'trend', 'remainder'])
+
+
+class _Cycles(object):
+    # lays a series out as a (cycle, period) matrix, with one column per period label
+    # and NaN where a cycle has no observation for a label (e.g. a trailing partial cycle)
+
+    def __init__(self, labels):
+        codes, _ = pd.factorize(labels)
+        n = len(codes)
+
+        # occurrence of each observation within its label, i.e. its cycle
+        order = np.argsort(codes, kind='mergesort')
+        sorted_codes = codes[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(sorted_codes)) + 1]
+        counts = np.diff(np.r_[starts, n])
+        occurrence = np.empty(n, dtype=np.int64)
+        occurrence[order] = np.arange(n) - np.repeat(starts, counts)
+
+        self.rows = occurrence
+        self.cols = codes
+        self.shape = (int(counts.max()) if n else 0, len(counts))
+
+    def stack(self, x):
+        m = np.full(self.shape, np.nan)
+        m[self.rows, self.cols] = x
+        return m
+
+    def unstack(self, m):
+        return m[self.rows, self.cols]
+
+
+def _centred_mean(x, window):
+    # centred moving average, NaN where the window doesn't fit (as pandas' rolling mean with center=True)
+    y = np.full(len(x), np.nan)
+    if len(x) >= window:
+        csum = np.cumsum(np.r_[0.0, x])
+        start = window // 2
+        y[start:start + len(x) - window + 1] = (csum[window:] - csum[:-window]) / window
+    return y
+
+
+def _compact(m):
+    # move every column's non-NaN values to the top, keeping their order
+    order = np.argsort(np.isnan(m), axis=0, kind='mergesort')
+    return np.take_along_axis(m, order, axis=0), order
+
+
+def _smooth_seasonal(m, constantSeasonal, seasonalSmoother):
+    # --- apply the seasonal smoother down each column of a cycles x period matrix
+    valid = ~np.isnan(m)
+    lengths = valid.sum(axis=0)
+    rows = np.arange(m.shape[0])[:, None]
+
+    with np.errstate(invalid='ignore'):
+        means = np.nansum(np.where(valid, m, 0), axis=0) / lengths
+
+    # smooth to a constant seasonal value
+    if constantSeasonal:
+        return np.where(valid, means, np.nan)
+
+    # smooth to a slowly changing seasonal value, on the values without the NAs from step 1
+    compact, order = _compact(m)
+    kS = len(seasonalSmoother)
+    lenS = (kS * 2) - 1
+    centralS = seasonalSmoother[kS - 1]
+
+    smoothed = np.full(m.shape, np.nan)
+    inner = m.shape[0] - lenS + 1
+    if inner > 0:
+        acc = np.zeros((inner, m.shape[1]))
+        for j, w in enumerate(centralS):
+            acc += w * compact[j:j + inner]
+        # NaN padding below each column's values leaves NaN where the window runs past the end
+        smoothed[kS - 1:kS - 1 + inner] = acc
+
+    # handle the end-point problem, with the reversed end weights at the start
+    ends = lengths[None, :] - 1 - rows
+    backwards = np.take_along_axis(compact, np.maximum(ends, 0), axis=0)
+    backwards[ends < 0] = np.nan
+    cols = np.arange(m.shape[1])
+    for i in range(kS - 1):
+        w = seasonalSmoother[i][::-1][:, None]
+        if len(w) > m.shape[0]:
+            break
+        smoothed[i] = (compact[:len(w)] * w).sum(axis=0)
+        at = lengths - 1 - i
+        fits = at >= 0
+        smoothed[at[fits], cols[fits]] = (backwards[:len(w)] * w).sum(axis=0)[fits]
+
+    # for short series the above process results in no data ... find a simple mean
+    short = lengths < lenS
+    smoothed[:, short] = means[short]
+    smoothed[rows >= lengths[None, :]] = np.nan
+
+    # put the values back in the cells they came from
+    out = np.full(m.shape, np.nan)
+    np.put_along_axis(out, order, smoothed, axis=0)
+    return out
+
+
+def _extend(m):
+    # --- extend seasonal components to the full length of series: back-cast the first value
+    # of each column over its leading NaNs and forward-cast the last over its trailing NaNs
+    valid = ~np.isnan(m)
+    rows = np.arange(m.shape[0])[:, None]
+    cols = np.arange(m.shape[1])
+    first = np.argmax(valid, axis=0)
+    last = m.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+    m = np.where(rows < first, m[first, cols], m)
+    return np.where(rows > last, m[last, cols], m)
+
+
+def henderson_weights(n):
+    """Symmetric weights of the n-term Henderson moving average (n odd)."""
+    if n < 3 or n % 2 == 0:
+        raise ValueError('The Henderson length should be an odd number >= 3')
+    m = (n - 1) // 2
+    p = m + 2.0
+    j = np.arange(-m, m + 1, dtype=np.float64)
+    return (315 * ((p - 1) ** 2 - j ** 2) * (p ** 2 - j ** 2) * ((p + 1) ** 2 - j ** 2) *
+            (3 * p ** 2 - 16 - 11 * j ** 2) /
+            (8 * p * (p ** 2 - 1) * (4 * p ** 2 - 1) * (4 * p ** 2 - 9) * (4 * p ** 2 - 25)))
+
+
+def henderson_end_weights(n, ic=None):
+    """
+    Musgrave's asymmetric weights for the last (n-1)/2 points of an n-term Henderson
+    moving average.
+
+    Row k holds the weights for a point with k later observations. They apply to
+    the m+1+k observations from m before the point to the end of the series and
+    are right-aligned, so every row applies to the last n-1 observations, with
+    zeros in the unused leading entries. ``ic`` is the irregular to trend-cycle ratio
+    the weights assume, by default the X-11 choices of 1.0 for up to 9 terms, 3.5
+    for up to 13 and 4.5 beyond.
+    """
+    if ic is None:
+        ic = 1.0 if n <= 9 else (3.5 if n <= 13 else 4.5)
+    w = henderson_weights(n)
+    m = (n - 1) // 2
+    beta = 4.0 / (pi * ic * ic)
+
+    i = np.arange(1, n + 1, dtype=np.float64)
+    weights = np.zeros((m, n - 1))
+    for k in range(m):
+        M = m + 1 + k
+        centre = (M + 1) / 2.0
+        missing = w[M:]
+        u = (w[:M] + missing.sum() / M +
+             (i[:M] - centre) * beta / (1 + M * (M - 1) * (M + 1) * beta / 12.0) *
+             ((i[M:] - centre) * missing).sum())
+        weights[k, n - 1 - M:] = u
+    return weights
+
+
+def henderson(x, n):
+    """n-term Henderson moving average of x, with Musgrave's end weights at both ends."""
+    x = np.asarray(x, dtype=np.float64)
+    N = len(x)
+    if n > N:
+        raise ValueError('The series is shorter than the Henderson moving average')
+
+    m = (n - 1) // 2
+    y = np.empty(N)
+    y[m:N - m] = np.convolve(x, henderson_weights(n), mode='valid')
+    if m == 0:
+        return y
+
+    # every end point is a dot product of its row of end weights with the last n-1
+    # observations, or the first n-1 in reverse at the start
+    ends = henderson_end_weights(n)
+    y[N - 1 - np.arange(m)] = ends.dot(x[N - (n - 1):])
+    y[:m] = ends.dot(x[:n - 1][::-1])
+    return y
@@ -0,0 +1,237 @@
+import threading
+import numpy as np
+import pandas as pd
+import kernels
+
+# Seasonal decomposition backends detect_anoms can use to get the remainder S-H-ESD runs on.
+# Every backend is called as decompose(data, period) with a pandas.Series and the number of
+# observations per period, and returns a DataFrame of seasonal, trend and remainder columns on
+# data's index. Backends are loaded on first use, so one that needs R (or any other optional
+# dependency) only imports it when it's picked. mstl runs any of them over several periods.
+
+
+class Backend(object):
+    """
+    A named decomposition and what it can do.
+
+    robust : the seasonal component resists outliers in the data
+    supports_nan : missing values (e.g. gaps the resample step fills in) are
+        allowed and come out as NaN in the remainder
+    releases_gil : the work happens in NumPy calls or compiled kernels that
+        release the GIL, so threads running detect_ts in parallel don't
+        serialise on it. A callable is asked each time, for backends that only
+        release it when the kernels are enabled.
+    """
+
+    def __init__(self, name, load, robust=False, supports_nan=False, releases_gil=False,
+                 description=''):
+        self.name = name
+        self.robust = robust
+        self.supports_nan = supports_nan
+        self._releases_gil = releases_gil
+        self.description = description
+        self._load = load
+        self._decompose = None
+        self._lock = threading.Lock()
+
+    @property
+    def releases_gil(self):
+        if callable(self._releases_gil):
+            return bool(self._releases_gil())
+        return self._releases_gil
+
+    def load(self):
+        # import the backend, e.g. in the initializer of a worker process
+        with self._lock:
+            if self._decompose is None:
+                self._decompose = self._load()
+        return self._decompose
+
+    def __call__(self, data, period):
+        decompose = self._decompose or self.load()
+        return decompose(data, period)
+
+    def __repr__(self):
+        return '<Backend %s robust=%s supports_nan=%s releases_gil=%s>' % (
+            self.name, self.robust, self.supports_nan, self.releases_gil)
+
+
+_backends = {}
+
+
+def register_backend(name, load, robust=False, supports_nan=False, releases_gil=False,
+                     description=''):
+    """
+    Register a decomposition backend under ``name``.
+
+    load : callable
+        Called without arguments the first time the backend is used, returns
+        the decompose(data, period) function.
+    """
+    backend = Backend(name, load, robust=robust, supports_nan=supports_nan,
+                      releases_gil=releases_gil, description=description)
+    _backends[name] = backend
+    return backend
+
+
+def get_backend(name):
+    if name not in _backends:
+        raise ValueError("decomposition options are: %s." % ' | '.join(backends()))
+    return _backends[name]
+
+
+def backends():
+    return sorted(_backends)
+
+
+def _load_r_stl():
+    import r_stl
+    r_stl.preload()
+    return lambda data, period: r_stl.stl(data, "periodic", np=period)
+
+
+def _kernels_enabled():
+    # stl's LOESS fits only leave the GIL when they run in the compiled kernel
+    return kernels.ENABLED
+
+
+def _load_stl():
+    from stl import stl
+    return lambda data, period: stl(data, "periodic", np=period)
+
+
+def _load_decompose():
+    from decompose import stl
+    return lambda data, period: stl(data, "periodic", np=period, model='additive')
+
+
+def _extend(trend, half, period):
+    # the half periods at the ends have no centred window, continue the line through the
+    # nearest period of the trend instead
+    n = len(trend)
+    if n < 2 * period:
+        return trend
+    for fitted, ends in ((np.arange(half, half + period), np.arange(half)),
+                         (np.arange(n - half - period, n - half), np.arange(n - half, n))):
+        fitted = fitted[np.isfinite(trend[fitted])]
+        if len(fitted) > 1:
+            slope, level = np.polyfit(fitted, trend[fitted], 1)
+            trend[ends] = level + slope * ends
+    return trend
+
+
+def _centred_mean(x, valid, period):
+    # mean over a centred period (a 2 x period average for even periods), leaving out NaNs
+    n = len(x)
+    half = period // 2
+    i = np.arange(n)
+    lo = np.maximum(i - half, 0)
+    hi = np.minimum(i + half + 1, n)
+    x = np.where(valid, x, 0.0)
+    valid = valid.astype(np.float64)
+    sums = np.concatenate([[0.0], np.cumsum(x)])
+    counts = np.concatenate([[0.0], np.cumsum(valid)])
+    total = sums[hi] - sums[lo]
+    count = counts[hi] - counts[lo]
+    if period % 2 == 0:
+        # the two ends of the window have half weight
+        first = i - half >= 0
+        last = i + half < n
+        total[first] -= 0.5 * x[i[first] - half]
+        count[first] -= 0.5 * valid[i[first] - half]
+        total[last] -= 0.5 * x[i[last] + half]
+        count[last] -= 0.5 * valid[i[last] + half]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        trend = np.where(count > 0, total / count, np.nan)
+    return _extend(trend, half, period)
+
+
+def periodic(data, period):
+    """
+    The fast path: trend is a centred moving average over one period, extended
+    linearly over the first and last half period, and the seasonal component is
+    the median of each phase of the detrended series, centred on zero. One pass
+    over the data and no iterations.
+    """
+    x = np.asarray(data, dtype=np.float64)
+    n = len(x)
+    valid = ~np.isnan(x)
+    trend = _centred_mean(x, valid, period)
+
+    cycles = -(-n // period)
+    detrended = np.full(cycles * period, np.nan)
+    detrended[:n] = x - trend
+    detrended = detrended.reshape(cycles, period)
+    # a phase with no observations at all is left at 0
+    observed = ~np.isnan(detrended).all(axis=0)
+    profile = np.zeros(period)
+    profile[observed] = np.nanmedian(detrended[:, observed], axis=0)
+    profile -= profile.mean()
+    seasonal = profile[np.arange(n) % period]
+
+    return pd.DataFrame({
+        'seasonal': seasonal,
+        'trend': trend,
+        'remainder': x - seasonal - trend
+    }, index=data.index, columns=['seasonal', 'trend', 'remainder'])
+
+
+def as_seasonal_periods(periods):
+    """
+    None, 'weekly' (the daily period and a week of it), or a tuple of periods
+    of at least 2 observations from a sequence or a comma separated string.
+    """
+    if periods is None or periods == 'weekly':
+        return periods
+    if isinstance(periods, basestring):
+        periods = periods.split(',')
+    try:
+        periods = tuple(sorted(set(int(period) for period in periods)))
+    except (TypeError, ValueError):
+        raise ValueError("seasonal_periods must be 'weekly' or periods in observations, not %r" % (periods,))
+    if not periods or periods[0] < 2:
+        raise ValueError("seasonal periods must be at least 2 observations")
+    return periods
+
+
+def mstl(data, periods, decompose, iterations=2):
+    """
+    MSTL (Bandara, Hyndman & Bergmeir, 2021): several seasonal components, e.g.
+    daily and weekly, removed in one decomposition with any single period
+    backend. Starting from the shortest period, each component is refitted by
+    ``decompose`` on the series with the others removed, ``iterations`` times
+    over, on one deseasonalized buffer; the trend is that of the last fit.
+
+    returns
+
+    decomposition : pandas.DataFrame
+        seasonal (the sum of the components), trend and remainder like the
+        backends, plus a seasonal_<period> column per period.
+    """
+    periods = sorted(periods)
+    x = np.asarray(data, dtype=np.float64)
+    seasonals = np.zeros((len(periods), len(x)))
+    deseasonalized = x.copy()
+    for _ in range(iterations):
+        for i, period in enumerate(periods):
+            deseasonalized += seasonals[i]
+            fit = decompose(pd.Series(deseasonalized, index=data.index), period)
+            seasonals[i] = fit['seasonal']
+            deseasonalized -= seasonals[i]
+    trend = np.asarray(fit['trend'], dtype=np.float64)
+    seasonal = seasonals.sum(axis=0)
+
+    columns = ['seasonal', 'trend', 'remainder'] + ['seasonal_%d' % period for period in periods]
+    frame = dict(zip(columns[3:], seasonals))
+    frame.update(seasonal=seasonal, trend=trend, remainder=x - seasonal - trend)
+    return pd.DataFrame(frame, index=data.index, columns=columns)
+
+
+register_backend('r_stl', _load_r_stl, robust=True,
+                 description="R's stl(s.window='periodic', robust=TRUE) through rpy2, the reference")
+register_backend('stl', _load_stl, robust=True, releases_gil=_kernels_enabled,
+                 description="NumPy port of R's stl, same decomposition without R")
+register_backend('periodic', lambda: periodic, robust=True, supports_nan=True, releases_gil=True,
+                 description='phase medians around a moving average, the fastest')
+register_backend('decompose', _load_decompose,
+                 description='X-11 style moving average decomposition')
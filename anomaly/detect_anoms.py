@@ -10,43 +10,72 @@
  #	 one_tail: If TRUE only positive or negative going anomalies are detected depending on if upper_tail is TRUE or FALSE.
  #	 upper_tail: If TRUE and one_tail is also TRUE, detect only positive going (right-tailed) anomalies. If FALSE and one_tail is TRUE, only detect negative (left-tailed) anomalies.
  #	 verbose: Additionally printing for debugging.
+ #	 dtype: float64 or float32, the precision the remainder and ESD statistics are computed in. Critical values
+ #	        are always computed in float64, see esd.py for when float32 is safe.
+ #	 decomposition: Name of the seasonal decomposition backend, see decomposition.py. Defaults to R's STL.
+ #	 max_gap: Fill runs of up to this many missing observations (missing timestamps or NAs) before decomposing.
+ #	          Filled values are never reported as anomalies. Defaults to 0, longer gaps are an error unless the
+ #	          decomposition supports NaN.
+ #	 gap_fill: 'linear' or 'seasonal' interpolation of the filled gaps, see resample.fill_gaps.
+ #	 step: Interval of the regular grid timestamps are resampled onto, in nanoseconds. Defaults to a minute, hour
+ #	       or day for 1440, 24 or 7 observations per period.
+ #	 approximate: Locate the median and MAD of the ESD steps from a sample of the remainder rather than recompute
+ #	              them over all of it at every step, for remainders of millions of points. The statistics are
+ #	              still exact, see esd.py.
+ #	 early_stop: An EarlyStop, stop the ESD loop once R_i has stayed well below lambda_i for a number of steps. Not
+ #	             the generalized ESD test any more, see esd.py.
+ #	 workspace: A Workspace to hold the remainder and the ESD working set instead of allocating them, see workspace.py.
+ #	 seasonal_periods: Periods to remove together in one MSTL decomposition (see decomposition.mstl) rather than
+ #	                   num_obs_per_period alone, e.g. (24, 168) for daily and weekly cycles in hourly data.
  # Returns:
- #   A list containing the anomalies (anoms) and decomposition components (stl).
+ #   A list containing the anomalies (anoms) and decomposition components (stl), plus the seasonal, trend and
+ #   remainder components (components) and the resampled counts (counts).
 
 import pandas as ps
 import numpy as np
 import statsmodels.api as sm
-from date_utils import format_timestamp
+from date_utils import format_timestamp, DAY_NS, HOUR_NS, MINUTE_NS
 from math import trunc, sqrt
 from scipy.stats import t as student_t
-from itertools import groupby
-from r_stl import stl
+from resample import regular_grid, fill_gaps
+from decomposition import get_backend, mstl
+from esd import esd, esd_approx, check_dtype, nanmedian
 import sys
-from statsmodels.robust.scale import mad
+
+# the grid timestamps are resampled onto, by observations per period
+RESAMPLE_STEP = {
+    1440: MINUTE_NS,
+    24: HOUR_NS,
+    7: DAY_NS
+}
 
 def detect_anoms(data, k=0.49, alpha=0.05, num_obs_per_period=None,
                  use_decomp=True, use_esd=False, one_tail=True,
-                 upper_tail=True, verbose=False):
+                 upper_tail=True, verbose=False, dtype=np.float64, decomposition='r_stl',
+                 max_gap=0, gap_fill='linear', step=None, approximate=False,
+                 early_stop=None, workspace=None, seasonal_periods=None):
     if num_obs_per_period is None:
         raise ValueError("must supply period length for time series decomposition")
 
+    dtype = check_dtype(dtype)
+    decompose = get_backend(decomposition)
+
     num_obs = len(data)
 
     # Check to make sure we have at least two periods worth of data for anomaly context
-    if num_obs < num_obs_per_period * 2:
+    if num_obs < max(seasonal_periods or [num_obs_per_period]) * 2:
         raise ValueError("Anom detection needs at least 2 periods worth of data")
 
     # Check if our timestamps are posix
     posix_timestamp = data.dtypes[0].type is np.datetime64
 
-    # run length encode result of isnull, check for internal nulls
-    if (len(map(lambda x: x[0], list(groupby(ps.isnull(
-            ps.concat([ps.Series([np.nan]),
-                       data.iloc[:,1],
-                       ps.Series([np.nan])])))))) > 3):
-        raise ValueError("Data contains non-leading NAs. We suggest replacing NAs with interpolated values (see na.approx in Zoo package).")
+    timestamps = np.asarray(data.iloc[:,0])
+    if posix_timestamp:
+        timestamps = timestamps.view(np.int64)
+        # rows without a timestamp are dropped like leading and trailing NAs
+        present = timestamps != np.iinfo(np.int64).min
     else:
-        data = data.dropna()
+        present = np.ones(len(timestamps), dtype=bool)
 
     # -- Step 1: Decompose data. This returns a univarite remainder which will be used for anomaly detection. Optionally, we might NOT decompose.
 
@@ -54,18 +83,29 @@ def detect_anoms(data, k=0.49, alpha=0.05, num_obs_per_period=None,
     #    data_decomp <- stl(ts(data[[2L]], frequency = num_obs_per_period),
     #                       s.window = "periodic", robust = TRUE)
 
-    data = data.set_index('timestamp')
+    # Lay the observations out on a regular grid, integer indexed series (detect_vec) are taken as evenly spaced.
+    # Missing observations and NAs are NaN on the grid, except at the ends where they are dropped.
+    if posix_timestamp:
+        if step is None:
+            if num_obs_per_period not in RESAMPLE_STEP:
+                raise ValueError("must supply the sampling interval for %d observations per period" % num_obs_per_period)
+            step = RESAMPLE_STEP[num_obs_per_period]
+    else:
+        step = 1
+    grid, grid_values = regular_grid(timestamps[present], np.asarray(data.iloc[:,1])[present], step)
 
-    # TODO clean this up
-    resample_period = {
-        1440: 'T',
-        24: 'H',
-        7: 'D'
-    }
-    data = data.resample(resample_period[num_obs_per_period])
+    # fill the short gaps, the rest are left for the decomposition if it can handle them
+    grid_values, filled = fill_gaps(grid_values, max_gap, gap_fill, num_obs_per_period)
+    if not decompose.supports_nan and np.isnan(grid_values).any():
+        raise ValueError("Data contains non-leading NAs or gaps. We suggest replacing NAs with interpolated values (see max_gap and gap_fill), or a decomposition that supports NaN (see decomposition.py).")
 
+    index = ps.DatetimeIndex(grid.view('M8[ns]')) if posix_timestamp else ps.Index(grid)
+    data = ps.DataFrame({'count': grid_values}, index=index)
 
-    decomp = stl(data['count'], "periodic", np=num_obs_per_period)
+    if seasonal_periods:
+        decomp = mstl(data['count'], seasonal_periods, decompose)
+    else:
+        decomp = decompose(data['count'], num_obs_per_period)
 
 #    data_decomp = stl(data, ns, np=None, nt=None, nl=None, isdeg=0, itdeg=1, ildeg=1,
 #        nsjump=None, ntjump=None, nljump=None, ni=2, no=0, fulloutput=False)
@@ -76,16 +116,20 @@ def detect_anoms(data, k=0.49, alpha=0.05, num_obs_per_period=None,
     # decomposition = sm.tsa.seasonal_decompose(data['count'])
 
     # Remove the seasonal component, and the median of the data to create the univariate remainder
+    counts = np.asarray(data['count'], dtype=dtype)
+    seasonal = np.asarray(decomp['seasonal'], dtype=dtype)
+    if workspace is None:
+        remainder = counts - seasonal - np.nanmedian(counts)
+    else:
+        remainder = np.subtract(counts, seasonal, out=workspace.get('remainder', len(counts), dtype))
+        remainder -= nanmedian(counts, workspace)
+    # filled values shape the decomposition but can't be anomalies themselves
+    remainder[filled] = np.nan
 
-    d = {
-        'timestamp': data.index,
-        'count': data['count'] - decomp['seasonal'] - data['count'].median()
-    }
-    data = ps.DataFrame(d)
-
+    # Store the smoothed seasonal component, plus the trend component for use in determining the "expected values" option
     p = {
         'timestamp': decomp.index,
-        'count': (decomp['trend'] + decomp['seasonal']).truncate().convert_objects(convert_numeric=True)
+        'count': np.asarray(decomp['trend'], dtype=dtype) + seasonal
     }
     data_decomp = ps.DataFrame(p)
 
@@ -98,80 +142,23 @@ def detect_anoms(data, k=0.49, alpha=0.05, num_obs_per_period=None,
     if max_outliers == 0:
         raise ValueError("With longterm=TRUE, AnomalyDetection splits the data into 2 week periods by default. You have %d observations in a period, which is too few. Set a higher piecewise_median_period_weeks." % num_obs)
 
-    ## Define values and vectors.
-    n = len(data.iloc[:,0])
-    R_idx = range(max_outliers)
-
-    # if posix_timestamp:
-    #     R_idx = datetimes_from_ts(data.iloc[:,1)
-    # else:
-
-    num_anoms = 0
-
-    # Compute test statistic until r=max_outliers values have been
-    # removed from the sample.
-    for i in range(1, max_outliers + 1):
-        # logging?
-        #        if(verbose) message(paste(i,"/", max_outliers,"completed"))
-
-        if one_tail:
-            if upper_tail:
-                ares = data['count'] - data['count'].median()
-            else:
-                ares = data['count'].median() - data['count']
-        else:
-#            print 'median', data['count'].median()
-            ares = (data['count'] - data['count'].median()).abs()
-
-#        print list(ares)
-        # with open('data_count', 'w+') as f:
-        #     import json
-        #     json.dump(list(data['count']), f)
-
-
-        # protect against constant time series
-        data_sigma = mad(data['count'])
-        if data_sigma == 0:
-            break
-
-#        print 'data_sigma', data_sigma
-#        print ares
-        ares = ares / float(data_sigma)
-
-        R = ares.max()
-#        print 'R', R
-#        sys.exit()
-
-
-        temp_max_idx = ares[ares == R].index.tolist()[0]
-
-        R_idx[i - 1] = temp_max_idx
-
-        data = data[data.index != R_idx[i - 1]]
-
-        if one_tail:
-            p = 1 - alpha / float(n - i + 1)
-        else:
-            p = 1 - alpha / float(2 * (n - i + 1))
-
-        t = student_t.ppf(p, (n - i - 1))
-        lam = t * (n - i) / float(sqrt((n - i - 1 + t**2) * (n - i + 1)))
-
-#        print(map(str,(i, p, t, R, lam)))
-
-        if R > lam:
-            num_anoms = i
-
-#    print 'num_anoms'
-#    print num_anoms
-#    sys.exit()
+    # Run the generalized ESD test on the remainder, the array core handles the removal loop
+    if approximate:
+        R_idx = esd_approx(remainder, max_outliers, alpha=alpha, one_tail=one_tail, upper_tail=upper_tail,
+                           dtype=dtype, early_stop=early_stop)
+    else:
+        R_idx = esd(remainder, max_outliers, alpha=alpha, one_tail=one_tail, upper_tail=upper_tail,
+                    dtype=dtype, early_stop=early_stop, workspace=workspace)
 
-    if num_anoms > 0:
-        R_idx = R_idx[:num_anoms]
+    if len(R_idx) > 0:
+        R_idx = data.index[R_idx].tolist()
     else:
         R_idx = None
 
     return {
         'anoms': R_idx,
-        'stl': data_decomp
+        'stl': data_decomp,
+        # the full decomposition and the resampled counts, used to fit a BaselineModel
+        'components': decomp,
+        'counts': counts
     }
@@ -0,0 +1,287 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import cpu_count
+import threading
+from detect_ts import detect_ts
+from shard import as_shard
+
+# asyncio on Python 3, the trollius backport on Python 2. Everything below is
+# written with callbacks rather than async/await so it runs on both.
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:
+    class StopAsyncIteration(Exception):
+        pass
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def _get_executor(executor):
+    global _default_executor
+    if executor is not None:
+        return executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=cpu_count())
+        return _default_executor
+
+
+def _check_asyncio():
+    if asyncio is None:
+        raise ImportError("detect_ts_async needs asyncio (or trollius on Python 2)")
+
+
+def detect_ts_async(df, executor=None, timeout=None, semaphore=None, loop=None, **kwargs):
+    """
+    Awaitable counterpart of detect_ts that runs the detection on an executor.
+
+    df
+        DataFrame or SeriesStore, as for detect_ts.
+
+    executor : concurrent.futures.Executor
+        Where detect_ts runs. A ProcessPoolExecutor keeps the work off the
+        event loop's process entirely. Defaults to a shared thread pool with
+        one thread per CPU.
+
+    timeout : float
+        Seconds to wait for the result, counting any wait for the semaphore,
+        before the returned future fails with asyncio.TimeoutError. A job
+        that already started keeps running to completion in its worker, but
+        its result is discarded.
+
+    semaphore : asyncio.Semaphore
+        Held while the job is queued or running, so several callers can
+        share a cap on in-flight jobs.
+
+    kwargs
+        Passed through to detect_ts.
+
+    returns
+
+    future : asyncio.Future
+        Resolves to the detect_ts result. Cancelling it cancels the job if it
+        hasn't started yet.
+    """
+    _check_asyncio()
+    loop = loop or asyncio.get_event_loop()
+    executor = _get_executor(executor)
+    result = asyncio.Future(loop=loop)
+
+    def release(_):
+        if semaphore is None:
+            return
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            # the loop was closed while the worker was still running
+            pass
+
+    def expire():
+        if not result.done():
+            result.set_exception(asyncio.TimeoutError())
+
+    if timeout is not None:
+        # armed before the semaphore is waited for, so a job queued behind it times out too
+        handle = loop.call_later(timeout, expire)
+        result.add_done_callback(lambda _: handle.cancel())
+
+    def finish(job):
+        if result.done():
+            return
+        if job.cancelled():
+            result.cancel()
+        elif job.exception() is not None:
+            result.set_exception(job.exception())
+        else:
+            result.set_result(job.result())
+
+    def start(acquired=None):
+        if acquired is not None and acquired.cancelled():
+            return
+        if result.done():
+            # cancelled or timed out while waiting for the semaphore
+            release(None)
+            return
+
+        work = executor.submit(detect_ts, df, **kwargs)
+        # the semaphore is released when the worker is really done, not when we stop waiting
+        work.add_done_callback(release)
+        job = asyncio.wrap_future(work, loop=loop)
+        job.add_done_callback(finish)
+        # cancelled or timed out: cancel the job if it hasn't started
+        result.add_done_callback(lambda _: job.cancel())
+
+    if semaphore is None:
+        start()
+    else:
+        acquiring = asyncio.ensure_future(semaphore.acquire(), loop=loop)
+        acquiring.add_done_callback(start)
+        result.add_done_callback(lambda _: acquiring.cancel())
+
+    return result
+
+
+class DetectionStream(object):
+    """
+    Results of detect_many_async, in the order the series finish.
+
+    Supports ``async for key, result in stream`` and ``async with stream``
+    on Python 3. ``next_result()`` returns the same futures as ``__anext__``
+    for callers without async syntax.
+
+    Series are pulled from the input lazily. A new job only starts once
+    the number of running jobs plus finished results that haven't been
+    consumed yet is below ``max_in_flight``, so a slow consumer holds back the
+    producers instead of buffering everything.
+    """
+
+    def __init__(self, series, executor=None, max_in_flight=None, timeout=None,
+                 semaphore=None, return_exceptions=False, loop=None, shard=None, **kwargs):
+        _check_asyncio()
+        self._loop = loop or asyncio.get_event_loop()
+        self._executor = _get_executor(executor)
+        self._max_in_flight = max_in_flight or cpu_count()
+        self._timeout = timeout
+        self._semaphore = semaphore or asyncio.Semaphore(self._max_in_flight)
+        self._return_exceptions = return_exceptions
+        self._kwargs = kwargs
+
+        shard = as_shard(shard)
+        if isinstance(series, dict):
+            self._items = iter(series.items())
+        elif shard is not None:
+            raise ValueError("sharding needs series keyed by id")
+        else:
+            self._items = enumerate(series)
+        if shard is not None:
+            self._items = ((key, item) for key, item in self._items if key in shard)
+
+        self._pending = set()
+        self._done = deque()
+        self._waiters = deque()
+        self._exhausted = False
+        self._closed = False
+
+    def _fill(self):
+        while not self._exhausted and not self._closed and \
+                len(self._pending) + len(self._done) < self._max_in_flight:
+            try:
+                key, df = next(self._items)
+            except StopIteration:
+                self._exhausted = True
+                break
+
+            job = detect_ts_async(df, executor=self._executor, timeout=self._timeout,
+                                  semaphore=self._semaphore, loop=self._loop, **self._kwargs)
+            self._pending.add(job)
+            job.add_done_callback(partial(self._on_done, key))
+
+    def _on_done(self, key, job):
+        self._pending.discard(job)
+        if self._closed:
+            return
+        self._done.append((key, job))
+        self._deliver()
+
+    def _deliver(self):
+        while self._waiters and self._done:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+
+            key, job = self._done.popleft()
+            if job.cancelled():
+                error = asyncio.CancelledError()
+            else:
+                error = job.exception()
+
+            if error is None:
+                waiter.set_result((key, job.result()))
+            elif self._return_exceptions:
+                waiter.set_result((key, error))
+            else:
+                waiter.set_exception(error)
+
+        # refill after consuming, so a slot only frees up when a result is taken
+        self._fill()
+
+        if self._closed or (self._exhausted and not self._pending and not self._done):
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_exception(StopAsyncIteration())
+
+    def next_result(self):
+        """Future resolving to the next (key, result) pair, failing with StopAsyncIteration at the end."""
+        waiter = asyncio.Future(loop=self._loop)
+        self._waiters.append(waiter)
+        self._fill()
+        self._deliver()
+        return waiter
+
+    def cancel(self):
+        """Stop pulling new series and cancel every job that hasn't finished."""
+        self._closed = True
+        for job in list(self._pending):
+            job.cancel()
+        self._done.clear()
+        self._deliver()
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self.next_result()
+
+    def __aenter__(self):
+        entered = asyncio.Future(loop=self._loop)
+        entered.set_result(self)
+        return entered
+
+    def __aexit__(self, exc_type, exc, tb):
+        self.cancel()
+        exited = asyncio.Future(loop=self._loop)
+        exited.set_result(False)
+        return exited
+
+
+def detect_many_async(series, executor=None, max_in_flight=None, timeout=None,
+                      semaphore=None, return_exceptions=False, loop=None, shard=None, **kwargs):
+    """
+    Stream detect_ts results for many series as each one finishes.
+
+        async for key, result in detect_many_async(frames, max_in_flight=8, timeout=30):
+            ...
+
+    series : dict or iterable
+        DataFrames or SeriesStores. Keys are the dict keys, or positions for
+        other iterables, which are consumed lazily.
+
+    max_in_flight : int
+        Cap on jobs queued or running at once, defaults to the number of CPUs.
+
+    timeout : float
+        Per-series timeout in seconds.
+
+    return_exceptions : bool
+        Yield (key, exception) for failed or timed out series instead of
+        raising from the iteration.
+
+    shard : ShardSpec, 'index/count' or (index, count)
+        Only detect on the series of a dict whose keys hash to this shard.
+
+    The remaining arguments are as for detect_ts_async.
+    """
+    return DetectionStream(series, executor=executor, max_in_flight=max_in_flight,
+                           timeout=timeout, semaphore=semaphore,
+                           return_exceptions=return_exceptions, loop=loop, shard=shard, **kwargs)
@@ -34,6 +34,46 @@
 #' 99th percentile of the daily max values (p99).
 #' @param title Title for the output plot.
 #' @param verbose Enable debug messages
+#' @param dtype \code{np.float64 | np.float32}. float32 halves the memory of the windows, the remainder and
+#' the ESD working set. Critical values are still computed in float64; see esd.py for the accuracy bounds.
+#' @param cache Window cache, any object with \code{get(key)} and item assignment such as a dict or a
+#' \code{DirectoryWindowCache}. Each window's anomalies are stored under a key made of the window bounds and a
+#' hash of its data and the detection parameters, so a rerun only runs S-H-ESD on windows whose data changed,
+#' typically just the trailing window of a growing series with \code{longterm}.
+#' @param baseline Fit a \code{BaselineModel} to the most recent window and return it as the result's
+#' \code{baseline}, to score new observations cheaply until the next detection run.
+#' @param decomposition Seasonal decomposition backend: \code{'r_stl'} (R's STL, the default), \code{'stl'} (the
+#' same STL in NumPy, no R needed), \code{'periodic'} (phase medians around a moving average, the fastest and the
+#' only one that allows gaps) or \code{'decompose'} (X-11 style moving averages). See decomposition.py for their
+#' capabilities and to register others.
+#' @param max_gap Fill runs of up to this many missing observations (missing timestamps or NAs) by interpolation
+#' before decomposing; filled values are never reported as anomalies. Defaults to 0: gaps are an error unless the
+#' decomposition supports NaN.
+#' @param period Observations per seasonal period. By default it follows from the granularity: 1440 for minutely,
+#' 24 for hourly and 7 for daily data, with secondly data summed to minutes first. Set it, or set \code{'auto'} to
+#' detect it from the autocorrelation of the values, to analyse the series at its own sampling interval instead,
+#' e.g. for secondly or millisecond data.
+#' @param gap_fill \code{'linear' | 'seasonal'}. Interpolate filled gaps linearly, or follow the same stretch of
+#' the neighbouring period.
+#' @param threshold_sketch A \code{QuantileSketch} of the daily max values to take the \code{threshold} from instead
+#' of the series, e.g. the merged \code{daily_max_sketch} of every shard of a series detected in parts.
+#' @param approximate Locate the median and MAD of each S-H-ESD step from a sample of the window's remainder,
+#' rather than recompute them over all of it at every step; for windows of millions of observations. The
+#' anomalies are those of the exact test up to rounding, see esd.py.
+#' @param early_stop \code{EarlyStop(patience, margin)}, or \code{'patience[:margin]'}. Stop each S-H-ESD run after
+#' \code{patience} consecutive steps with R_i below lambda_i - \code{margin} instead of running all
+#' \code{max_anoms} steps. This is no longer the generalized ESD test, which looks at every step: an anomaly
+#' that only clears its critical value after such a streak is missed. See esd.py for how often that happened on the
+#' reference data, and the speedups.
+#' @param workspace A \code{Workspace} whose buffers hold the remainder and the S-H-ESD working set of each window,
+#' instead of allocating them per call. Reuse one across calls, one per thread; see workspace.py.
+#' @param seasonal_periods \code{'weekly'}, or seasonal periods in observations. Remove several seasonal cycles in
+#' one MSTL decomposition (with the \code{decomposition} backend for each) rather than \code{period} alone, so that
+#' e.g. weekend effects don't end up in the remainder. \code{'weekly'} removes the daily period and a week of it,
+#' (1440, 10080) for minutely data or (24, 168) for hourly data. Every window needs at least two of the longest
+#' period, more than two for the STL backends, and with fewer than 4 each phase of the longest one is fitted from
+#' so few observations that it absorbs part of the noise, shrinking the MAD; so use a
+#' \code{piecewise_median_period_weeks} of at least 4 with \code{longterm} and \code{'weekly'}.
 #' @return The returned value is a list with the following components.
 #' @return \item{anoms}{Data frame containing timestamps, values, and optionally expected values.}
 #' @return \item{plot}{A graphical object if plotting was requested by the user. The plot contains
@@ -60,16 +100,33 @@
 #' @export
 #'
 from pandas import DataFrame, to_datetime
-from pandas.lib import Timestamp
 import numpy as np
-from date_utils import format_timestamp, get_gran, date_format, datetimes_from_ts
-from collections import namedtuple
-from detect_anoms import detect_anoms
+from date_utils import format_timestamp, get_gran, get_gran_ns, date_format, datetimes_from_ts, \
+    timestamps_to_ns, DAY_NS, HOUR_NS, MINUTE_NS
+from period import detect_period, sampling_interval
+from windows import Direction, detect_window, locate
+from results import DetectionResult
+from series_store import SeriesStore
+from partitioned import PartitionedSeries
+from arrow import ArrowSeries, is_arrow
+from esd import check_dtype, as_early_stop
+from window_cache import window_key
+from baseline import BaselineModel
+from decomposition import get_backend, as_seasonal_periods
+from resample import GAP_FILL
+from sketch import QuantileSketch, THRESHOLD_QUANTILES, daily_max_sketch
 import datetime
 from math import ceil
 import sys
 
-Direction = namedtuple('Direction', ['one_tail', 'upper_tail'])
+WEEK_NS = 7 * DAY_NS
+
+# the sampling interval of each granularity with a default period
+GRAN_STEP = {
+    'min': MINUTE_NS,
+    'hr': HOUR_NS,
+    'day': DAY_NS
+}
 
 def message(s):
     # actually log something?
@@ -79,22 +136,41 @@ def detect_ts(df, max_anoms=0.10, direction='pos',
               alpha=0.05, only_last=None, threshold=None,
               e_value=False, longterm=False, piecewise_median_period_weeks=2, plot=False,
               y_log=False, xlabel = '', ylabel = 'count',
-              title=None, verbose=False):
-    if not isinstance(df, DataFrame):
-        raise ValueError("data must be a single data frame.")
+              title=None, verbose=False, dtype=np.float64, cache=None, baseline=False,
+              decomposition='r_stl', max_gap=0, gap_fill='linear', period=None, threshold_sketch=None,
+              approximate=False, early_stop=None, workspace=None, seasonal_periods=None):
+    if is_arrow(df):
+        # two columns, like a data frame, as views of the Arrow buffers
+        if df.num_columns != 2:
+            raise ValueError("data must be a 2 column Arrow table of timestamps and numeric values.")
+        df = ArrowSeries.from_arrow(df)
+    if isinstance(df, (SeriesStore, PartitionedSeries, ArrowSeries)):
+        # read straight from the memory-mapped columns, partition files or Arrow buffers, windows are sliced out as needed
+        timestamps = df.timestamps
+        values = df.values
+    elif not isinstance(df, DataFrame):
+        raise ValueError("data must be a single data frame, Arrow table, SeriesStore or PartitionedSeries.")
     else:
-        if len(df.columns) != 2 or not df.iloc[:,1].map(np.isreal).all():
+        # numeric columns are real without looking at every value
+        if len(df.columns) != 2 or not (df.dtypes[1].kind in 'iuf' or df.iloc[:,1].map(np.isreal).all()):
             raise ValueError("data must be a 2 column data.frame, with the first column being a set of timestamps, and the second coloumn being numeric values.")
 
+        # the caller's frame is never written to, so it can be shared between threads
         if not (df.dtypes[0].type is np.datetime64):
             df = format_timestamp(df)
 
-    if list(df.columns.values) != ["timestamp", "count"]:
-        df.columns = ["timestamp", "count"]
+        timestamps = timestamps_to_ns(df.iloc[:,0])
+        values = np.asarray(df.iloc[:,1], dtype=np.float64)
+
+        # the windowing below relies on sorted timestamps
+        if np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind='mergesort')
+            timestamps = timestamps[order]
+            values = values[order]
 
     # Sanity check all input parameters
     if max_anoms > 0.49:
-        length = len(df.iloc[:,1])
+        length = len(values)
         raise ValueError(
             ("max_anoms must be less than 50% of "
              "the data points (max_anoms =%f data_points =%s).")
@@ -113,12 +189,35 @@ def detect_ts(df, max_anoms=0.10, direction='pos',
     if not threshold in [None,'med_max','p95','p99']:
         raise ValueError("threshold options are: None | med_max | p95 | p99")
 
+    if not (threshold_sketch is None or isinstance(threshold_sketch, QuantileSketch)):
+        raise ValueError("threshold_sketch must be a QuantileSketch")
+
     if not isinstance(e_value, bool):
         raise ValueError("e_value must be a boolean")
 
+    if not isinstance(approximate, bool):
+        raise ValueError("approximate must be a boolean")
+
+    early_stop = as_early_stop(early_stop)
+
+    seasonal_periods = as_seasonal_periods(seasonal_periods)
+
     if not isinstance(longterm, bool):
         raise ValueError("longterm must be a boolean")
 
+    if not isinstance(baseline, bool):
+        raise ValueError("baseline must be a boolean")
+
+    dtype = check_dtype(dtype)
+
+    decomposition = get_backend(decomposition).name
+
+    if not isinstance(max_gap, (int, long)) or max_gap < 0:
+        raise ValueError("max_gap must be a non-negative integer")
+
+    if not gap_fill in GAP_FILL:
+        raise ValueError("gap_fill options are: linear | seasonal")
+
     if piecewise_median_period_weeks < 2:
         raise ValueError("piecewise_median_period_weeks must be at greater than 2 weeks")
 
@@ -142,7 +241,11 @@ def detect_ts(df, max_anoms=0.10, direction='pos',
     else:
         title = title + " : "
 
-    gran = get_gran(df)
+    if not (period is None or period == 'auto' or
+            (isinstance(period, (int, long)) and not isinstance(period, bool) and period >= 2)):
+        raise ValueError("period must be None, 'auto' or an integer of at least 2")
+
+    gran = get_gran_ns(timestamps)
 
     if gran == "day":
         num_days_per_line = 7
@@ -151,138 +254,162 @@ def detect_ts(df, max_anoms=0.10, direction='pos',
     else:
         num_days_per_line = 1
 
-    if gran == 'sec':
-        df.timestamp = date_format(df.timestamp, "%Y-%m-%d %H:%M:00")
-        df = format_timestamp(df.groupby('timestamp').aggregate(np.sum))
+    if period is None:
+        if gran == 'ms':
+            raise ValueError("millisecond data has no default period, set period to the number of observations in a period or to 'auto'")
 
-    # if the data is daily, then we need to bump the period to weekly to get multiple examples
-    gran_period = {
-        'min': 1440,
-        'hr': 24,
-        'day': 7
-    }
-    period = gran_period[gran]
-    num_obs = len(df['count'])
+        # Aggregate data to minutely if secondly
+        if gran == 'sec':
+            timestamps, values = _sum_by_minute(timestamps, values)
+            gran = 'min'
+
+        # if the data is daily, then we need to bump the period to weekly to get multiple examples
+        gran_period = {
+            'min': 1440,
+            'hr': 24,
+            'day': 7
+        }
+        period = gran_period[gran]
+        step = GRAN_STEP[gran]
+    else:
+        # the series is analysed at its own sampling interval
+        step = sampling_interval(timestamps)
+        if period == 'auto':
+            period = _auto_period(values, gran, step, longterm, piecewise_median_period_weeks)
+
+    if seasonal_periods == 'weekly':
+        if period * step != DAY_NS:
+            raise ValueError("seasonal_periods='weekly' needs a daily period, not %d observations" % period)
+        seasonal_periods = (period, 7 * period)
+
+    num_obs = len(values)
 
     clamp = (1 / float(num_obs))
     if max_anoms < clamp:
         max_anoms = clamp
 
     if longterm:
-        if gran == "day":
-            num_obs_in_period = period * piecewise_median_period_weeks + 1
-            num_days_in_period = 7 * piecewise_median_period_weeks + 1
-        else:
-            num_obs_in_period = period * 7 * piecewise_median_period_weeks
-            num_days_in_period = 7 * piecewise_median_period_weeks
-
-        last_date = df.timestamp.iget(-1)
-
-        all_data = range(int(ceil(len(df['count']) / float(num_obs_in_period))))
+        num_obs_in_period, num_days_in_period = _longterm_span(gran, step, piecewise_median_period_weeks)
 
-        for j in range(0, len(df.timestamp), num_obs_in_period):
-            start_date = df.timestamp.iget(j)
-            end_date = min(start_date + datetime.timedelta(days=num_obs_in_period),
-                           df.timestamp.iget(-1))
-
-            # if there is at least 14 days left, subset it, otherwise subset last_date - 14days
-            if (end_date - start_date).days == num_days_in_period:
-                all_data[int(ceil(j / num_obs_in_period))] = df[(df.timestamp >= start_date) & (df.timestamp < end_date)]
-            else:
-                all_data[int(ceil(j / num_obs_in_period))] = df[
-                    (df.timestamp >
-                     (last_date - datetime.timedelta(days=num_days_in_period)))
-                    & (df.timestamp <= last_date)]
+        if seasonal_periods and num_obs_in_period < 2 * seasonal_periods[-1]:
+            raise ValueError("longterm windows of %d observations are too short for a seasonal period of %d, set a "
+                             "higher piecewise_median_period_weeks" % (num_obs_in_period, seasonal_periods[-1]))
+        windows = _longterm_windows(timestamps, num_obs_in_period, num_days_in_period)
     else:
-        all_data = [df]
+        windows = [(0, num_obs)]
 
-    all_anoms = DataFrame(columns=['timestamp', 'count'])
-    seasonal_plus_trend = DataFrame(columns=['timestamp', 'count'])
-
-    # Detect anomalies on all data (either entire data in one-pass, or in 2 week blocks if longterm=TRUE)
-    for i in range(len(all_data)):
-        directions = {
-            'pos': Direction(True, True),
-            'neg': Direction(True, False),
-            'both': Direction(False, True)
-        }
-        anomaly_direction = directions[direction]
-
-        # detect_anoms actually performs the anomaly detection and returns the results in a list containing the anomalies
-        # as well as the decomposed components of the time series for further analysis.
+    # -- If only_last was set by the user, only the anomalies from the most recent day (or hr) are kept
+    if only_last:
+        if gran != "day" and only_last == 'hr':
+            start_anoms = timestamps[-1] - HOUR_NS
+        else:
+            start_anoms = timestamps[-1] - DAY_NS
 
-        s_h_esd_timestamps = detect_anoms(all_data[i], k=max_anoms, alpha=alpha, num_obs_per_period=period, use_decomp=True, use_esd=False,
-                                       one_tail=anomaly_direction.one_tail, upper_tail=anomaly_direction.upper_tail, verbose=verbose)
+        # so windows that end before it needn't be read or analysed
+        windows = [(start, stop) for start, stop in windows if timestamps[stop - 1] > start_anoms]
 
-        # store decomposed components in local variable and overwrite s_h_esd_timestamps to contain only the anom timestamps
-        data_decomp = s_h_esd_timestamps['stl']
-        s_h_esd_timestamps = s_h_esd_timestamps['anoms']
+    directions = {
+        'pos': Direction(True, True),
+        'neg': Direction(True, False),
+        'both': Direction(False, True)
+    }
+    anomaly_direction = directions[direction]
+
+    # The threshold only depends on the daily max values of the whole series, so compute it once
+    if threshold:
+        if threshold_sketch is None:
+            threshold_sketch = daily_max_sketch(timestamps, values)
+        thresh = threshold_sketch.quantile(THRESHOLD_QUANTILES[threshold])
+
+    result = DetectionResult(e_value=e_value)
+
+    # everything besides the window's data that changes what detect_anoms finds in it
+    cache_params = {
+        'max_anoms': max_anoms,
+        'alpha': alpha,
+        'period': period,
+        'direction': direction,
+        'dtype': dtype.str,
+        'decomposition': decomposition,
+        'max_gap': max_gap,
+        'gap_fill': gap_fill,
+        'step': step
+    }
+    if approximate:
+        cache_params['approximate'] = True
+    if early_stop is not None:
+        cache_params['early_stop'] = str(early_stop)
+    if seasonal_periods:
+        cache_params['seasonal_periods'] = list(seasonal_periods)
 
-        # -- Step 3: Use detected anomaly timestamps to extract the actual anomalies (timestamp and value) from the data
-        if s_h_esd_timestamps:
-            anoms = all_data[i][all_data[i].iloc[:,0].isin(s_h_esd_timestamps)]
-        else:
-            anoms = DataFrame(columns=['timestamp', 'count'])
+    # Detect anomalies on all data (either entire data in one-pass, or in 2 week blocks if longterm=TRUE)
+    for i, (start, stop) in enumerate(windows):
+        # the baseline is fitted to the decomposition of the most recent window, so that one always runs
+        fit_baseline = baseline and i == len(windows) - 1
+
+        key = None
+        entry = None
+        if cache is not None:
+            key = window_key(timestamps[start:stop], values[start:stop], cache_params)
+            if not fit_baseline:
+                entry = cache.get(key)
+
+        cached = entry is not None
+        if not cached:
+            entry, output = detect_window(timestamps, values, start, stop, max_anoms, alpha, period,
+                                           anomaly_direction, verbose, dtype,
+                                           decomposition=decomposition, max_gap=max_gap,
+                                           gap_fill=gap_fill, step=step, approximate=approximate,
+                                           early_stop=early_stop, workspace=workspace,
+                                           seasonal_periods=seasonal_periods)
+            if cache is not None:
+                cache[key] = entry
+
+        if fit_baseline:
+            components = output['components']
+            decomp_timestamps = timestamps_to_ns(components.index)
+            if output['anoms']:
+                anomalies = locate(decomp_timestamps, timestamps_to_ns(output['anoms']))
+            else:
+                anomalies = []
+            # the sum of the seasonal components repeats every longest period
+            result.baseline = BaselineModel.fit(
+                decomp_timestamps, output['counts'], components['seasonal'], components['trend'],
+                anomalies, max(seasonal_periods or [period]), int((stop - start) * max_anoms), alpha=alpha,
+                one_tail=anomaly_direction.one_tail, upper_tail=anomaly_direction.upper_tail,
+                threshold=thresh if threshold else None)
+
+        positions = entry['positions']
+        anom_timestamps = timestamps[start:stop][positions]
+        anom_values = values[start:stop][positions]
+        expected = entry['expected']
 
         # Filter the anomalies using one of the thresholding functions if applicable
         if threshold:
-            # Calculate daily max values
-            periodic_maxes = df.groupby(df.timestamp.map(Timestamp.date)).aggregate(np.max)['count']
-
-            # Calculate the threshold set by the user
-            if threshold == 'med_max':
-                thresh = periodic_maxes.median()
-            elif threshold == 'p95':
-                thresh = periodic_maxes.quantile(.95)
-            elif threshold == 'p99':
-                thresh = periodic_maxes.quantile(.99)
+            keep = anom_values >= thresh
+            positions = positions[keep]
+            anom_timestamps = anom_timestamps[keep]
+            anom_values = anom_values[keep]
+            expected = expected[keep]
 
-            # Remove any anoms below the threshold
-            anoms = anoms[anoms.iloc[:,1] >= thresh]
+        if not e_value:
+            expected = np.full(len(positions), np.nan)
 
-        all_anoms = all_anoms.append(anoms)
-        seasonal_plus_trend = seasonal_plus_trend.append(data_decomp)
+        result.add_window(positions + start, anom_timestamps, anom_values, expected,
+                          start, stop, entry['num_anoms'], cached=cached)
 
-    # Cleanup potential duplicates
-    all_anoms.drop_duplicates(subset=['timestamp'])
-    seasonal_plus_trend.drop_duplicates(subset=['timestamp'])
-
-    # -- If only_last was set by the user, create subset of the data that represent the most recent day
     if only_last:
-        start_date = df.timestamp.iget(-1) - datetime.timedelta(days=7)
-        start_anoms = df.timestamp.iget(-1) - datetime.timedelta(days=1)
-        if gran is "day":
-            breaks = 3 * 12
-            num_days_per_line = 7
-        else:
-            if only_last == 'day':
-                breaks = 12
-            else:
-                start_date = df.timestamp.iget(-1) - datetime.timedelta(days=2)
-                # truncate to days
-                start_date = datetime.date(start_date.year, start_date.month, start_date.day)
-                start_anoms = df.timestamp.iget(-1) - datetime.timedelta(hours=1)
-                breaks = 3
-
-        # subset the last days worth of data
-        x_subset_single_day = df[df.timestamp > start_anoms]
-        # When plotting anoms for the last day only we only show the previous weeks data
-        x_subset_week = df[(df.timestamp <= start_anoms) & (df.timestamp > start_date)]
-        if len(all_anoms) > 0:
-            all_anoms = all_anoms[all_anoms.timestamp >= x_subset_single_day.timestamp.iget(0)]
-        num_obs = len(x_subset_single_day['count'])
+        result.filter(result.timestamps > start_anoms)
+        num_obs = len(timestamps) - int(np.searchsorted(timestamps, start_anoms, side='right'))
 
     # Calculate number of anomalies as a percentage
-    anom_pct = (len(df.iloc[:,1]) / float(num_obs)) * 100
+    anom_pct = (len(result) / float(num_obs)) * 100
 
     if anom_pct == 0:
         # logging ?
         # if verbose:
         #     message("No anomalies detected.")
-        return {
-            "anoms": None,
-            "plot": None
-        }
+        return result
 
     # skip plotting for now
     # if(plot){
@@ -324,23 +451,11 @@ def detect_ts(df, max_anoms=0.10, direction='pos',
 
     # }
 
-
     # Fix to make sure date-time is correct and that we retain hms at midnight
     #    all_anoms.iloc[:,0] = date_format(all_anoms.iloc[:,0], "%Y-%m-%d %H:%M:%S")
 
-    # Store expected values if set by user
-    if e_value:
-        d = {
-            'timestamp': all_anoms.timestamp,
-            'anoms': all_anoms.iloc[:,1],
-            'expected_value': seasonal_plus_trend.iloc[:,1][seasonal_plus_trend.timestamp.isin(all_anoms.timestamp)]
-        }
-    else:
-        d = {
-            'timestamp': all_anoms.timestamp,
-            'anoms': all_anoms.iloc[:,1]
-        }
-    anoms = DataFrame(d, index=all_anoms.timestamp)
+    # Expected values are stored on the result when e_value is set, the anoms DataFrame is only
+    # built when it's read from the result.
 
     # Make sure we're still a valid POSIXlt datetime.
     # TODO: Make sure we keep original datetime format and timezone.
@@ -349,14 +464,53 @@ def detect_ts(df, max_anoms=0.10, direction='pos',
 
     # Lastly, return anoms and optionally the plot if requested by the user
     # Ignore plotting for now
-    plot = False
-    if plot:
-        return {
-            'anoms': anoms,
-            'plot': xgraph
-        }
+    return result
+
+
+def _longterm_span(gran, step, piecewise_median_period_weeks):
+    # observations and days in each longterm window; daily data gets an extra day
+    if gran == "day":
+        num_days_in_period = 7 * piecewise_median_period_weeks + 1
     else:
-        return {
-            'anoms': anoms,
-            'plot': None
-        }
+        num_days_in_period = 7 * piecewise_median_period_weeks
+    return int(num_days_in_period * DAY_NS // step), num_days_in_period
+
+
+def _auto_period(values, gran, step, longterm, piecewise_median_period_weeks):
+    # detect the period from the most recent window, preferring a calendar hour, day or week
+    if longterm:
+        num_obs_in_period, _ = _longterm_span(gran, step, piecewise_median_period_weeks)
+    else:
+        num_obs_in_period = len(values)
+    preferred = [span // step for span in (HOUR_NS, DAY_NS, WEEK_NS) if span % step == 0]
+    period = detect_period(np.asarray(values[-num_obs_in_period:]), preferred=preferred)
+    if period is None:
+        raise ValueError("no seasonal period found in the data, set period to the number of observations in a period")
+    return period
+
+
+def _longterm_windows(timestamps, num_obs_in_period, num_days_in_period):
+    # (start, stop) positions of the piecewise windows over sorted int64 timestamps
+    num_obs = len(timestamps)
+    span = num_days_in_period * DAY_NS
+    last_date = timestamps[-1]
+
+    windows = []
+    for j in range(0, num_obs, num_obs_in_period):
+        start_date = timestamps[j]
+        end_date = min(start_date + span, last_date)
+
+        # if there is at least 14 days left, subset it, otherwise subset last_date - 14days
+        if end_date - start_date == span:
+            windows.append((j, int(np.searchsorted(timestamps, end_date, side='left'))))
+        else:
+            windows.append((int(np.searchsorted(timestamps, last_date - span, side='right')),
+                            num_obs))
+
+    return windows
+
+
+def _sum_by_minute(timestamps, values):
+    minutes = timestamps // MINUTE_NS
+    starts = np.flatnonzero(np.r_[True, minutes[1:] != minutes[:-1]])
+    return minutes[starts] * MINUTE_NS, np.add.reduceat(np.asarray(values, dtype=np.float64), starts)
@@ -1,5 +1,11 @@
 from pandas import DataFrame, Series
-from math import ceil
+import numpy as np
+from windows import Direction, detect_window
+from results import DetectionResult
+from esd import check_dtype, as_early_stop
+from decomposition import get_backend, as_seasonal_periods
+from resample import GAP_FILL
+from period import detect_period
 
 def message(s):
     # actually log something?
@@ -9,19 +15,73 @@ def detect_vec(df, max_anoms=0.10, direction='pos',
                alpha=0.05, period=None, only_last=False,
                threshold='None', e_value=False, longterm_period=None,
                plot=False, y_log=False, xlabel='', ylabel='count',
-               title=None, verbose=False):
-
-    if (isinstance(df, DataFrame) and
-        len(df.columns) == 1 and
-        df.iloc[:,0].applymap(np.isreal).all(1)):
-        df = DataFrame(timestamp=range(len(df.iloc[:,0])), count=df.iloc[:,0])
+               title=None, verbose=False, dtype=np.float64, decomposition='r_stl',
+               max_gap=0, gap_fill='linear', approximate=False, early_stop=None,
+               workspace=None, seasonal_periods=None):
+    """
+    Anomaly detection on a series of observations without timestamps, using S-H-ESD.
+
+    df
+        Numeric observations: a one column DataFrame, a Series, a list or a
+        1-d NumPy array. Observations are taken as evenly spaced and are
+        indexed by their position, starting at 0.
+
+    period : int or 'auto'
+        Number of observations in a single seasonal period, or 'auto' to
+        detect it from the autocorrelation of the values.
+
+    longterm_period : int
+        Split the series into windows of this many observations, each with its
+        own piecewise median, as in detect_ts with longterm=True. The last window
+        is aligned with the end of the series.
+
+    only_last : bool
+        Only report anomalies within the last period.
+
+    threshold : str
+        'None', 'med_max', 'p95' or 'p99'. Only report anomalies at or above the
+        median, 95th or 99th percentile of the per-period maxima of their window.
+
+    decomposition : str
+        Seasonal decomposition backend, 'r_stl', 'stl', 'periodic' or
+        'decompose', see decomposition.py.
+
+    max_gap : int
+        Fill runs of up to this many NAs before decomposing, with 'linear' or
+        'seasonal' ``gap_fill``. NAs at the ends are always dropped.
+
+    early_stop : EarlyStop or 'patience[:margin]'
+        Stop each S-H-ESD run early, which deviates from the generalized ESD
+        test; see esd.py.
+
+    seasonal_periods : sequence of int
+        Remove all of these seasonal periods in one MSTL decomposition rather
+        than ``period`` alone, see decomposition.mstl.
+
+    The remaining arguments are as for detect_ts.
+
+    returns
+
+    result : DetectionResult
+        With integer positions as the ``timestamp`` column and index.
+    """
+    if isinstance(df, DataFrame):
+        if len(df.columns) != 1:
+            raise ValueError("data must be a single data frame, list, or vector that holds numeric values.")
+        values = df.iloc[:,0].values
     elif isinstance(df, Series):
-        df = DataFrame(timestamp=range(len(df)), count=df)
+        values = df.values
+    elif isinstance(df, (list, tuple, np.ndarray)):
+        values = np.asarray(df)
     else:
         raise ValueError("data must be a single data frame, list, or vector that holds numeric values.")
 
+    if values.ndim != 1 or values.dtype.kind not in 'biuf':
+        raise ValueError("data must be a single data frame, list, or vector that holds numeric values.")
+    values = np.asarray(values, dtype=np.float64)
+
     if max_anoms > 0.49:
-        length = len(df.iloc[:,1])
+        length = len(values)
         raise ValueError(
             ("max_anoms must be less than 50% of "
              "the data points (max_anoms =%f data_points =%s).")
@@ -34,18 +94,44 @@ def detect_vec(df, max_anoms=0.10, direction='pos',
         if verbose:
             message("Warning: alpha is the statistical signifigance, and is usually between 0.01 and 0.1")
 
+    if period == 'auto':
+        period = detect_period(values[-longterm_period:] if longterm_period else values)
+        if period is None:
+            raise ValueError("no seasonal period found in the data, set period to the number of data points in a single period")
+
     if not period:
         raise ValueError("Period must be set to the number of data points in a single period")
 
     if not isinstance(only_last, bool):
         raise ValueError("only_last must be a boolean")
 
+    if threshold is None:
+        threshold = 'None'
     if not threshold in ['None','med_max','p95','p99']:
         raise ValueError("threshold options are: None | med_max | p95 | p99")
 
     if not isinstance(e_value, bool):
         raise ValueError("e_value must be a boolean")
 
+    if not isinstance(approximate, bool):
+        raise ValueError("approximate must be a boolean")
+
+    early_stop = as_early_stop(early_stop)
+
+    seasonal_periods = as_seasonal_periods(seasonal_periods)
+    if seasonal_periods == 'weekly':
+        raise ValueError("seasonal_periods='weekly' needs timestamps, give the periods in observations")
+
+    dtype = check_dtype(dtype)
+
+    decomposition = get_backend(decomposition).name
+
+    if not isinstance(max_gap, (int, long)) or max_gap < 0:
+        raise ValueError("max_gap must be a non-negative integer")
+
+    if not gap_fill in GAP_FILL:
+        raise ValueError("gap_fill options are: linear | seasonal")
+
     if not isinstance(plot, bool):
         raise ValueError("plot must be a boolean")
 
@@ -68,99 +154,67 @@ def detect_vec(df, max_anoms=0.10, direction='pos',
 
       # -- Main analysis: Perform S-H-ESD
 
-    num_obs = len(df.iloc[:,1])
+    num_obs = len(values)
+    # positions double as timestamps, so the window core can be shared with detect_ts
+    timestamps = np.arange(num_obs, dtype=np.int64)
 
     if max_anoms < (1 / float(num_obs)):
         max_anoms = 1 / float(num_obs)
 
-
       # -- Setup for longterm time series
 
-      # If longterm is enabled, break the data into subset data frames and store in all_data,
+      # If longterm is enabled, break the data into windows of longterm_period observations
     if longterm_period:
-        all_data = []
-        for j in range(0, len(df.iloc[:,0]), longterm_period):
-            start_index = df.iloc[:,0][j]
-            end_index = min((start_index + longterm_period - 1), num_obs)
-            if (end_index - start_index + 1) == longterm_period:
-                all_data[int(math.ceil(j / float(longterm_period)))] = df[(df.iloc[:,0] >= start_index) & (df.iloc[:,0] <= end_index)]
-            else:
-                all_data[int(math.ceil(j / float(longterm_period)))] = df[(df.iloc[:,0] >= (num_obs - longterm_period)) & (df.iloc[:,0] <= num_obs)]
+        windows = _longterm_windows(num_obs, longterm_period)
     else:
-        all_data = list(df)
-
-    # Create empty data frames to store all anoms and seasonal+trend component from decomposition
-    all_anoms = DataFrame(columns=['timestamp', 'count'])
-    seasonal_plus_trend = DataFrame(columns=['timestamp', 'count'])
-
-    # Detect anomalies on all data (either entire data in one-pass, or in 2 week blocks if longterm=TRUE)
-    for i in range(len(all_data)):
-        directions = {
-            'pos': Direction(True, True),
-            'neg': Direction(True, False),
-            'both': Direction(False, False)
-        }
-        anomaly_direction = directions[direction]
-
-        s_h_esd_timestamps = detect_anoms(all_data[i], k=max_anoms, alpha=alpha, num_obs_per_period=period, use_decomp=True, use_esd=False,
-                                       one_tail=anomaly_direction.one_tail, upper_tail=anomaly_direction.upper_tail, verbose=verbose)
-
-        # store decomposed components in local variable and overwrite s_h_esd_timestamps to contain only the anom timestamps
-        data_decomp = s_h_esd_timestamps['stl']
-        s_h_esd_timestamps = s_h_esd_timestamps['anoms']
-
-        if not s_h_esd_timestamps:
-            anoms = all_data[i][all_data[i].iloc[:,0].isin(s_h_esd_timestamps)]
-        else:
-            anoms = DataFrame(columns=['timestamp', 'count'])
-
-        if threshold:
-            if longterm_period:
-                periodic_maxes = data.groupby(Series(range(longterm_period)) / period).aggregate(np.max)
-            else:
-                periodic_maxes = data.groupby(Series(range(num_obs)) / period).aggregate(np.max)
-
-            # Calculate the threshold set by the user
-            if threshold == 'med_max':
-                thresh = periodic_maxes.median()
-            elif threshold == 'p95':
-                thresh = periodic_maxes.quantile(.95)
-            elif threshold == 'p99':
-                thresh = periodic_maxes.quantile(.99)
-
-            # Remove any anoms below the threshold
-            anoms = anoms[anoms.iloc[:,1] >= thresh]
-
-            all_anoms.append(anoms)
-            seasonal_plus_trend.append(data_decomp)
-
-    # Cleanup potential duplicates
-    all_anoms.drop_duplicates(subset=['timestamp'])
-    seasonal_plus_trend.drop_duplicates(subset=['timestamp'])
-
-    # -- If only_last was set by the user, create subset of the data that represent the most recent period
+        windows = [(0, num_obs)]
+
+    directions = {
+        'pos': Direction(True, True),
+        'neg': Direction(True, False),
+        'both': Direction(False, True)
+    }
+    anomaly_direction = directions[direction]
+
+    result = DetectionResult(e_value=e_value, index_type='int')
+
+    # Detect anomalies on all data (either entire data in one-pass, or in longterm_period blocks)
+    for start, stop in windows:
+        entry, _ = detect_window(timestamps, values, start, stop, max_anoms, alpha, period,
+                                 anomaly_direction, verbose, dtype, index_type='int',
+                                 decomposition=decomposition, max_gap=max_gap, gap_fill=gap_fill,
+                                 approximate=approximate, early_stop=early_stop, workspace=workspace,
+                                 seasonal_periods=seasonal_periods)
+        positions = entry['positions']
+        anom_values = values[start:stop][positions]
+        expected = entry['expected']
+
+        # Remove any anoms below the threshold, which is computed per window
+        if threshold != 'None':
+            keep = anom_values >= _periodic_max_threshold(values[start:stop], period, threshold)
+            positions = positions[keep]
+            anom_values = anom_values[keep]
+            expected = expected[keep]
+
+        if not e_value:
+            expected = np.full(len(positions), np.nan)
+
+        result.add_window(positions + start, positions + start, anom_values, expected,
+                          start, stop, entry['num_anoms'])
+
+    # -- If only_last was set by the user, only keep the anomalies from the most recent period
     if only_last:
-        x_subset_single_period = DataFrame(timestamp=df.iloc[:,0].iloc[(num_obs - period + 1):num_obs],
-                                           count=df.iloc[:,1][(num_obs - period + 1):num_obs])
-        past_obs = period * 7
-        if num_obs < past_obs:
-            past_obs = num_obs - period
-        # When plotting anoms for the last period only we only show the previous 7 periods of data
-        x_subset_previous = DataFrame(timestamp=df.iloc[:,0].iloc[(num_obs - past_obs + 1):(num_obs-period+1)], count=df.iloc[:,1].iloc[(num_obs - past_obs + 1):(num_obs - period + 1)])
-        all_anoms = all_anoms[all_anoms[:,0] >= x_subset_single_period.iloc[:,0][0]]
-        num_obs = len(x_subset_single_period.iloc[:,1])
+        result.filter(result.positions >= num_obs - period)
+        num_obs = min(period, num_obs)
 
     # Calculate number of anomalies as a percentage
-    anom_pct = (len(df.iloc[:,1]) / float(num_obs)) * 100
+    anom_pct = (len(result) / float(num_obs)) * 100
 
     if anom_pct == 0:
         # logging ?
         # if verbose:
         #     message("No anomalies detected.")
-        return {
-            "anoms": None,
-            "plot": None
-        }
+        return result
 
   # skip plotting for now
   #     if(plot){
@@ -212,23 +266,32 @@ def detect_vec(df, max_anoms=0.10, direction='pos',
   #   xgraph <- xgraph + add_formatted_y(yrange, y_log=y_log)
   # }
 
-  # Store expected values if set by user
-    if e_value:
-        anoms = DataFrame(timestamp=all_anoms.iloc[:,0], anoms=all_anoms.iloc[:,1],
-                          expected_value=seasonal_plus_trend.iloc[:,1][datetimes_from_ts(seasonal_plus_trend.iloc[:,1]).isin(all_anoms.iloc[:,0])])
-    else:
-        anoms = DataFrame(timestamp=all_anoms.iloc[:0], anoms=all_anoms.iloc[:,1])
+    # Expected values are stored on the result when e_value is set, the anoms DataFrame is only
+    # built when it's read from the result.
 
     # Lastly, return anoms and optionally the plot if requested by the user
     # Ignore plotting for now
-    plot = False
-    if plot:
-        return {
-            'anoms': anoms,
-            'plot': xgraph
-        }
-    else:
-        return {
-            'anoms': anoms,
-            'plot': None
-        }
+    return result
+
+
+def _longterm_windows(num_obs, longterm_period):
+    # (start, stop) positions of consecutive windows, the last one aligned with the end of the series
+    windows = []
+    for j in range(0, num_obs, longterm_period):
+        if j + longterm_period <= num_obs:
+            windows.append((j, j + longterm_period))
+        else:
+            windows.append((max(num_obs - longterm_period, 0), num_obs))
+    return windows
+
+
+def _periodic_max_threshold(values, period, threshold):
+    periodic_maxes = np.fmax.reduceat(values, np.arange(0, len(values), period))
+
+    # Calculate the threshold set by the user
+    if threshold == 'med_max':
+        return np.nanmedian(periodic_maxes)
+    elif threshold == 'p95':
+        return np.nanpercentile(periodic_maxes, 95)
+    elif threshold == 'p99':
+        return np.nanpercentile(periodic_maxes, 99)
@@ -0,0 +1,202 @@
+import numpy as np
+from pandas import DataFrame
+from date_utils import format_timestamp, timestamps_to_ns, get_gran_ns, HOUR_NS, DAY_NS
+from esd import MAD_SCALE
+from batch import detect_many
+
+# Top-down detection over a hierarchy of series (e.g. service -> cluster -> host). Every parent is the
+# sum of its children, and a subtree is only detected on when its parent has anomalies or a cheap
+# score of the subtree's own series looks anomalous, so quiet subtrees cost one O(n) pass rather than
+# a detect_ts run per leaf.
+
+SEPARATOR = '/'
+
+# seasonal lag of the triage score, like detect_ts' default periods
+GRAN_PERIOD = {'min': 1440, 'hr': 24, 'day': 7}
+
+
+def _leaf_arrays(df):
+    if not isinstance(df, DataFrame) or len(df.columns) != 2:
+        raise ValueError("leaves must be 2 column data frames of timestamps and values")
+    if not (df.dtypes[0].type is np.datetime64):
+        df = format_timestamp(df)
+    timestamps = timestamps_to_ns(df.iloc[:, 0])
+    values = np.asarray(df.iloc[:, 1], dtype=np.float64)
+    order = np.argsort(timestamps, kind='mergesort')
+    return timestamps[order], values[order]
+
+
+def rollup(series):
+    """
+    Sum of several (timestamps, values) series, on the union of their
+    timestamps. NaNs are skipped; a timestamp with no values is NaN.
+    """
+    timestamps = np.concatenate([ts for ts, _ in series])
+    values = np.concatenate([v for _, v in series])
+    grid, inverse = np.unique(timestamps, return_inverse=True)
+    valid = ~np.isnan(values)
+    sums = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=len(grid))
+    counts = np.bincount(inverse[valid], minlength=len(grid))
+    sums[counts == 0] = np.nan
+    return grid, sums
+
+
+def triage_score(timestamps, values, period, start=None):
+    """
+    How anomalous the series looks after ``start``: the largest absolute
+    change from one period earlier, as a robust z-score (median and MAD of all
+    the changes). Series shorter than two periods use the change from the
+    previous observation.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    lag = period if len(values) >= 2 * period else 1
+    if len(values) <= lag:
+        return 0.0
+    change = values[lag:] - values[:-lag]
+    finite = ~np.isnan(change)
+    if not finite.any():
+        return 0.0
+    center = np.median(change[finite])
+    deviation = np.abs(change - center)
+    scale = np.median(deviation[finite]) / MAD_SCALE
+
+    recent = finite
+    if start is not None:
+        recent = recent & (np.asarray(timestamps)[lag:] > start)
+    if not recent.any():
+        return 0.0
+    largest = deviation[recent].max()
+    if scale == 0:
+        return np.inf if largest > 0 else 0.0
+    return largest / scale
+
+
+class HierarchyResult(object):
+    """
+    The DetectionResults of the nodes detect_hierarchy ran detect_ts on, keyed
+    by node path (names joined by '/'), and the triage scores of the nodes it
+    scored.
+    """
+
+    def __init__(self, leaves):
+        self.results = {}
+        self.scores = {}
+        self.leaves = frozenset(leaves)
+
+    @property
+    def leaf_evaluations(self):
+        return sum(1 for node in self.results if node in self.leaves)
+
+    @property
+    def leaf_evaluations_avoided(self):
+        return len(self.leaves) - self.leaf_evaluations
+
+    @property
+    def anomalous(self):
+        """Paths of the nodes with anomalies, parents first."""
+        return sorted((node for node, result in self.results.items() if len(result)),
+                      key=lambda node: (node.count(SEPARATOR), node))
+
+    def keys(self):
+        return self.results.keys()
+
+    def __contains__(self, node):
+        return node in self.results
+
+    def __getitem__(self, node):
+        return self.results[node]
+
+    def __repr__(self):
+        return '<HierarchyResult: %d nodes detected, %d of %d leaf evaluations avoided>' % (
+            len(self.results), self.leaf_evaluations_avoided, len(self.leaves))
+
+
+def detect_hierarchy(tree, score_threshold=4.0, max_workers=None, **kwargs):
+    """
+    Detect anomalies top-down in a hierarchy of series.
+
+    The top-level nodes are always detected on. The children of a node with
+    anomalies are all detected on; the children of a node without are only
+    detected on when their triage_score, over the window detect_ts reports on
+    (the last day or hour with ``only_last``, otherwise all of it), is above
+    ``score_threshold``.
+
+    tree : dict
+        Node name -> either a dict of its children, or for leaves a
+        DataFrame like detect_ts takes. Parents are the sum of their leaves.
+
+    score_threshold : float
+        Robust z-score above which a child of a quiet parent is detected on.
+
+    max_workers : int
+        Nodes of the same level are detected on a thread pool of this size,
+        see detect_many.
+
+    kwargs
+        Passed through to detect_ts.
+
+    returns
+
+    result : HierarchyResult
+    """
+    if not isinstance(tree, dict):
+        raise ValueError("tree must be a dict of top-level nodes")
+    nodes = {}
+    children = {}
+
+    def walk(node, path):
+        if isinstance(node, dict):
+            if not node:
+                raise ValueError("%s has no children" % (path or 'the hierarchy'))
+            names = sorted(node)
+            kids = [path + SEPARATOR + name if path else name for name in names]
+            for name, kid in zip(names, kids):
+                if SEPARATOR in name:
+                    raise ValueError("node names can't contain '%s': %s" % (SEPARATOR, name))
+                walk(node[name], kid)
+            children[path] = kids
+            nodes[path] = rollup([nodes[kid] for kid in kids])
+        else:
+            nodes[path] = _leaf_arrays(node)
+            leaves[path] = node
+
+    leaves = {}
+    walk(tree, '')
+    result = HierarchyResult(leaves)
+
+    only_last = kwargs.get('only_last')
+    period = kwargs.get('period')
+
+    def score(node):
+        timestamps, values = nodes[node]
+        if len(timestamps) == 0:
+            return 0.0
+        lag = period if isinstance(period, (int, long)) else GRAN_PERIOD.get(get_gran_ns(timestamps), 1)
+        start = None
+        if only_last:
+            start = timestamps[-1] - (HOUR_NS if only_last == 'hr' else DAY_NS)
+        return triage_score(timestamps, values, lag, start)
+
+    def frame(node):
+        if node in leaves:
+            return leaves[node]
+        timestamps, values = nodes[node]
+        return DataFrame({'timestamp': timestamps.view('M8[ns]'), 'count': values},
+                         columns=['timestamp', 'count'])
+
+    frontier = children['']
+    while frontier:
+        results = detect_many(dict((node, frame(node)) for node in frontier), max_workers, **kwargs)
+        result.results.update(results)
+
+        descend = []
+        for node in frontier:
+            for kid in children.get(node, []):
+                if len(results[node]):
+                    descend.append(kid)
+                    continue
+                result.scores[kid] = score(kid)
+                if result.scores[kid] > score_threshold:
+                    descend.append(kid)
+        frontier = descend
+    return result
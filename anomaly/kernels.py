@@ -0,0 +1,192 @@
+import os
+import numpy as np
+
+# Compiled kernels for the loops that can't be vectorized: the generalized ESD removal loop and the
+# per-fit LOESS of stl.py. They are compiled with Numba when it is installed (nopython, releasing the
+# GIL, cached on disk next to this module so worker processes load rather than recompile them) and
+# the callers fall back to their NumPy code otherwise. ANOMALY_JIT=0 turns them off.
+#
+# The kernels are plain Python as written, so their logic can be tested without Numba on small
+# inputs, but they are far too slow to run that way.
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+ENABLED = numba is not None and os.environ.get('ANOMALY_JIT', '1') != '0'
+
+
+def _jit(f):
+    if numba is None:
+        return f
+    return numba.njit(nogil=True, cache=True)(f)
+
+
+@_jit
+def _kth_deviation(x, lo, hi, split, med, k):
+    # the k-th (0-based) smallest |x - med| of the sorted x[lo:hi], with x[split:hi] >= med: the
+    # merge of the deviations below the median, med - x[split-1], med - x[split-2], ..., and above
+    # it, x[split] - med, x[split+1] - med, ..., each already in ascending order
+    n_below = split - lo
+    n_above = hi - split
+    a_lo = max(0, k + 1 - n_above)
+    a_hi = min(k + 1, n_below)
+    # a of the k+1 smallest deviations come from below the median
+    while a_lo < a_hi:
+        a = (a_lo + a_hi) // 2
+        if med - x[split - 1 - a] < x[split + k - a] - med:
+            a_lo = a + 1
+        else:
+            a_hi = a
+    a = a_lo
+    b = k + 1 - a
+    if a == 0:
+        return x[split + b - 1] - med
+    if b == 0:
+        return med - x[split - a]
+    return max(med - x[split - a], x[split + b - 1] - med)
+
+
+@_jit
+def esd_trajectory(data, positions, max_outliers, one_tail, upper_tail, constants, R_idx, R,
+                   lam, patience, margin):
+    """
+    The removal loop of esd.esd. Fills R_idx and R with the position and test
+    statistic of each removed point, most extreme first, and returns how many
+    were removed before the MAD reached 0, or before ``patience`` consecutive
+    R[i] below lam[i] - ``margin`` stopped the loop (never with patience 0).
+
+    The median and MAD come from a sorted copy of ``data`` that points are
+    removed from, in O(log n) per iteration: the most extreme point is always
+    at one of its ends. The arithmetic is done in ``data``'s dtype, as the
+    NumPy loop does. ``constants`` holds 0.5 and the MAD scale in that dtype.
+    """
+    order = np.argsort(data, kind='mergesort')
+    x = data[order]
+    pos = positions[order]
+    half = constants[0]
+    scale = constants[1]
+    lo = 0
+    hi = len(x)
+    steps = min(max_outliers, hi)
+    streak = 0
+    for i in range(steps):
+        m = hi - lo
+        h = m // 2
+        if m % 2:
+            med = x[lo + h]
+        else:
+            med = (x[lo + h - 1] + x[lo + h]) * half
+        split = lo + np.searchsorted(x[lo:hi], med)
+
+        # ties go to the earliest point, and equal values are sorted in time order
+        top = hi - 1
+        while top > lo and x[top - 1] == x[hi - 1]:
+            top -= 1
+        top_dev = x[hi - 1] - med
+        bottom_dev = med - x[lo]
+        if not one_tail:
+            if top_dev > bottom_dev or (top_dev == bottom_dev and pos[top] < pos[lo]):
+                idx, stat = top, top_dev
+            else:
+                idx, stat = lo, bottom_dev
+        elif upper_tail:
+            idx, stat = top, top_dev
+        else:
+            idx, stat = lo, bottom_dev
+
+        if m % 2:
+            sigma = _kth_deviation(x, lo, hi, split, med, h) / scale
+        else:
+            sigma = (_kth_deviation(x, lo, hi, split, med, h - 1) / scale +
+                     _kth_deviation(x, lo, hi, split, med, h) / scale) * half
+        if sigma == 0:
+            return i
+
+        if m % 2:
+            R[i] = stat / sigma
+        else:
+            # NumPy's median of an even count is a float64 mean, whatever the dtype
+            R[i] = np.float64(stat) / np.float64(sigma)
+        R_idx[i] = pos[idx]
+        if idx == lo:
+            lo += 1
+        else:
+            for j in range(idx, hi - 1):
+                x[j] = x[j + 1]
+                pos[j] = pos[j + 1]
+            hi -= 1
+
+        if patience > 0:
+            streak = streak + 1 if R[i] < lam[i] - margin else 0
+            if streak == patience:
+                return i + 1
+    return steps
+
+
+@_jit
+def loess_fit(y, n, length, degree, xs, nleft, width, rw, use_rw, values, ok):
+    """
+    stlest: the local fits of stl._loess_at, one fit and column at a time.
+    Fills values and ok, both (fits x columns).
+    """
+    w = np.empty(width)
+    for f in range(len(xs)):
+        x = xs[f]
+        left = nleft[f]
+        h = max(x - left, left + width - 1 - x)
+        if length > n:
+            h += (length - n) // 2
+        for col in range(y.shape[1]):
+            total = 0.0
+            for j in range(width):
+                r = abs(left + j - x)
+                if r > 0.999 * h:
+                    w[j] = 0.0
+                elif r <= 0.001 * h:
+                    w[j] = 1.0
+                else:
+                    w[j] = (1.0 - (r / h) ** 3) ** 3
+                if use_rw:
+                    w[j] *= rw[left + j - 1, col]
+                total += w[j]
+            if total <= 0:
+                ok[f, col] = False
+                values[f, col] = 0.0
+                continue
+            ok[f, col] = True
+            for j in range(width):
+                w[j] /= total
+            if degree > 0 and h > 0:
+                center = 0.0
+                for j in range(width):
+                    center += w[j] * (left + j)
+                c = 0.0
+                for j in range(width):
+                    c += w[j] * (left + j - center) ** 2
+                if np.sqrt(c) > 0.001 * (n - 1):
+                    b = (x - center) / c
+                    for j in range(width):
+                        w[j] *= b * (left + j - center) + 1.0
+            fitted = 0.0
+            for j in range(width):
+                fitted += w[j] * y[left + j - 1, col]
+            values[f, col] = fitted
+
+
+def warm():
+    # load (or compile) the kernels now rather than on the first detection, e.g. in a worker initializer
+    if not ENABLED:
+        return
+    # the arguments must have the types and flags of esd's, e.g. its memoized critical values are
+    # read-only, which Numba compiles separately
+    lam = np.zeros(2)
+    lam.flags.writeable = False
+    for dtype in (np.float64, np.float32):
+        data = np.arange(8, dtype=dtype)
+        esd_trajectory(data, np.arange(8), 2, True, True, np.array([0.5, 0.6745], dtype=dtype),
+                       np.empty(2, dtype=np.int64), np.empty(2), lam, 0, 0.)
+    y = np.ones((8, 1))
+    loess_fit(y, 8, 3, 1, np.arange(1.0, 9.0), np.clip(np.arange(8), 1, 6), 3, y, False,
+              np.empty((8, 1)), np.empty((8, 1), dtype=np.bool_))
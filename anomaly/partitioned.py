@@ -0,0 +1,249 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+import pandas as pd
+from date_utils import parse_timestamps, get_gran_ns
+from period import sampling_interval
+
+# Series too large to load whole, stored as several files (e.g. one per day), for detect_ts to
+# read a window at a time. Only the timestamps are kept in memory, 8 bytes an observation;
+# values are read from the files as windows ask for them, through a cache of whole decoded
+# partitions held within a byte budget.
+
+# peak memory of detecting one window, per observation in it (measured at 150-400 bytes
+# depending on the decomposition, rounded up)
+WINDOW_BYTES_PER_OBS = 512
+
+DEFAULT_BUDGET = 1 << 30
+
+# a series' partitions and memory budget, as a batch task source
+Partitions = namedtuple('Partitions', ['paths', 'budget'])
+
+
+def _columns(path, timestamp_column, value_column, names):
+    if timestamp_column in names and value_column in names:
+        return timestamp_column, value_column
+    if len(names) == 2:
+        return names[0], names[1]
+    raise ValueError("%s has no %s and %s columns" % (path, timestamp_column, value_column))
+
+
+def read_partition(path, timestamp_column='timestamp', value_column='count', values=True):
+    """
+    int64 nanosecond timestamps and (unless ``values`` is False) float64 values
+    of a CSV or NPY partition, in the formats cli.load_series reads. NPY files
+    are memory-mapped, so reading only the timestamps doesn't touch the values.
+    """
+    if path.lower().endswith('.npy'):
+        data = np.load(path, mmap_mode='r')
+        if data.dtype.names:
+            ts_field, value_field = _columns(path, timestamp_column, value_column, data.dtype.names)
+            timestamps, column = data[ts_field], data[value_field]
+        elif data.ndim == 2 and data.shape[1] == 2:
+            timestamps, column = data[:, 0], data[:, 1]
+        else:
+            raise ValueError("%s must be a structured array or have two columns" % path)
+    else:
+        names = list(pd.read_csv(path, nrows=0).columns)
+        ts_name, value_name = _columns(path, timestamp_column, value_column, names)
+        df = pd.read_csv(path, usecols=[ts_name, value_name] if values else [ts_name])
+        timestamps = df[ts_name].values
+        column = df[value_name].values if values else None
+
+    timestamps = parse_timestamps(timestamps)
+    if not values:
+        return timestamps, None
+    return timestamps, np.array(column, dtype=np.float64)
+
+
+class PartitionedSeries(object):
+    """
+    A single <timestamp, count> series split across CSV/NPY files, which
+    detect_ts reads like a SeriesStore: ``timestamps`` is an in-memory int64
+    array, ``values`` reads the slices detect_ts asks for from the files.
+
+    Partitions may be given in any order but must not overlap in time, and each
+    must be sorted.
+
+    paths : list of str
+    cache_bytes : int
+        Decoded partitions are kept, least recently used first out, up to this
+        many bytes.
+    """
+
+    def __init__(self, paths, timestamp_column='timestamp', value_column='count',
+                 cache_bytes=DEFAULT_BUDGET // 4):
+        if not paths:
+            raise ValueError("a partitioned series needs at least one partition")
+        self.timestamp_column = timestamp_column
+        self.value_column = value_column
+
+        scanned = []
+        for path in paths:
+            timestamps, _ = read_partition(path, timestamp_column, value_column, values=False)
+            if len(timestamps) == 0:
+                continue
+            if np.any(timestamps[1:] <= timestamps[:-1]):
+                raise ValueError("%s is not sorted by timestamp" % path)
+            scanned.append((timestamps[0], path, timestamps))
+        scanned.sort(key=lambda p: p[0])
+
+        for (_, previous, before), (_, path, after) in zip(scanned, scanned[1:]):
+            if after[0] <= before[-1]:
+                raise ValueError("partitions %s and %s overlap" % (previous, path))
+
+        self.paths = [path for _, path, _ in scanned]
+        self.timestamps = np.concatenate([ts for _, _, ts in scanned]) if scanned \
+            else np.empty(0, dtype=np.int64)
+        self.offsets = np.cumsum([0] + [len(ts) for _, _, ts in scanned])
+        self.values = PartitionedValues(self, cache_bytes)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def partition_values(self, i):
+        _, values = read_partition(self.paths[i], self.timestamp_column, self.value_column)
+        if len(values) != self.offsets[i + 1] - self.offsets[i]:
+            raise ValueError("%s changed while it was being read" % self.paths[i])
+        return values
+
+    def __getstate__(self):
+        # a worker process gets a cold cache
+        state = self.__dict__.copy()
+        state['values'] = None
+        state['_cache_bytes'] = self.values.cache_bytes
+        return state
+
+    def __setstate__(self, state):
+        cache_bytes = state.pop('_cache_bytes')
+        self.__dict__.update(state)
+        self.values = PartitionedValues(self, cache_bytes)
+
+
+class PartitionedValues(object):
+    # the values column of a PartitionedSeries, read a slice at a time
+
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, series, cache_bytes):
+        self.series = series
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.series)
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    def _partition(self, i):
+        with self._lock:
+            if i in self._cache:
+                values = self._cache.pop(i)
+                self._cache[i] = values
+                return values
+        values = self.series.partition_values(i)
+        with self._lock:
+            if i not in self._cache and values.nbytes <= self.cache_bytes:
+                while self._cached_bytes + values.nbytes > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= evicted.nbytes
+                self._cache[i] = values
+                self._cached_bytes += values.nbytes
+        return values
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("partitioned values only support contiguous slices")
+        elif isinstance(key, (int, long, np.integer)):
+            start = key + len(self) if key < 0 else key
+            if not 0 <= start < len(self):
+                raise IndexError("index %d is out of bounds" % key)
+            return self[start:start + 1][0]
+        else:
+            raise TypeError("partitioned values are indexed with integers and slices")
+
+        out = np.empty(max(stop - start, 0), dtype=np.float64)
+        offsets = self.series.offsets
+        first = np.searchsorted(offsets, start, side='right') - 1
+        for i in range(first, len(offsets) - 1):
+            if offsets[i] >= stop:
+                break
+            lo, hi = max(start, offsets[i]), min(stop, offsets[i + 1])
+            out[lo - start:hi - start] = self._partition(i)[lo - offsets[i]:hi - offsets[i]]
+        return out
+
+    def __array__(self, dtype=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+
+def window_obs(timestamps, longterm=False, piecewise_median_period_weeks=2, period=None, **kwargs):
+    # observations in the largest window detect_ts will analyse
+    from detect_ts import GRAN_STEP, _longterm_span, _longterm_windows
+    gran = get_gran_ns(timestamps)
+    # secondly data is summed to minutes in one pass over all of it
+    if not longterm or len(timestamps) < 2 or (period is None and gran not in GRAN_STEP):
+        return len(timestamps)
+    step = GRAN_STEP[gran] if period is None else sampling_interval(timestamps)
+    windows = _longterm_windows(timestamps, *_longterm_span(gran, step, piecewise_median_period_weeks))
+    return max(stop - start for start, stop in windows)
+
+
+def open_partitioned(paths, budget=DEFAULT_BUDGET, timestamp_column='timestamp',
+                     value_column='count', **kwargs):
+    """
+    A PartitionedSeries whose value cache gets what ``budget`` bytes leave after
+    the timestamps and the working set of detect_ts(**kwargs)'s largest window.
+    Raises ValueError when even one window doesn't fit.
+    """
+    series = PartitionedSeries(paths, timestamp_column, value_column, cache_bytes=0)
+    fixed = series.timestamps.nbytes + WINDOW_BYTES_PER_OBS * window_obs(series.timestamps, **kwargs)
+    if fixed > budget:
+        raise ValueError("%s needs a memory budget of at least %d bytes%s" % (
+            series.paths[0], fixed, '' if kwargs.get('longterm') else ', or longterm=True'))
+    series.values.cache_bytes = budget - fixed
+    return series
+
+
+def group_partitions(paths):
+    """
+    Directory -> sorted partition paths. Files in the same directory are the
+    partitions of one series, e.g. ``cpu/2015-01-01.csv``, ``cpu/2015-01-02.csv``.
+    """
+    groups = {}
+    for path in paths:
+        groups.setdefault(os.path.dirname(path), []).append(path)
+    return dict((series, sorted(files)) for series, files in groups.items())
+
+
+def detect_partitioned(inputs, budget=DEFAULT_BUDGET, timestamp_column='timestamp',
+                       value_column='count', shard=None, **kwargs):
+    """
+    Run detect_ts over partitioned series one at a time, within ``budget``
+    bytes of memory for each.
+
+    inputs : dict
+        Series name -> partition paths, e.g. from group_partitions.
+
+    shard : ShardSpec, 'index/count' or (index, count)
+        Only detect on the series whose names hash to this shard.
+
+    yields
+
+    (series, result) : (str, DetectionResult)
+    """
+    from detect_ts import detect_ts
+    from shard import as_shard
+    shard = as_shard(shard)
+    for series in sorted(inputs):
+        if shard is not None and series not in shard:
+            continue
+        source = open_partitioned(inputs[series], budget, timestamp_column, value_column, **kwargs)
+        yield series, detect_ts(source, **kwargs)
@@ -0,0 +1,100 @@
+import numpy as np
+
+# Seasonal period detection, for series whose granularity doesn't imply a period (e.g. 10 second
+# counters) or when the implied one is wrong.
+
+
+def _prepare(values):
+    # detrended with a least squares line, NaNs count as zero (the mean)
+    x = np.asarray(values, dtype=np.float64)
+    n = len(x)
+    finite = np.isfinite(x)
+    t = np.arange(n, dtype=np.float64)
+    if finite.sum() > 1:
+        slope, level = np.polyfit(t[finite], x[finite], 1)
+        x = x - (level + slope * t)
+    return np.where(finite, x, 0.0)
+
+
+def _spectrum(x):
+    # zero padded to at least 2n so the circular correlation doesn't wrap
+    size = 1 << int(np.ceil(np.log2(2 * len(x))))
+    return np.fft.rfft(x, size), size
+
+
+def autocorrelation(values, max_lag=None):
+    """
+    Sample autocorrelation of ``values`` at lags 0 .. max_lag, computed with an
+    FFT in O(n log n). The series is detrended with a least squares line first
+    and NaNs count as the mean.
+    """
+    x = _prepare(values)
+    if max_lag is None:
+        max_lag = len(x) - 1
+    spectrum, size = _spectrum(x)
+    return _acf(spectrum, size, max_lag)
+
+
+def _acf(spectrum, size, max_lag):
+    acf = np.fft.irfft(spectrum * np.conj(spectrum), size)[:max_lag + 1]
+    if acf[0] <= 0:
+        return np.zeros(max_lag + 1)
+    return acf / acf[0]
+
+
+def detect_period(values, min_period=2, max_period=None, min_correlation=0.2, preferred=()):
+    """
+    The most likely seasonal period of ``values``, in observations.
+
+    The strongest frequency of the periodogram with a period between
+    ``min_period`` and ``max_period`` (by default half the series, so there
+    are at least two periods of data) gives a first estimate, which is refined
+    to the lag with the highest autocorrelation within that frequency's
+    resolution. A ``preferred`` period, e.g. a day's worth of observations,
+    within 2% of the estimate is taken instead.
+
+    returns
+
+    period : int or None
+        None if the autocorrelation at the period is below ``min_correlation``.
+    """
+    x = _prepare(values)
+    n = len(x)
+    if max_period is None:
+        max_period = n // 2
+    max_period = min(max_period, n // 2)
+    if max_period < min_period:
+        return None
+
+    spectrum, size = _spectrum(x)
+    acf = _acf(spectrum, size, max_period)
+
+    # the padded spectrum's bin j has a period of size / j observations
+    bins = np.arange(int(np.ceil(size / float(max_period))), int(size / float(min_period)) + 1)
+    bins = bins[bins < len(spectrum)]
+    if len(bins) == 0:
+        return None
+    strongest = bins[np.argmax(np.abs(spectrum[bins]) ** 2)]
+    cycles = n * strongest / float(size)
+
+    # lags within half a cycle over the whole series of the estimate
+    lo = max(min_period, int(np.floor(n / (cycles + 0.5))))
+    hi = max_period if cycles <= 0.5 else min(max_period, int(np.ceil(n / (cycles - 0.5))))
+    best = lo + int(np.argmax(acf[lo:hi + 1]))
+
+    for period in preferred:
+        if min_period <= period <= max_period and abs(best - period) <= 0.02 * period:
+            best = int(period)
+            break
+
+    if acf[best] < min_correlation:
+        return None
+    return int(best)
+
+
+def sampling_interval(timestamps):
+    """The median interval between sorted int64 timestamps."""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if len(timestamps) < 2:
+        raise ValueError("need at least two timestamps for a sampling interval")
+    return int(np.median(np.diff(timestamps)))
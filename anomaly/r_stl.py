@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import threading
 
 from numpy import asarray, ceil
 import pandas
 import rpy2.robjects as robjects
 from rpy2.robjects.packages import importr
 
+# The embedded R interpreter isn't re-entrant, so calls into it are serialised
+# when stl is used from several threads.
+_r_lock = threading.Lock()
+
+def preload():
+    # start R and look up the functions stl uses, e.g. when warming up a worker process
+    with _r_lock:
+        robjects.r['ts']
+        robjects.r['stl']
+
+
 def stl(data, ns, np=None, nt=None, nl=None, isdeg=0, itdeg=1, ildeg=1,
         nsjump=None, ntjump=None, nljump=None, ni=2, no=0, fulloutput=False):
     """
@@ -106,8 +118,6 @@ def stl(data, ns, np=None, nt=None, nl=None, isdeg=0, itdeg=1, ildeg=1,
     # zoo package contains na.approx
 #    zoo_ = importr("zoo")
 
-    ts_ = robjects.r['ts']
-    stl_ = robjects.r['stl']
 #    naaction_ = robjects.r['na.approx']
 
     # # find out the period of the time series
@@ -134,18 +144,25 @@ def stl(data, ns, np=None, nt=None, nl=None, isdeg=0, itdeg=1, ildeg=1,
 
     # # convert data to R object
 
-    start = robjects.IntVector([data.index[0].year, data.index[0].month])
-    ts = ts_(robjects.FloatVector(asarray(data)), start=start, frequency=np)
-
     # if nt is None:
     #     nt = robjects.rinterface.R_NilValue
 
     # result = stl_(ts, ns, isdeg, nt, itdeg, nl, ildeg, nsjump, ntjump, nljump,
     #               True, ni, no, naaction_)
 
-    result = stl_(ts, "periodic", robust=True)
+    with _r_lock:
+        ts_ = robjects.r['ts']
+        stl_ = robjects.r['stl']
+
+        if isinstance(data.index, pandas.DatetimeIndex):
+            start = robjects.IntVector([data.index[0].year, data.index[0].month])
+        else:
+            start = robjects.IntVector([1, 1])
+        ts = ts_(robjects.FloatVector(asarray(data)), start=start, frequency=np)
+
+        result = stl_(ts, "periodic", robust=True)
 
-    res_ts = asarray(result[0])
+        res_ts = asarray(result[0])
     try:
         res_ts = pandas.DataFrame({"seasonal" : pandas.Series(res_ts[:,0],
                                                            index=data.index),
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Regular grids and gap filling for detect_anoms, on int64 timestamps and float arrays, in O(n)
+# NumPy passes without Python loops over the data.
+
+GAP_FILL = ['linear', 'seasonal']
+
+
+def regular_grid(timestamps, values, step):
+    """
+    Bin observations onto a grid with one point every ``step``, starting at the
+    first observation, like ``DataFrame.resample`` with the mean. Observations
+    sharing a bin are averaged; bins without any (and NaN values) are NaN. NaN
+    values at the ends don't extend the grid. A regularly spaced series maps
+    onto its own timestamps, at any ``step``.
+
+    returns
+
+    grid, grid_values : numpy.ndarray
+        int64 timestamps of the bins and the binned float64 values
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    timestamps, values = timestamps[valid], values[valid]
+    if len(timestamps) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    origin = timestamps.min()
+    bins = (timestamps - origin) // step
+    size = bins.max() + 1
+    sums = np.bincount(bins, weights=values, minlength=size)
+    counts = np.bincount(bins, minlength=size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grid_values = np.where(counts > 0, sums / counts, np.nan)
+    return origin + np.arange(size, dtype=np.int64) * step, grid_values
+
+
+def na_runs(missing):
+    """Starts and (exclusive) stops of the runs of True in a boolean array."""
+    edges = np.diff(np.concatenate([[0], np.asarray(missing, dtype=np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _gap_positions(starts, stops):
+    # every position inside the runs, with the index of the run it belongs to
+    lengths = stops - starts
+    run = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - offsets[run] + starts[run], run
+
+
+def fill_gaps(values, max_gap, method='linear', period=None):
+    """
+    Fill the runs of at most ``max_gap`` NaNs between two observations.
+
+    method : str
+        'linear' interpolates between the observations either side of the gap.
+        'seasonal' copies the same stretch of the previous (or, at the start,
+        the next) period and shifts it linearly to meet the observations either
+        side, falling back to 'linear' where that stretch has gaps itself.
+
+    returns
+
+    values, filled : numpy.ndarray
+        A float64 copy of ``values`` with the gaps filled, and a mask of the
+        positions that were filled.
+    """
+    if method not in GAP_FILL:
+        raise ValueError("gap_fill options are: %s." % ' | '.join(GAP_FILL))
+    values = np.array(values, dtype=np.float64)
+    n = len(values)
+    filled = np.zeros(n, dtype=bool)
+    missing = np.isnan(values)
+    if max_gap <= 0 or not missing.any():
+        return values, filled
+
+    starts, stops = na_runs(missing)
+    # runs at the ends have nothing to interpolate from
+    short = (stops - starts <= max_gap) & (starts > 0) & (stops < n)
+    starts, stops = starts[short], stops[short]
+    if len(starts) == 0:
+        return values, filled
+
+    positions, run = _gap_positions(starts, stops)
+    left, right = starts[run] - 1, stops[run]
+    fraction = (positions - left) / (right - left).astype(np.float64)
+    fill = values[left] + (values[right] - values[left]) * fraction
+
+    if method == 'seasonal' and period:
+        # the next period is only used where the previous one isn't available
+        for shift in (period, -period):
+            usable = (left + shift >= 0) & (right + shift < n)
+            lag, lag_left, lag_right = [np.clip(i + shift, 0, n - 1) for i in (positions, left, right)]
+            usable &= ~(missing[lag] | missing[lag_left] | missing[lag_right])
+            # the other period's values, offset by a line through the differences at the gap's ends
+            offset_left = values[left] - values[lag_left]
+            offset_right = values[right] - values[lag_right]
+            seasonal = values[lag] + offset_left + (offset_right - offset_left) * fraction
+            fill = np.where(usable, seasonal, fill)
+    values[positions] = fill
+    filled[positions] = True
+    return values, filled
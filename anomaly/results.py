@@ -0,0 +1,156 @@
+import numpy as np
+from pandas import DataFrame, DatetimeIndex
+
+# per-window bookkeeping kept alongside the anomalies, one row per detect_anoms call
+WINDOW_STATS_DTYPE = np.dtype([
+    ('start', 'i8'),
+    ('stop', 'i8'),
+    ('num_obs', 'i8'),
+    ('num_anoms', 'i8'),
+    ('num_reported', 'i8'),
+    # True when the window's anomalies came from a window cache instead of detect_anoms
+    ('cached', '?')
+])
+
+
+class DetectionResult(object):
+    """
+    Columnar container for the anomalies found by a detection run.
+
+    Each window handed to detect_anoms contributes one chunk of NumPy arrays
+    (positions into the input series, int64 nanosecond timestamps, observed
+    values and expected values). Chunks are only concatenated once, the first
+    time a column is read, and pandas objects are only built when ``anoms`` or
+    ``to_frame()`` is requested.
+
+    For backwards compatibility the result can still be indexed like the dict
+    previously returned by detect_ts: ``result['anoms']`` and ``result['plot']``.
+    """
+
+    def __init__(self, e_value=False, index_type='datetime'):
+        self.e_value = e_value
+        # 'datetime' for detect_ts, 'int' for detect_vec
+        self.index_type = index_type
+        self.plot = None
+        # BaselineModel of the most recent window, when detect_ts was asked for one
+        self.baseline = None
+        self._chunks = []
+        self._stats = []
+        self._columns = None
+        self._frame = None
+
+    def add_window(self, positions, timestamps, values, expected, start, stop,
+                   num_anoms, cached=False):
+        positions = np.asarray(positions, dtype=np.int64)
+        self._chunks.append((positions,
+                             np.asarray(timestamps, dtype=np.int64),
+                             np.asarray(values, dtype=np.float64),
+                             np.asarray(expected, dtype=np.float64)))
+        self._stats.append((start, stop, stop - start, num_anoms, len(positions), cached))
+        self._columns = None
+        self._frame = None
+
+    def _collect(self):
+        if self._columns is not None:
+            return self._columns
+
+        if self._chunks:
+            positions, timestamps, values, expected = [
+                np.concatenate(column) for column in zip(*self._chunks)]
+        else:
+            positions = np.empty(0, dtype=np.int64)
+            timestamps = np.empty(0, dtype=np.int64)
+            values = np.empty(0, dtype=np.float64)
+            expected = np.empty(0, dtype=np.float64)
+
+        # report in time order; longterm windows can overlap, so keep the
+        # first report of each timestamp
+        timestamps, first = np.unique(timestamps, return_index=True)
+        positions = positions[first]
+        values = values[first]
+        expected = expected[first]
+
+        self._columns = (positions, timestamps, values, expected)
+        return self._columns
+
+    def filter(self, mask):
+        """Keep only the anomalies selected by the boolean ``mask``."""
+        positions, timestamps, values, expected = self._collect()
+        self._columns = (positions[mask], timestamps[mask], values[mask],
+                         expected[mask])
+        self._chunks = [self._columns]
+        self._frame = None
+
+    @property
+    def positions(self):
+        return self._collect()[0]
+
+    @property
+    def timestamps(self):
+        return self._collect()[1]
+
+    @property
+    def values(self):
+        return self._collect()[2]
+
+    @property
+    def expected_values(self):
+        return self._collect()[3]
+
+    @property
+    def window_stats(self):
+        return np.array(self._stats, dtype=WINDOW_STATS_DTYPE)
+
+    @property
+    def count(self):
+        return len(self)
+
+    def __len__(self):
+        return len(self._collect()[0])
+
+    def to_frame(self):
+        """Materialize the anomalies as a DataFrame, building it at most once."""
+        if self._frame is not None:
+            return self._frame
+
+        positions, timestamps, values, expected = self._collect()
+        if self.index_type == 'datetime':
+            index = DatetimeIndex(timestamps)
+        else:
+            index = timestamps
+
+        columns = ['timestamp', 'anoms']
+        d = {
+            'timestamp': index,
+            'anoms': values
+        }
+        if self.e_value:
+            columns.append('expected_value')
+            d['expected_value'] = expected
+
+        self._frame = DataFrame(d, index=index, columns=columns)
+        return self._frame
+
+    @property
+    def anoms(self):
+        if len(self) == 0:
+            return None
+        return self.to_frame()
+
+    # dict style access kept for callers of the original API
+    def keys(self):
+        return ['anoms', 'plot']
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self.keys():
+            return default
+        return getattr(self, key)
+
+    def __repr__(self):
+        return '<DetectionResult: %d anomalies in %d windows>' % (
+            len(self), len(self._stats))
@@ -0,0 +1,197 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from date_utils import as_ns_array
+
+TIMESTAMPS_FILE = 'timestamps.bin'
+VALUES_FILE = 'values.bin'
+INDEX_FILE = 'index.bin'
+META_FILE = 'meta.json'
+
+FORMAT_VERSION = 1
+
+# the sparse time-range index keeps the first timestamp of every block
+DEFAULT_BLOCK_SIZE = 65536
+
+
+class SeriesStore(object):
+    """
+    On-disk columnar storage for a single <timestamp, count> series.
+
+    A store is a directory holding little-endian int64 nanosecond timestamps
+    and float32/float64 values as flat binary files, so both columns can be
+    memory-mapped, plus a sparse index of the first timestamp of every block
+    that narrows time-range lookups to a single block. ``meta.json`` records
+    the committed length and is rewritten last on append, so a crash during an
+    append never exposes a partially written tail.
+
+    Timestamps must be strictly increasing across appends.
+
+    path : str
+        Directory of the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError("unsupported series store version %s" % meta['version'])
+
+        self.dtype = np.dtype(meta['value_dtype'])
+        self.block_size = meta['block_size']
+        self._length = meta['length']
+        self._maps = None
+
+    @classmethod
+    def create(cls, path, dtype=np.float64, block_size=DEFAULT_BLOCK_SIZE):
+        """Create an empty store at ``path`` with values stored as ``dtype``."""
+        dtype = np.dtype(dtype)
+        if dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+            raise ValueError("dtype must be float32 or float64")
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in (TIMESTAMPS_FILE, VALUES_FILE, INDEX_FILE):
+            open(os.path.join(path, name), 'wb').close()
+
+        _write_meta(path, {
+            'version': FORMAT_VERSION,
+            'value_dtype': dtype.newbyteorder('<').str,
+            'block_size': int(block_size),
+            'length': 0
+        })
+        return cls(path)
+
+    @classmethod
+    def from_csv(cls, path, csv_path, dtype=np.float64, chunksize=1000000,
+                 usecols=('timestamp', 'count'), block_size=DEFAULT_BLOCK_SIZE):
+        """Stream a <timestamp, count> CSV into a new store, ``chunksize`` rows at a time."""
+        store = cls.create(path, dtype=dtype, block_size=block_size)
+        for chunk in pd.read_csv(csv_path, usecols=list(usecols), chunksize=chunksize):
+            store.append(chunk[usecols[0]], chunk[usecols[1]])
+        return store
+
+    def __len__(self):
+        return self._length
+
+    def __getstate__(self):
+        # pickle the path rather than the mapped data, e.g. when sent to a worker process
+        state = self.__dict__.copy()
+        state['_maps'] = None
+        return state
+
+    def _map(self):
+        if self._maps is None:
+            if self._length == 0:
+                self._maps = (np.empty(0, dtype='<i8'), np.empty(0, dtype=self.dtype),
+                              np.empty(0, dtype='<i8'))
+            else:
+                num_blocks = (self._length + self.block_size - 1) // self.block_size
+                self._maps = (
+                    np.memmap(os.path.join(self.path, TIMESTAMPS_FILE), dtype='<i8',
+                              mode='r', shape=(self._length,)),
+                    np.memmap(os.path.join(self.path, VALUES_FILE), dtype=self.dtype,
+                              mode='r', shape=(self._length,)),
+                    np.fromfile(os.path.join(self.path, INDEX_FILE), dtype='<i8',
+                                count=num_blocks)
+                )
+        return self._maps
+
+    @property
+    def timestamps(self):
+        """Memory-mapped int64 nanosecond timestamps."""
+        return self._map()[0]
+
+    @property
+    def values(self):
+        """Memory-mapped values."""
+        return self._map()[1]
+
+    def append(self, timestamps, values):
+        """Append observations, which must all be later than the last stored timestamp."""
+        timestamps = np.ascontiguousarray(as_ns_array(timestamps), dtype='<i8')
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+
+        if len(timestamps) != len(values):
+            raise ValueError("timestamps and values must be the same length")
+        if len(timestamps) == 0:
+            return
+
+        if np.any(np.diff(timestamps) <= 0):
+            raise ValueError("timestamps must be strictly increasing")
+        if self._length and timestamps[0] <= self.timestamps[-1]:
+            raise ValueError("appended timestamps must be later than the last stored timestamp")
+
+        old_length = self._length
+        new_length = old_length + len(timestamps)
+
+        # first timestamp of every block that starts inside the appended range
+        first_block = (old_length + self.block_size - 1) // self.block_size
+        block_starts = np.arange(first_block * self.block_size, new_length, self.block_size)
+        index = timestamps[block_starts - old_length]
+
+        self._maps = None
+        _append_file(os.path.join(self.path, TIMESTAMPS_FILE), timestamps, old_length)
+        _append_file(os.path.join(self.path, VALUES_FILE), values, old_length)
+        _append_file(os.path.join(self.path, INDEX_FILE), index, first_block)
+
+        with open(os.path.join(self.path, META_FILE)) as f:
+            meta = json.load(f)
+        meta['length'] = new_length
+        _write_meta(self.path, meta)
+        self._length = new_length
+
+    def locate(self, start=None, end=None):
+        """Positions (i, j) such that timestamps[i:j] covers start <= timestamp < end."""
+        timestamps, _, index = self._map()
+        i = 0 if start is None else self._search(timestamps, index, _as_ns(start))
+        j = self._length if end is None else self._search(timestamps, index, _as_ns(end))
+        return i, max(i, j)
+
+    def _search(self, timestamps, index, t):
+        # find the block in the sparse index, then only search inside that block
+        block = max(int(np.searchsorted(index, t, side='right')) - 1, 0)
+        lo = block * self.block_size
+        hi = min(lo + self.block_size, self._length)
+        return lo + int(np.searchsorted(timestamps[lo:hi], t, side='left'))
+
+    def window(self, start=None, end=None):
+        """Memory-mapped (timestamps, values) views for start <= timestamp < end."""
+        i, j = self.locate(start, end)
+        timestamps, values, _ = self._map()
+        return timestamps[i:j], values[i:j]
+
+    def to_frame(self, start=None, end=None):
+        """Load start <= timestamp < end as a <timestamp, count> DataFrame."""
+        timestamps, values = self.window(start, end)
+        return pd.DataFrame({
+            'timestamp': np.asarray(timestamps).view('M8[ns]'),
+            'count': np.asarray(values)
+        }, columns=['timestamp', 'count'])
+
+    def __repr__(self):
+        return '<SeriesStore %s: %d observations, %s>' % (self.path, self._length, self.dtype)
+
+
+def _as_ns(t):
+    if isinstance(t, (int, long, np.integer)):
+        return int(t)
+    return pd.Timestamp(t).value
+
+
+def _append_file(path, array, committed):
+    # drop anything past the committed length (left by an interrupted append), then append
+    with open(path, 'r+b') as f:
+        f.truncate(committed * array.dtype.itemsize)
+        f.seek(0, os.SEEK_END)
+        array.tofile(f)
+
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, META_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.rename(tmp, os.path.join(path, META_FILE))
@@ -0,0 +1,427 @@
+import argparse
+import json
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from Queue import Queue, Empty
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import cpu_count
+from StringIO import StringIO
+
+import numpy as np
+import pandas as pd
+
+from date_utils import parse_timestamps, get_gran_ns
+from detect_ts import detect_ts
+from batch import preload
+from esd import as_early_stop
+from decomposition import as_seasonal_periods, backends, get_backend
+from worker_pool import WorkerPool
+
+# detect_ts parameters a request may set, and how to read them from a query string
+PARAMS = {
+    'max_anoms': float,
+    'direction': str,
+    'alpha': float,
+    'only_last': str,
+    'threshold': str,
+    'e_value': lambda v: v if isinstance(v, bool) else v.lower() in ('1', 'true', 'yes'),
+    'longterm': lambda v: v if isinstance(v, bool) else v.lower() in ('1', 'true', 'yes'),
+    'piecewise_median_period_weeks': int,
+    'decomposition': str,
+    'max_gap': int,
+    'gap_fill': str,
+    'period': lambda v: v if v == 'auto' or isinstance(v, int) else int(v),
+    'approximate': lambda v: v if isinstance(v, bool) else v.lower() in ('1', 'true', 'yes'),
+    'early_stop': as_early_stop,
+    'seasonal_periods': as_seasonal_periods
+}
+
+GRAN_ORDER = {'ms': 0, 'sec': 1, 'min': 2, 'hr': 3, 'day': 4}
+
+
+def _run_batch(jobs):
+    # runs in a worker; a single bad series can't fail its batch, and anything that escapes the series
+    # fails the whole batch, returned for the callback to pass on to its requests (a worker that dies
+    # fails its task's future instead)
+    try:
+        results = []
+        for timestamps, values, params in jobs:
+            try:
+                df = pd.DataFrame({'timestamp': timestamps.view('M8[ns]'), 'count': values},
+                                  columns=['timestamp', 'count'])
+                result = detect_ts(df, **params)
+                results.append(('ok', (result.timestamps, result.values, result.expected_values)))
+            except Exception as e:
+                results.append(('error', (type(e).__name__, str(e))))
+        return 'ok', results
+    except BaseException as e:
+        return 'error', (type(e).__name__, str(e))
+
+
+class ServiceStats(object):
+    """Thread-safe request, batch and latency counters for the /stats endpoint."""
+
+    def __init__(self, window=10000):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._latencies = deque(maxlen=window)
+        self._batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+
+    def record_request(self, latency, error=False):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            self._latencies.append(latency)
+
+    def record_batch(self, size):
+        with self._lock:
+            self.batches += 1
+            self._batch_sizes.append(size)
+
+    def snapshot(self):
+        with self._lock:
+            uptime = time.time() - self._started
+            latencies = np.array(self._latencies) * 1000.0
+            batch_sizes = np.array(self._batch_sizes)
+            stats = {
+                'uptime_s': uptime,
+                'requests': self.requests,
+                'errors': self.errors,
+                'batches': self.batches,
+                'throughput_rps': self.requests / uptime if uptime > 0 else 0.0,
+                'mean_batch_size': float(batch_sizes.mean()) if len(batch_sizes) else 0.0
+            }
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats['latency_ms'] = {'p50': p50, 'p95': p95, 'p99': p99,
+                                   'max': float(latencies.max())}
+        else:
+            stats['latency_ms'] = {}
+        return stats
+
+
+class MicroBatcher(object):
+    """
+    Coalesce concurrently submitted series into batches.
+
+    The first job to arrive opens a batch. Jobs arriving within ``max_delay``
+    seconds, up to ``max_batch_size`` in total, join it. Jobs are grouped by
+    period (the series granularity), length bucket (the next power of two) and
+    detection parameters, and each group is handed to ``dispatch`` as a list.
+    """
+
+    def __init__(self, dispatch, max_batch_size=32, max_delay=0.005):
+        self._dispatch = dispatch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run, name='anomaly-batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def batch_key(timestamps, params):
+        gran = get_gran_ns(timestamps) if len(timestamps) > 1 else 'day'
+        length_bucket = 1 << int(max(len(timestamps) - 1, 1)).bit_length()
+        return (GRAN_ORDER[gran], length_bucket, tuple(sorted(params.items())))
+
+    def submit(self, timestamps, values, params):
+        future = Future()
+        self._queue.put((self.batch_key(timestamps, params), (timestamps, values, params), future))
+        return future
+
+    def stop(self):
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            groups = {}
+            count = 0
+            deadline = time.time() + self.max_delay
+            while item is not None:
+                key, job, future = item
+                groups.setdefault(key, []).append((job, future))
+                count += 1
+                if count >= self.max_batch_size:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+
+            for jobs in groups.values():
+                self._dispatch(jobs)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.service.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, code, body):
+        payload = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        if path == '/stats':
+            self._send(200, self.server.service.stats.snapshot())
+        elif path == '/health':
+            self._send(200, {'status': 'ok'})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != '/detect':
+            self._send(404, {'error': 'not found'})
+            return
+
+        started = time.time()
+        service = self.server.service
+        body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        try:
+            timestamps, values, params = parse_request(
+                body, self.headers.getheader('Content-Type', ''), url.query)
+            params.setdefault('decomposition', service.decomposition)
+            future = service.batcher.submit(timestamps, values, params)
+            status, payload = future.result(timeout=service.request_timeout)
+        except Exception as e:
+            status, payload = 'error', (type(e).__name__, str(e))
+
+        if status == 'ok':
+            code, response = 200, format_anomalies(*payload)
+        elif payload[0] in ('ValueError', 'KeyError', 'TypeError'):
+            code, response = 400, {'error': payload[1]}
+        else:
+            code, response = 500, {'error': '%s: %s' % payload}
+
+        service.stats.record_request(time.time() - started, error=code != 200)
+        self._send(code, response)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def parse_request(body, content_type, query=''):
+    """
+    Parse a detection request into (timestamps, values, params).
+
+    JSON bodies hold either ``timestamps`` and ``values`` lists or ``data``, a
+    list of [timestamp, value] pairs, plus optional ``params``. CSV bodies hold
+    a header and <timestamp, count> rows, with parameters in the query string.
+    Timestamps are date strings or epoch seconds.
+    """
+    params = {}
+    for name, value in urlparse.parse_qsl(query):
+        if name not in PARAMS:
+            raise ValueError("unknown parameter %s" % name)
+        params[name] = PARAMS[name](value)
+
+    if 'csv' in content_type:
+        df = pd.read_csv(StringIO(body))
+        if len(df.columns) != 2:
+            raise ValueError("CSV input must have a timestamp and a value column")
+        timestamps, values = df.iloc[:, 0].values, df.iloc[:, 1].values
+    else:
+        request = json.loads(body)
+        if 'data' in request:
+            pairs = request['data']
+            timestamps = [pair[0] for pair in pairs]
+            values = [pair[1] for pair in pairs]
+        else:
+            timestamps, values = request['timestamps'], request['values']
+        for name, value in request.get('params', {}).items():
+            if name not in PARAMS:
+                raise ValueError("unknown parameter %s" % name)
+            params[name] = PARAMS[name](value)
+
+    timestamps = parse_timestamps(timestamps)
+    values = np.asarray(values, dtype=np.float64)
+    if len(timestamps) != len(values):
+        raise ValueError("timestamps and values must be the same length")
+    return timestamps, values, params
+
+
+def format_anomalies(timestamps, values, expected):
+    isoformat = [t.isoformat() for t in pd.DatetimeIndex(timestamps)]
+    anoms = []
+    for i in range(len(timestamps)):
+        anom = {'timestamp': isoformat[i], 'value': float(values[i])}
+        if not np.isnan(expected[i]):
+            anom['expected_value'] = float(expected[i])
+        anoms.append(anom)
+    return {'count': len(anoms), 'anoms': anoms}
+
+
+class DetectionService(object):
+    """
+    Local HTTP front end for detect_ts with request micro-batching.
+
+    ``POST /detect`` takes a JSON or CSV series and returns its anomalies,
+    ``GET /stats`` reports throughput, batch sizes and latency percentiles,
+    ``GET /health`` is a liveness check. Requests that arrive together are
+    coalesced by MicroBatcher and each batch is split evenly over a warm
+    worker pool, whose processes import the detection stack (and start R for
+    r_stl) once.
+
+    host, port : str, int
+        Address to bind; port 0 picks a free port. Defaults to localhost only.
+
+    workers : int
+        Worker pool size, defaults to the number of CPUs.
+
+    pool : str
+        'process' or 'thread'.
+
+    decomposition : str
+        Decomposition backend the workers load up front, and the default for
+        requests that don't set one. Other backends load on first use.
+
+    max_batch_size, max_delay
+        See MicroBatcher.
+
+    request_timeout : float
+        Seconds a request waits for its batch before failing.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, workers=None, pool='process', decomposition='r_stl',
+                 max_batch_size=32, max_delay=0.005, request_timeout=300, verbose=False):
+        if pool not in ('process', 'thread'):
+            raise ValueError("pool must be either 'process' or 'thread'")
+        get_backend(decomposition)
+
+        self.decomposition = decomposition
+
+        self.verbose = verbose
+        self.request_timeout = request_timeout
+        self.stats = ServiceStats()
+        self.workers = workers = workers or cpu_count()
+
+        if pool == 'process':
+            self._pool = WorkerPool(workers, initializer=preload, initargs=(decomposition,))
+        else:
+            preload(decomposition)
+            self._pool = ThreadPoolExecutor(max_workers=workers)
+
+        self.batcher = MicroBatcher(self._dispatch, max_batch_size=max_batch_size,
+                                    max_delay=max_delay)
+        self._server = _ThreadingHTTPServer((host, port), _Handler)
+        self._server.service = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.address
+
+    def _dispatch(self, jobs):
+        self.stats.record_batch(len(jobs))
+        # one task per worker, rather than the whole batch queueing up in a single one
+        share = -(-len(jobs) // self.workers)
+        for start in range(0, len(jobs), share):
+            self._submit(jobs[start:start + share])
+
+    def _submit(self, jobs):
+        payloads = [job for job, _ in jobs]
+        futures = [future for _, future in jobs]
+
+        def fail(error):
+            for future in futures:
+                future.set_exception(error)
+
+        def deliver(outcome):
+            status, payload = outcome
+            if status == 'error':
+                fail(RuntimeError('batch failed with %s: %s' % payload))
+                return
+            for future, result in zip(futures, payload):
+                future.set_result(result)
+
+        def done(task):
+            try:
+                outcome = task.result()
+            except BaseException as e:
+                fail(e)
+            else:
+                deliver(outcome)
+
+        self._pool.submit(_run_batch, payloads).add_done_callback(done)
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='anomaly-http')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self.batcher.stop()
+        if isinstance(self._pool, WorkerPool):
+            self._pool.terminate()
+        else:
+            self._pool.shutdown(wait=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local anomaly detection HTTP service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--pool', choices=['process', 'thread'], default='process')
+    parser.add_argument('--decomposition', choices=backends(), default='r_stl',
+                        help='decomposition backend to preload and use by default (default: r_stl)')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-delay', type=float, default=0.005,
+                        help='seconds to wait for more requests to join a batch')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    service = DetectionService(host=args.host, port=args.port, workers=args.workers,
+                               pool=args.pool, decomposition=args.decomposition,
+                               max_batch_size=args.max_batch_size,
+                               max_delay=args.max_delay, verbose=args.verbose)
+    print 'Serving anomaly detection on %s' % service.url
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import hashlib
+import os
+from collections import namedtuple
+
+# Deterministic sharding of a fleet of series between machines (or processes) that don't talk to
+# each other: every series belongs to the shard its id hashes to, so each node only needs its own
+# (index, count) to know which series are its own.
+
+
+def shard_of(series, count):
+    """
+    The shard, of ``count``, a series id belongs to: the first 64 bits of the
+    MD5 of the id, modulo ``count``. Unlike hash() this is the same on every
+    machine, process and Python version.
+    """
+    if isinstance(series, unicode):
+        series = series.encode('utf-8')
+    else:
+        series = str(series)
+    return int(int(hashlib.md5(series).hexdigest()[:16], 16) % count)
+
+
+class ShardSpec(namedtuple('ShardSpec', ['index', 'count'])):
+    """
+    Shard ``index`` of ``count``, written 'index/count'. ``series in shard``
+    tells whether a series id belongs to it.
+    """
+    __slots__ = ()
+
+    def __new__(cls, index, count):
+        index, count = int(index), int(count)
+        if count < 1 or not 0 <= index < count:
+            raise ValueError("shard must be index/count with 0 <= index < count, not %d/%d" % (index, count))
+        return super(ShardSpec, cls).__new__(cls, index, count)
+
+    @classmethod
+    def parse(cls, spec):
+        try:
+            index, count = spec.split('/')
+            return cls(index, count)
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError("shard must be index/count, e.g. 0/4, not %r" % (spec,))
+
+    def __contains__(self, series):
+        return shard_of(series, self.count) == self.index
+
+    def __str__(self):
+        return '%d/%d' % self
+
+
+def as_shard(shard):
+    """A ShardSpec from a ShardSpec, 'index/count' or (index, count), or None."""
+    if shard is None or isinstance(shard, ShardSpec):
+        return shard
+    if isinstance(shard, basestring):
+        return ShardSpec.parse(shard)
+    return ShardSpec(*shard)
+
+
+def shard_path(path, shard):
+    """``path`` with the shard before its extension: out.csv -> out.shard-0-of-4.csv."""
+    root, ext = os.path.splitext(path)
+    return '%s.shard-%d-of-%d%s' % (root, shard.index, shard.count, ext)
@@ -0,0 +1,137 @@
+import numpy as np
+from date_utils import DAY_NS
+
+# A KLL quantile sketch (Karnin, Lang & Liberty, 2016) for the daily maxima behind the med_max, p95 and
+# p99 thresholds, so that they can be computed in bounded memory from a stream of blocks, and combined
+# from the shards or partitions of a series processed separately.
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch of a stream of floats.
+
+    Items are kept in levels, those at level h standing for 2**h items of
+    the stream. A full level is sorted and every other item of it promoted to
+    the next level, alternating between the odd and even ones. Up to ``k``
+    items are kept exactly and quantiles are the same as NumPy's; past that
+    the sketch holds O(k) items and the rank error is O(1/k).
+
+    k : int
+        Size of the largest level, at least 8.
+    """
+
+    def __init__(self, k=2048):
+        if k < 8:
+            raise ValueError("k must be at least 8")
+        self.k = int(k)
+        self.levels = [np.empty(0)]
+        self._offset = 0
+
+    def _capacity(self, h):
+        return max(2, int(np.ceil(self.k * (2 / 3.) ** (len(self.levels) - 1 - h))))
+
+    def _compress(self):
+        while sum(len(items) for items in self.levels) > sum(self._capacity(h) for h in range(len(self.levels))):
+            for h, items in enumerate(self.levels):
+                if len(items) < self._capacity(h):
+                    continue
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item out stays behind
+                self.levels[h] = items[len(items) - len(items) % 2:]
+                promoted = items[self._offset:len(items) - len(items) % 2:2]
+                self._offset = 1 - self._offset
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                break
+
+    def update(self, values):
+        """Add values, ignoring NaNs. Returns the sketch."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.levels[0] = np.concatenate([self.levels[0], values[~np.isnan(values)]])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Add the items of another sketch. Returns this sketch."""
+        for h, items in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self._compress()
+        return self
+
+    @property
+    def count(self):
+        """Number of values the sketch stands for."""
+        return sum(len(items) << h for h, items in enumerate(self.levels))
+
+    def __len__(self):
+        return self.count
+
+    def quantile(self, q):
+        """
+        The q-quantile, 0 <= q <= 1, interpolated linearly between ranks like
+        numpy.percentile. NaN if the sketch is empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+        weights = np.concatenate([np.full(len(items), 1 << h, dtype=np.int64)
+                                  for h, items in enumerate(self.levels)])
+        items = np.concatenate(self.levels)
+        if len(items) == 0:
+            return np.nan
+        order = np.argsort(items, kind='mergesort')
+        items = items[order]
+        # the last rank each item stands for
+        ranks = np.cumsum(weights[order]) - 1
+        position = q * ranks[-1]
+        lo = items[np.searchsorted(ranks, np.floor(position))]
+        hi = items[np.searchsorted(ranks, np.ceil(position))]
+        above = position - np.floor(position)
+        return lo * (1 - above) + hi * above
+
+    def to_dict(self):
+        return {'k': self.k, 'offset': self._offset, 'levels': [items.tolist() for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['k'])
+        sketch._offset = state['offset']
+        sketch.levels = [np.asarray(items, dtype=np.float64) for items in state['levels']]
+        return sketch
+
+    def __repr__(self):
+        return '<QuantileSketch: %d values in %d items>' % (self.count, sum(len(items) for items in self.levels))
+
+
+# the quantile of the daily maxima each detect_ts threshold filters on
+THRESHOLD_QUANTILES = {'med_max': 0.5, 'p95': 0.95, 'p99': 0.99}
+
+
+def daily_max_sketch(timestamps, values, sketch=None, block_size=1 << 20):
+    """
+    Add the maximum of each day of a series to a QuantileSketch (a new one by
+    default) and return it. The series is read a block at a time, so mapped or
+    partitioned histories aren't loaded whole. Sketches of shards split at day
+    boundaries can be merged into the sketch of the whole series.
+    """
+    if sketch is None:
+        sketch = QuantileSketch()
+    last_day = None
+    pending = None
+    for lo in range(0, len(timestamps), block_size):
+        days = np.asarray(timestamps[lo:lo + block_size]) // DAY_NS
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        maxes = np.fmax.reduceat(np.asarray(values[lo:lo + block_size], dtype=np.float64), starts)
+        # a day can straddle two blocks, so the last one is only added once the next block starts
+        if days[0] == last_day:
+            maxes[0] = np.fmax(maxes[0], pending)
+        elif pending is not None:
+            sketch.update([pending])
+        sketch.update(maxes[:-1])
+        pending = maxes[-1]
+        last_day = days[-1]
+    if pending is not None:
+        sketch.update([pending])
+    return sketch
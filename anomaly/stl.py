@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import numpy
+import pandas
+import kernels
+
+# A NumPy port of the Fortran behind R's stl() (Cleveland, Cleveland, McRae & Terpenning, 1990).
+# The loops over fitting points are vectorized: every LOESS fit a smoother makes is a row of a
+# (fits x window) weight matrix, and the cycle-subseries of the seasonal smoother are the columns
+# of a (cycles x period) matrix smoothed all at once. Positions in the comments and the window
+# arithmetic are 1-based, as in the Fortran, so the two can be read side by side.
+
+# the weight matrices are built in blocks of at most this many elements
+_BLOCK = 1 << 20
+
+
+def _nextodd(x):
+    x = int(round(x))
+    return x + 1 if x % 2 == 0 else x
+
+
+def _loess_at(y, n, length, degree, xs, nleft, width, rw=None):
+    # stlest: local fits of y (n x m) at positions xs, each over the window nleft .. nleft+width-1.
+    # Returns the fitted values (fits x m) and whether each fit had any weight.
+    m = y.shape[1]
+    if kernels.ENABLED:
+        y = numpy.ascontiguousarray(y, dtype=numpy.float64)
+        values = numpy.empty((len(xs), m))
+        ok = numpy.empty((len(xs), m), dtype=bool)
+        kernels.loess_fit(y, n, length, degree, numpy.asarray(xs, dtype=numpy.float64),
+                          numpy.asarray(nleft, dtype=numpy.int64), width,
+                          y if rw is None else numpy.ascontiguousarray(rw), rw is not None, values, ok)
+        return values, ok
+    block = max(1, _BLOCK // (width * m))
+    values = numpy.empty((len(xs), m))
+    ok = numpy.empty((len(xs), m), dtype=bool)
+    for s in range(0, len(xs), block):
+        x = xs[s:s + block, None]
+        left = nleft[s:s + block, None]
+        J = left + numpy.arange(width)
+        h = numpy.maximum(x - left, left + (width - 1) - x)
+        if length > n:
+            h = h + (length - n) // 2
+        r = numpy.abs(J - x)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            w = numpy.where(r <= 0.001 * h, 1.0, (1.0 - (r / h) ** 3) ** 3)
+        w[r > 0.999 * h] = 0.0
+        w = w[:, :, None]
+        if rw is not None:
+            w = w * rw[J - 1]
+        a = w.sum(axis=1)
+        fitted = a > 0
+        w = w / numpy.where(fitted, a, 1.0)[:, None, :]
+        if degree > 0:
+            Jf = J[:, :, None].astype(numpy.float64)
+            center = (w * Jf).sum(axis=1)[:, None, :]
+            c = (w * (Jf - center) ** 2).sum(axis=1)[:, None, :]
+            adjust = (h[:, :, None] > 0) & (numpy.sqrt(c) > 0.001 * (n - 1))
+            b = numpy.where(adjust, (x[:, :, None] - center) / numpy.where(adjust, c, 1.0), 0.0)
+            w = w * (b * (Jf - center) + 1.0)
+        values[s:s + block] = (w * y[J - 1]).sum(axis=1)
+        ok[s:s + block] = fitted
+    return values, ok
+
+
+def _loess(y, length, degree, jump, rw=None):
+    # stless: LOESS smooth of each column of y (n x m), fitted every jump points and linearly
+    # interpolated in between
+    n = y.shape[0]
+    if n < 2:
+        return y.copy()
+    jump = min(jump, n - 1)
+    positions = numpy.arange(1, n + 1, jump)
+    if length >= n:
+        nleft = numpy.ones(len(positions), dtype=numpy.int64)
+        width = n
+    else:
+        nsh = (length + 1) // 2
+        nleft = numpy.clip(positions - nsh + 1, 1, n - length + 1)
+        width = length
+    if positions[-1] != n:
+        # the last point is fitted over the window of the last fitting point
+        positions = numpy.append(positions, n)
+        nleft = numpy.append(nleft, nleft[-1])
+
+    fitted, ok = _loess_at(y, n, length, degree, positions.astype(numpy.float64), nleft, width, rw)
+    fitted = numpy.where(ok, fitted, y[positions - 1])
+    if jump == 1:
+        return fitted
+
+    i = numpy.arange(1, n + 1)
+    segment = numpy.minimum(numpy.searchsorted(positions, i, side='right') - 1, len(positions) - 2)
+    left, right = positions[segment], positions[segment + 1]
+    delta = (fitted[segment + 1] - fitted[segment]) / (right - left)[:, None]
+    smoothed = fitted[segment] + delta * (i - left)[:, None]
+    smoothed[positions - 1] = fitted
+    return smoothed
+
+
+def _cycle_subseries(y, period, ns, isdeg, nsjump, rw=None):
+    # stlss: smooth each cycle-subseries and extend it by one cycle at both ends, giving
+    # n + 2 * period values
+    n = len(y)
+    season = numpy.empty(n + 2 * period)
+    q, r = divmod(n, period)
+    for columns, k in ((numpy.arange(r), q + 1), (numpy.arange(r, period), q)):
+        if len(columns) == 0:
+            continue
+        rows = numpy.arange(k)[:, None] * period + columns
+        sub = y[rows]
+        sub_rw = None if rw is None else rw[rows]
+        smoothed = _loess(sub, ns, isdeg, nsjump, sub_rw)
+
+        width = min(ns, k)
+        ends = numpy.array([0.0, k + 1.0])
+        nleft = numpy.array([1, max(1, k - ns + 1)])
+        extended, ok = _loess_at(sub, k, ns, isdeg, ends, nleft, width, sub_rw)
+        first = numpy.where(ok[0], extended[0], smoothed[0])
+        last = numpy.where(ok[1], extended[1], smoothed[-1])
+
+        out = numpy.arange(k + 2)[:, None] * period + columns
+        season[out] = numpy.vstack([first, smoothed, last])
+    return season
+
+
+def _moving_average(x, length):
+    # stlma
+    total = numpy.concatenate([[0.0], numpy.cumsum(x)])
+    return (total[length:] - total[:-length]) / float(length)
+
+
+def _robustness_weights(y, fit):
+    # stlrwt: bisquare weights of the residuals, scaled by 6 MADs
+    r = numpy.abs(y - fit)
+    cmad = 6.0 * numpy.median(r)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rw = numpy.where(r <= 0.001 * cmad, 1.0, (1.0 - (r / cmad) ** 2) ** 2)
+    rw[r > 0.999 * cmad] = 0.0
+    return rw
+
+
+def stl_arrays(y, np, ns, nt, nl, isdeg, itdeg, ildeg, nsjump, ntjump, nljump, ni, no):
+    """
+    The seasonal and trend components of the 1-d float array y, see stl for the arguments.
+    """
+    y = numpy.asarray(y, dtype=numpy.float64)
+    n = len(y)
+    np = max(2, np)
+    ns, nt, nl = [max(3, v) + (1 - max(3, v) % 2) for v in (ns, nt, nl)]
+
+    trend = numpy.zeros(n)
+    rw = None
+    for outer in range(no + 1):
+        for inner in range(ni):
+            # stlstp
+            c = _cycle_subseries(y - trend, np, ns, isdeg, nsjump, rw)
+            low_pass = _moving_average(_moving_average(_moving_average(c, np), np), 3)
+            low_pass = _loess(low_pass[:, None], nl, ildeg, nljump)[:, 0]
+            season = c[np:np + n] - low_pass
+            trend = _loess((y - season)[:, None], nt, itdeg, ntjump,
+                           None if rw is None else rw[:, None])[:, 0]
+        if outer < no:
+            rw = _robustness_weights(y, trend + season)
+    return season, trend
+
+
+def stl(data, ns, np=None, nt=None, nl=None, isdeg=0, itdeg=1, ildeg=1,
+        nsjump=None, ntjump=None, nljump=None, ni=None, no=None, robust=True):
+    """
+    Seasonal-Trend decomposition procedure based on LOESS, in NumPy
+
+    Takes the arguments of r_stl.stl, with R's defaults, and returns the same
+    decomposition as R's ``stl(ts(data, frequency=np), s.window=ns,
+    robust=robust)`` up to floating point rounding.
+
+    data : pandas.Series, without missing values
+
+    ns : int or "periodic"
+        Length of the seasonal smoother, an odd integer >= 3. With "periodic"
+        the seasonal component is the mean of each point in the cycle.
+
+    np : int
+        Period of the seasonal component.
+
+    nt, nl : int
+        Lengths of the trend and low-pass smoothers. If None, the smallest odd
+        integers >= 1.5*np/(1-1.5/ns) and >= np.
+
+    isdeg, itdeg, ildeg : int
+        Degree, 0 or 1, of the seasonal, trend and low-pass smoothers.
+
+    nsjump, ntjump, nljump : int
+        Skipping values of the smoothers, which fit every n-th point and
+        interpolate in between. If None, 10% of the smoother length.
+
+    ni, no : int
+        Number of inner loops and robustness iterations. If None, 1 and 15
+        for robust fitting, 2 and 0 otherwise.
+
+    robust : bool
+        Sets the defaults of ni and no.
+
+    returns
+
+    data : pandas.DataFrame
+        The seasonal, trend, and remainder components
+    """
+    y = numpy.asarray(data, dtype=numpy.float64)
+    n = len(y)
+    if numpy.isnan(y).any():
+        raise ValueError("stl can't decompose series with missing values")
+    if np is None or np < 2 or n <= 2 * np:
+        raise ValueError("stl needs a period of at least 2 and more than 2 periods worth of data")
+
+    periodic = ns == 'periodic'
+    if periodic:
+        ns = 10 * n + 1
+        isdeg = 0
+    if nt is None:
+        nt = _nextodd(numpy.ceil(1.5 * np / (1 - 1.5 / ns)))
+    if nl is None:
+        nl = _nextodd(np)
+    if nsjump is None:
+        nsjump = int(numpy.ceil(ns / 10.))
+    if ntjump is None:
+        ntjump = int(numpy.ceil(nt / 10.))
+    if nljump is None:
+        nljump = int(numpy.ceil(nl / 10.))
+    if ni is None:
+        ni = 1 if robust else 2
+    if no is None:
+        no = 15 if robust else 0
+
+    seasonal, trend = stl_arrays(y, np, ns, nt, nl, isdeg, itdeg, ildeg,
+                                 nsjump, ntjump, nljump, ni, no)
+    if periodic:
+        phase = numpy.arange(n) % np
+        seasonal = (numpy.bincount(phase, weights=seasonal, minlength=np) /
+                    numpy.bincount(phase, minlength=np))[phase]
+
+    return pandas.DataFrame({'seasonal': seasonal,
+                             'trend': trend,
+                             'remainder': y - seasonal - trend},
+                            index=data.index, columns=['seasonal', 'trend', 'remainder'])
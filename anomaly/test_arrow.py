@@ -0,0 +1,151 @@
+from nose.tools import eq_, ok_, assert_raises
+from nose.plugins.skip import SkipTest
+from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly import arrow
+from anomaly.arrow import ArrowSeries, split_series, detect_arrow, result_table, ParquetAnomalyWriter, \
+    arrow_values
+from anomaly.cli import main
+
+class TestArrow(TestCase):
+    def setUp(self):
+        if arrow.pa is None:
+            raise SkipTest("pyarrow is not available")
+        self.pa, self.pq = arrow.pa, arrow.pq
+        path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        # hourly sums keep the runs short
+        raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp']).values.astype('M8[h]')
+        self.raw_data = raw_data.groupby('timestamp', as_index=False).sum()
+        self.timestamps = self.raw_data['timestamp'].values.view('i8')
+        self.values = self.raw_data['count'].values.astype(np.float64)
+        self.expected = anomaly.detect_ts(self.raw_data, max_anoms=0.05, direction='both')
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def table(self, timestamps=None, values=None, unit='ns', **columns):
+        timestamps = self.timestamps if timestamps is None else timestamps
+        arrays = [self.pa.array(timestamps // arrow.TIME_UNIT_NS[unit], type=self.pa.timestamp(unit)),
+                  self.pa.array(self.values if values is None else values)]
+        names = ['timestamp', 'count']
+        for name, column in sorted(columns.items()):
+            arrays.append(self.pa.array(column))
+            names.append(name)
+        return self.pa.Table.from_arrays(arrays, names)
+
+    def assert_same(self, result, expected):
+        eq_(list(result.timestamps), list(expected.timestamps))
+        ok_(np.allclose(result.values, expected.values))
+
+    def test_columns_are_views(self):
+        series = ArrowSeries.from_arrow(self.table())
+        ok_(np.array_equal(series.timestamps, self.timestamps))
+        ok_(np.array_equal(series.values, self.values))
+        for column in (series.timestamps, series.values):
+            ok_(not column.flags.owndata)
+            ok_(not column.flags.writeable)
+
+    def test_conversions(self):
+        # coarser units, integer values, nulls and several chunks are converted
+        series = ArrowSeries.from_arrow(self.table(unit='s', values=self.values.astype(np.int64)))
+        ok_(np.array_equal(series.timestamps, self.timestamps))
+        eq_(series.values.dtype, np.float64)
+
+        values = list(self.values)
+        values[3] = None
+        series = ArrowSeries.from_arrow(self.table(values=values))
+        ok_(np.isnan(series.values[3]))
+        ok_(np.array_equal(series.values[4:], self.values[4:]))
+
+        # a null timestamp stays missing in any unit, and its row is left out
+        for unit in ('s', 'ms'):
+            timestamps = self.pa.array(self.timestamps // arrow.TIME_UNIT_NS[unit], type=self.pa.timestamp(unit),
+                                       mask=np.arange(len(self.timestamps)) == 3)
+            table = self.pa.Table.from_arrays(
+                [timestamps, self.pa.array(self.values)],
+                ['timestamp', 'count'])
+            series = ArrowSeries.from_arrow(table)
+            eq_(series.timestamps[0], np.iinfo(np.int64).min)
+            ok_(np.array_equal(series.timestamps[1:], np.delete(self.timestamps, 3)))
+            # the hour the null took is a gap, not 1970
+            result = anomaly.detect_ts(table, max_anoms=0.05, direction='both', max_gap=1)
+            ok_(len(result) > 0)
+            ok_(set(result.timestamps) <= set(self.timestamps))
+
+        table = self.table()
+        chunked = self.pa.Table.from_batches(table.to_batches(max_chunksize=100))
+        series = ArrowSeries.from_arrow(chunked, 'timestamp', 'count')
+        ok_(np.array_equal(series.values, self.values))
+
+        strings = self.pa.Table.from_arrays(
+            [self.pa.array([str(t) for t in self.raw_data['timestamp']]), self.pa.array(self.values)],
+            ['timestamp', 'count'])
+        ok_(np.array_equal(ArrowSeries.from_arrow(strings).timestamps, self.timestamps))
+
+        assert_raises(ValueError, ArrowSeries.from_arrow, table, 'timestamp', 'missing')
+
+    def test_detect_ts(self):
+        table = self.table()
+        self.assert_same(anomaly.detect_ts(table, max_anoms=0.05, direction='both'), self.expected)
+        self.assert_same(anomaly.detect_ts(table.to_batches()[0], max_anoms=0.05, direction='both'),
+                         self.expected)
+        assert_raises(ValueError, anomaly.detect_ts, self.table(extra=np.zeros(len(self.values))))
+
+    def test_long_format(self):
+        n = len(self.values)
+        long = pd.DataFrame({'series': ['a'] * n + ['b'] * n,
+                             'timestamp': np.tile(self.timestamps, 2),
+                             'count': np.r_[self.values, 2 * self.values]})
+        # rows in no particular order
+        long = long.iloc[np.random.RandomState(0).permutation(len(long))]
+        table = self.table(long['timestamp'].values, long['count'].values, series=list(long['series']))
+
+        series = split_series(table, 'series')
+        eq_(sorted(series), ['a', 'b'])
+        ok_(np.array_equal(series['a'].timestamps, self.timestamps))
+        ok_(np.array_equal(series['b'].values, 2 * self.values))
+
+        results = detect_arrow(table, series_column='series', max_workers=2, max_anoms=0.05, direction='both')
+        self.assert_same(results['a'], self.expected)
+        eq_(list(results['b'].timestamps), list(self.expected.timestamps))
+
+    def test_parquet_output(self):
+        result = anomaly.detect_ts(self.raw_data, max_anoms=0.05, direction='both', e_value=True)
+        table = result_table(result, 'a')
+        eq_(table.schema.names, ['series', 'timestamp', 'anoms', 'expected_value'])
+
+        path = os.path.join(self.dir, 'anoms.parquet')
+        with ParquetAnomalyWriter(path, e_value=True) as writer:
+            writer.write('a', result)
+            writer.write('b', result)
+        written = self.pq.ParquetFile(path)
+        eq_(written.num_row_groups, 2)
+        read = written.read()
+        eq_(read.num_rows, 2 * len(result))
+        ok_(np.array_equal(arrow_values(read.column(2))[:len(result)], result.values))
+
+    def test_cli(self):
+        inputs = os.path.join(self.dir, 'inputs')
+        os.makedirs(inputs)
+        self.pq.write_table(self.table(), os.path.join(inputs, 'a.parquet'))
+        output = os.path.join(self.dir, 'anoms.parquet')
+        manifest = os.path.join(self.dir, 'manifest')
+        args = ['detect', '--max-anoms', '0.05', '--direction', 'both', '-j', '1',
+                '-o', output, '--manifest', manifest, inputs]
+        eq_(main(args), 0)
+
+        read = self.pq.read_table(output)
+        series = ArrowSeries.from_arrow(read, 'timestamp', 'anoms')
+        self.assert_same(series, self.expected)
+        with open(manifest) as f:
+            eq_([json.loads(line)['status'] for line in f], ['done'])
+        # a Parquet file can't be appended to
+        assert_raises(SystemExit, main, args)
@@ -0,0 +1,75 @@
+from nose.tools import eq_, ok_, assert_raises
+from nose.plugins.skip import SkipTest
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import os
+import time
+import anomaly
+from anomaly import detect_async
+from anomaly.detect_async import detect_ts_async, detect_many_async, StopAsyncIteration
+
+class TestAsync(TestCase):
+    def setUp(self):
+        if detect_async.asyncio is None:
+            raise SkipTest("asyncio is not available")
+        self.asyncio = detect_async.asyncio
+        self.loop = self.asyncio.new_event_loop()
+        self.asyncio.set_event_loop(self.loop)
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+
+    def tearDown(self):
+        self.loop.close()
+
+    def drain(self, stream):
+        results = []
+        while True:
+            try:
+                results.append(self.loop.run_until_complete(stream.next_result()))
+            except StopAsyncIteration:
+                return results
+
+    def test_detect_ts_async(self):
+        expected = anomaly.detect_ts(self.raw_data, max_anoms=0.02, direction='both')
+        result = self.loop.run_until_complete(
+            detect_ts_async(self.raw_data, max_anoms=0.02, direction='both'))
+        ok_(np.array_equal(result.timestamps, expected.timestamps))
+
+    def test_stream_results(self):
+        frames = dict(('series-%d' % i, self.raw_data) for i in range(5))
+        stream = detect_many_async(frames, max_in_flight=2, max_anoms=0.02,
+                                   direction='both', only_last='day')
+        results = self.drain(stream)
+        eq_(sorted(key for key, _ in results), sorted(frames.keys()))
+        eq_(len(set(len(result) for _, result in results)), 1)
+
+    def test_errors_and_timeouts(self):
+        frames = [self.raw_data, 'not a frame']
+        results = dict(self.drain(detect_many_async(frames, return_exceptions=True,
+                                                    max_anoms=0.02, direction='both')))
+        ok_(isinstance(results[1], ValueError))
+        ok_(len(results[0]) > 0)
+
+        assert_raises(self.asyncio.TimeoutError, self.loop.run_until_complete,
+                      detect_ts_async(self.raw_data, timeout=0.001, max_anoms=0.02))
+
+    def test_timeout_counts_the_semaphore_wait(self):
+        semaphore = self.asyncio.Semaphore(1, loop=self.loop)
+        self.loop.run_until_complete(semaphore.acquire())
+        started = time.time()
+        assert_raises(self.asyncio.TimeoutError, self.loop.run_until_complete,
+                      detect_ts_async(self.raw_data, timeout=0.05, semaphore=semaphore, max_anoms=0.02))
+        ok_(time.time() - started < 5)
+        # the expired job gave up its place in the queue, so the next one runs
+        semaphore.release()
+        result = self.loop.run_until_complete(
+            detect_ts_async(self.raw_data, timeout=60, semaphore=semaphore, max_anoms=0.02))
+        ok_(len(result) > 0)
+        ok_(not semaphore.locked())
+
+    def test_cancel(self):
+        stream = detect_many_async([self.raw_data] * 4, max_in_flight=1, max_anoms=0.02)
+        waiter = stream.next_result()
+        stream.cancel()
+        assert_raises(StopAsyncIteration, self.loop.run_until_complete, waiter)
@@ -0,0 +1,67 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import os
+import numpy as np
+import pandas as pd
+import anomaly
+
+HOUR_NS = 3600 * 10**9
+DAY_NS = 24 * HOUR_NS
+
+class TestBacktest(TestCase):
+    def setUp(self):
+        path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp'])
+        self.raw_data = raw_data
+
+    def hourly(self, days=60):
+        rng = np.random.RandomState(0)
+        t = np.arange(days * 24)
+        values = 100 + 20 * np.sin(2 * np.pi * t / 24) + rng.normal(0, 2, len(t))
+        spikes = rng.choice(np.arange(10 * 24, len(t)), 12, replace=False)
+        values[spikes] += 40
+        return pd.DataFrame({'timestamp': pd.date_range('2015-01-01', periods=len(t), freq='H'),
+                             'count': values, 'label': np.in1d(t, spikes)},
+                            columns=['timestamp', 'count', 'label'])
+
+    def replay(self, df, evaluations, step_ns, only_last, **kwargs):
+        # what running detect_ts at every step would have reported
+        timestamps = df['timestamp'].values.view('i8')
+        fired = []
+        for evaluation in evaluations:
+            result = anomaly.detect_ts(df[timestamps <= evaluation], only_last=only_last, **kwargs)
+            fired.extend(t for t in result.timestamps if t > evaluation - step_ns)
+        return fired
+
+    def test_matches_repeated_detect_ts(self):
+        kwargs = dict(max_anoms=0.02, direction='both')
+        result = anomaly.backtest(self.raw_data, step='day', **kwargs)
+        timestamps = self.raw_data['timestamp'].values.view('i8')
+        first = -(-(timestamps[0] + 7 * DAY_NS) // DAY_NS) * DAY_NS
+        evaluations = np.arange(first, timestamps[-1] + DAY_NS, DAY_NS)
+        eq_(result.steps, len(evaluations))
+        eq_(list(result.alerts['timestamp'].values.view('i8')), self.replay(self.raw_data, evaluations, DAY_NS, 'day', **kwargs))
+        ok_(len(result.alerts) > 0)
+        ok_(np.all(result.alerts['timestamp'] <= result.alerts['step']))
+
+    def test_longterm_windows_are_reused(self):
+        df = self.hourly()
+        kwargs = dict(max_anoms=0.02, direction='pos', longterm=True, decomposition='periodic')
+        result = anomaly.backtest(df, step='hr', start='2015-02-20', label_column='label', max_workers=2, **kwargs)
+        evaluations = np.arange(pd.Timestamp('2015-02-20').value, df['timestamp'].values.view('i8')[-1] + HOUR_NS, HOUR_NS)
+        eq_(result.steps, len(evaluations))
+        expected = self.replay(df[['timestamp', 'count']], evaluations, HOUR_NS, 'hr', **kwargs)
+        eq_(sorted(result.alerts['timestamp'].values.view('i8')), sorted(expected))
+
+        # each step only detects on the windows that reach into its hour
+        ok_(result.windows_run <= 2 * result.steps)
+        ok_(result.observations <= result.windows_run * 14 * 24)
+        ok_(result.precision > 0.5)
+        ok_(0 < result.recall <= 1)
+        ok_(result.throughput > 0)
+
+    def test_bad_arguments(self):
+        assert_raises(ValueError, anomaly.backtest, self.raw_data, step='min')
+        assert_raises(ValueError, anomaly.backtest, self.raw_data, only_last='hr')
+        assert_raises(ValueError, anomaly.backtest, self.raw_data, label_column='label')
@@ -0,0 +1,78 @@
+from nose.tools import eq_, ok_
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly.baseline import BaselineModel
+
+HOUR_NS = 3600 * 10**9
+
+class TestBaseline(TestCase):
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def synthetic(self):
+        # a week of hourly data: daily sine + linear trend + small noise
+        rng = np.random.RandomState(0)
+        timestamps = np.arange(24 * 7, dtype=np.int64) * HOUR_NS
+        seasonal = 10 * np.sin(2 * np.pi * np.arange(len(timestamps)) / 24)
+        trend = 100 + 0.5 * np.arange(len(timestamps))
+        counts = seasonal + trend + rng.normal(0, 1, len(timestamps))
+        counts[50] += 40
+        return BaselineModel.fit(timestamps, counts, seasonal, trend, [50], 24, 16,
+                                 one_tail=False)
+
+    def test_scores_new_points(self):
+        model = self.synthetic()
+        # the next day, following the same pattern, with one spike and one dip
+        timestamps = np.arange(24 * 7, 24 * 8, dtype=np.int64) * HOUR_NS
+        hours = np.arange(24 * 7, 24 * 8)
+        clean = 10 * np.sin(2 * np.pi * hours / 24) + 100 + 0.5 * hours
+        values = clean.copy()
+        values[5] += 30
+        values[17] -= 30
+
+        scores = model.score(timestamps, values)
+        ok_(np.allclose(scores.expected, clean))
+        eq_(list(np.flatnonzero(scores.anomalous)), [5, 17])
+
+    def test_one_tailed(self):
+        model = self.synthetic()
+        model.one_tail = True
+        model.upper_tail = True
+        timestamps = np.array([24 * 7, 24 * 7 + 1], dtype=np.int64) * HOUR_NS
+        values = model.expected(timestamps) + np.array([30, -30])
+        eq_(list(model.score(timestamps, values).anomalous), [True, False])
+
+    def test_save_and_load(self):
+        model = self.synthetic()
+        path = os.path.join(self.dir, 'baseline.json')
+        model.save(path)
+        loaded = BaselineModel.load(path)
+        timestamps = np.arange(0, 48, dtype=np.int64) * HOUR_NS
+        ok_(np.allclose(loaded.expected(timestamps), model.expected(timestamps)))
+        eq_(loaded.cutoff, model.cutoff)
+
+    def test_detect_ts_baseline_flags_the_next_day(self):
+        raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp'])
+        day = 1440
+
+        full = anomaly.detect_ts(raw_data, max_anoms=0.02, direction='both')
+        history = anomaly.detect_ts(raw_data.iloc[:-day], max_anoms=0.02, direction='both', baseline=True)
+        ok_(isinstance(history.baseline, BaselineModel))
+        ok_(full.baseline is None)
+
+        last_day = raw_data.iloc[-day:]
+        scores = history.baseline.score(last_day['timestamp'].values, last_day['count'].values)
+        flagged = set(last_day['timestamp'].values.astype('i8')[scores.anomalous])
+        reported = set(full.timestamps[full.positions >= len(raw_data) - day])
+        ok_(len(reported & flagged) >= 0.8 * len(reported))
+        ok_(len(flagged) < 0.05 * day)
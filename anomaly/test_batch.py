@@ -0,0 +1,41 @@
+from nose.tools import eq_, ok_
+from unittest import TestCase
+from pandas.util.testing import assert_frame_equal
+import numpy as np
+import pandas as pd
+import os
+import anomaly
+from anomaly.batch import detect_many
+
+class TestBatch(TestCase):
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+
+    def test_detect_ts_does_not_modify_input(self):
+        data = self.raw_data.rename(columns={'timestamp': 'date', 'count': 'value'})
+        original = data.copy()
+        anomaly.detect_ts(data, max_anoms=0.02, direction='both')
+        assert_frame_equal(data, original)
+
+    def test_concurrent_results_match_serial(self):
+        original = self.raw_data.copy()
+        kwargs = dict(max_anoms=0.02, direction='both', e_value=True)
+        expected = anomaly.detect_ts(self.raw_data, **kwargs)
+
+        # every worker shares the same frame
+        for _ in range(3):
+            results = detect_many([self.raw_data] * 8, max_workers=8, **kwargs)
+            eq_(len(results), 8)
+            for result in results:
+                ok_(np.array_equal(result.timestamps, expected.timestamps))
+                ok_(np.array_equal(result.values, expected.values))
+                ok_(np.array_equal(result.expected_values, expected.expected_values))
+
+        assert_frame_equal(self.raw_data, original)
+
+    def test_keyed_series(self):
+        results = detect_many({'a': self.raw_data, 'b': self.raw_data}, max_workers=2,
+                              max_anoms=0.02, direction='both', only_last='day')
+        eq_(sorted(results.keys()), ['a', 'b'])
+        ok_(np.array_equal(results['a'].timestamps, results['b'].timestamps))
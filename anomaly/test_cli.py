@@ -0,0 +1,170 @@
+from nose.tools import eq_, ok_
+from unittest import TestCase
+from StringIO import StringIO
+import json
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly import cli
+from anomaly.cli import main, read_manifest, read_anomalies, AnomalyWriter
+
+class TestCli(TestCase):
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        # hourly sums keep the runs short
+        raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp']).values.astype('M8[h]')
+        self.raw_data = raw_data.groupby('timestamp', as_index=False).sum()
+        self.expected = anomaly.detect_ts(self.raw_data, max_anoms=0.05, direction='both')
+
+        self.dir = tempfile.mkdtemp()
+        self.inputs = os.path.join(self.dir, 'inputs')
+        os.makedirs(self.inputs)
+        self.raw_data.to_csv(os.path.join(self.inputs, 'a.csv'), index=False)
+        np.save(os.path.join(self.inputs, 'b.npy'), np.column_stack([
+            self.raw_data['timestamp'].values.astype('i8') // 10**9, self.raw_data['count']
+        ]))
+        self.output = os.path.join(self.dir, 'anoms.csv')
+        self.manifest = os.path.join(self.dir, 'manifest')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def detect(self, *args):
+        return main(['detect', '--max-anoms', '0.05', '--direction', 'both',
+                     '-o', self.output, '--manifest', self.manifest] + list(args))
+
+    def test_directory_of_files(self):
+        eq_(self.detect(self.inputs, '-j', '2'), 0)
+        output = pd.read_csv(self.output)
+        for name in ('a.csv', 'b.npy'):
+            anoms = output[output['series'] == os.path.join(self.inputs, name)]
+            ok_(np.allclose(anoms['anoms'], self.expected.values))
+        eq_(len(read_manifest(self.manifest)), 2)
+
+    def test_resume_skips_finished_files(self):
+        eq_(self.detect(os.path.join(self.inputs, '*.csv'), '-j', '1'), 0)
+        first = len(pd.read_csv(self.output))
+        eq_(first, len(self.expected))
+
+        eq_(self.detect(self.inputs, '-j', '1'), 0)
+        output = pd.read_csv(self.output)
+        eq_(len(output), 2 * first)
+        eq_(output['series'].nunique(), 2)
+
+    def test_failed_series_are_retried(self):
+        with open(os.path.join(self.inputs, 'bad.csv'), 'w') as f:
+            f.write('timestamp,count\n1980-09-25 14:01:00,1\n')
+        eq_(self.detect(self.inputs, '-j', '1'), 1)
+        done = read_manifest(self.manifest)
+        eq_(len(done), 2)
+        ok_(os.path.join(self.inputs, 'bad.csv') not in done)
+
+    def test_worker_dies(self):
+        # a series that takes its worker down fails, and the rest of the run goes on
+        def crash(df, **kwargs):
+            if df['count'].iloc[0] < 0:
+                os._exit(1)
+            return detect_ts(df, **kwargs)
+
+        crashing = self.raw_data.copy()
+        crashing.loc[0, 'count'] = -1
+        crashing.to_csv(os.path.join(self.inputs, 'crash.csv'), index=False)
+        detect_ts, cli.detect_ts = cli.detect_ts, crash
+        try:
+            eq_(self.detect(self.inputs, '-j', '2'), 1)
+        finally:
+            cli.detect_ts = detect_ts
+        eq_(read_manifest(self.manifest), set(os.path.join(self.inputs, name) for name in ('a.csv', 'b.npy')))
+        with open(self.manifest) as f:
+            errors = [entry['error'] for entry in map(json.loads, f) if entry['status'] != 'done']
+        eq_(len(errors), 1)
+        ok_(errors[0].startswith('WorkerDied'))
+
+    def test_stdin_records(self):
+        timestamps = list(self.raw_data['timestamp'].values.astype('i8') // 10**9)
+        values = list(self.raw_data['count'])
+        lines = [json.dumps({'series': 'whole', 'timestamps': timestamps, 'values': values})]
+        lines += [json.dumps({'series': 'rows', 'timestamp': t, 'value': v})
+                  for t, v in zip(timestamps, values)]
+
+        stdin = sys.stdin
+        sys.stdin = StringIO('\n'.join(lines))
+        try:
+            eq_(self.detect('-j', '1'), 0)
+        finally:
+            sys.stdin = stdin
+
+        output = pd.read_csv(self.output)
+        for series in ('whole', 'rows'):
+            ok_(np.allclose(output[output['series'] == series]['anoms'], self.expected.values))
+
+    def test_partitioned_series(self):
+        # a directory of daily files per series
+        for name in ('a', 'b'):
+            directory = os.path.join(self.dir, 'partitioned', name)
+            os.makedirs(directory)
+            days = self.raw_data['timestamp'].dt.date
+            for day, part in self.raw_data.groupby(days):
+                part.to_csv(os.path.join(directory, '%s.csv' % day), index=False)
+
+        eq_(self.detect(os.path.join(self.dir, 'partitioned'), '--partitioned', '-j', '2'), 0)
+        output = pd.read_csv(self.output)
+        eq_(output['series'].nunique(), 2)
+        for name in ('a', 'b'):
+            anoms = output[output['series'] == os.path.join(self.dir, 'partitioned', name)]
+            ok_(np.allclose(anoms['anoms'], self.expected.values))
+
+    def test_sharded_run(self):
+        for name in ('c', 'd'):
+            self.raw_data.to_csv(os.path.join(self.inputs, '%s.csv' % name), index=False)
+        eq_(self.detect(self.inputs, '--shards', '2', '-j', '2'), 0)
+        output = pd.read_csv(self.output)
+        eq_(output['series'].nunique(), 4)
+        eq_(list(output['series']), sorted(output['series']))
+        for series, anoms in output.groupby('series'):
+            ok_(np.allclose(anoms['anoms'], self.expected.values))
+        eq_(len(read_manifest(self.manifest)), 4)
+
+        # a rerun resumes the shards, and merges them again
+        eq_(self.detect(self.inputs, '--shards', '2', '-j', '2'), 0)
+        eq_(len(pd.read_csv(self.output)), len(output))
+
+    def test_merge_shards(self):
+        manifests = []
+        for index in range(2):
+            output = os.path.join(self.dir, 'anoms-%d.csv' % index)
+            manifests.append(os.path.join(self.dir, 'manifest-%d' % index))
+            eq_(main(['detect', '--max-anoms', '0.05', '--direction', 'both', '-j', '1', '--shard', '%d/2' % index,
+                      '-o', output, '--manifest', manifests[-1], self.inputs]), 0)
+        # rows a resumed shard repeated are only merged once
+        with open(os.path.join(self.dir, 'anoms-0.csv')) as f:
+            rows = f.readlines()[1:]
+        with open(os.path.join(self.dir, 'anoms-0.csv'), 'a') as f:
+            f.writelines(rows)
+
+        eq_(main(['merge', '-o', self.output, '--manifest', self.manifest] + manifests), 0)
+        output = pd.read_csv(self.output)
+        eq_(len(output), 2 * len(self.expected))
+        eq_(len(read_manifest(self.manifest)), 2)
+
+        with self.assertRaises(SystemExit):
+            main(['merge', '-o', self.output, manifests[0]])
+
+    def test_sub_second_timestamps(self):
+        seconds = pd.date_range('2015-01-01', periods=2, freq='S')
+        millis = pd.DatetimeIndex(['2015-01-01 00:00:00.250', '2015-01-01 00:00:00.500'])
+        writer = AnomalyWriter(self.output, e_value=True)
+        writer.write('s', 'done', (seconds.values, np.array([1.0, 2.0]), np.array([0.5, 0.5])))
+        writer.write('ms', 'done', (millis.values, np.array([3.0, 4.0]), np.array([0.5, 0.5])))
+        writer.close()
+
+        with open(self.output) as f:
+            ok_('2015-01-01 00:00:01,' in f.read())
+        output = read_anomalies(self.output)
+        eq_(list(output['timestamp']), list(seconds) + list(millis))
+        eq_(list(output['anoms']), [1.0, 2.0, 3.0, 4.0])
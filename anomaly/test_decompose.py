@@ -0,0 +1,83 @@
+from nose.tools import eq_, ok_
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+from anomaly.decompose import Decompose, stl, henderson, henderson_weights, \
+    henderson_end_weights, _Cycles, _smooth_seasonal, s3x3, s3x5, s3x9
+
+def smooth_one_season_at_a_time(x, labels, smoother):
+    # the per-period loop this module used to run, as a reference
+    out = np.full(len(x), np.nan)
+    kS = len(smoother)
+    for u in np.unique(labels):
+        idx = np.flatnonzero(labels == u)
+        idx = idx[~np.isnan(x[idx])]
+        season = x[idx]
+        L = len(season)
+        if L < 2 * kS - 1:
+            # too short for the smoother, the mean is used instead
+            out[idx] = season.mean()
+            continue
+        smoothed = np.full(L, np.nan)
+        for i in range(kS - 1, L - kS + 1):
+            smoothed[i] = (season[i - kS + 1:i + kS] * smoother[-1]).sum()
+        for i in range(kS - 1):
+            smoothed[i] = (season[0:i + kS] * smoother[i][::-1]).sum()
+        for i in range(L - 1, L - kS, -1):
+            smoothed[i] = (season[i - (kS - 1):L] * smoother[L - 1 - i]).sum()
+        out[idx] = smoothed
+    return out
+
+class TestDecompose(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        t = np.arange(240)
+        self.s = pd.Series(100 + 0.1 * t + 5 * np.sin(2 * np.pi * t / 12) + rng.normal(0, 0.5, len(t)))
+
+    def test_additive(self):
+        result = Decompose(self.s, periods=12, model='additive')
+        ok_(np.allclose(result['Original'], result['Seasonal'] + result['Trend'] + result['Irregular']))
+        ok_(not result[['Seasonal', 'Trend', 'Irregular']].isnull().any().any())
+        ok_(result['Irregular'].abs().max() < 3)
+
+    def test_multiplicative(self):
+        result = Decompose(self.s, periods=12)
+        ok_(np.allclose(result['Original'], result['Seasonal'] * result['Trend'] * result['Irregular']))
+
+    def test_period_labels(self):
+        labels = pd.Series(np.arange(len(self.s)) % 12, index=self.s.index)
+        by_int = Decompose(self.s, periods=12, model='additive')
+        by_labels = Decompose(self.s, periods=labels, model='additive')
+        ok_(np.allclose(by_int['Seasonal'], by_labels['Seasonal']))
+
+    def test_seasonal_smoothers(self):
+        rng = np.random.RandomState(1)
+        for n, period in [(200, 12), (75, 7), (1000, 24)]:
+            x = rng.normal(size=n)
+            # the NAs the first trend estimate leaves at both ends
+            x[:period // 2] = np.nan
+            x[-(period // 2):] = np.nan
+            labels = np.arange(n) % period
+            cycles = _Cycles(labels)
+            for smoother in (s3x3, s3x5, s3x9):
+                smoothed = cycles.unstack(_smooth_seasonal(cycles.stack(x), False, smoother))
+                expected = smooth_one_season_at_a_time(x, labels, smoother)
+                ok_(np.allclose(smoothed, expected, equal_nan=True))
+
+    def test_henderson(self):
+        eq_(list(np.round(henderson_weights(13)[6:], 3)), [0.24, 0.214, 0.147, 0.065, 0.0, -0.028, -0.019])
+        # ABS end weights of the 13-term filter for the last point
+        eq_(list(np.round(henderson_end_weights(13)[0][-7:], 3)),
+            [-0.092, -0.058, 0.012, 0.12, 0.244, 0.353, 0.421])
+        ok_(np.allclose(henderson_end_weights(23).sum(axis=1), 1))
+        ok_(np.allclose(henderson(np.full(50, 3.0), 13), 3.0))
+
+    def test_stl_interface(self):
+        data = pd.Series(self.s.values, index=pd.date_range('2015-01-01', periods=len(self.s), freq='H'))
+        result = stl(data, 'periodic', np=12)
+        eq_(list(result.columns), ['seasonal', 'trend', 'remainder'])
+        ok_(result.index.equals(data.index))
+        # a periodic seasonal component repeats exactly
+        seasonal = result['seasonal'].values
+        ok_(np.allclose(seasonal[:-12], seasonal[12:]))
+        ok_(np.allclose(data, result.sum(axis=1)))
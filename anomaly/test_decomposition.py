@@ -0,0 +1,143 @@
+from nose.tools import eq_, ok_, raises
+from unittest import TestCase
+import os
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly import kernels
+from anomaly.decomposition import get_backend, register_backend, backends, periodic, mstl, \
+    as_seasonal_periods
+from anomaly.detect_anoms import detect_anoms
+from anomaly.stl import stl
+
+class TestDecomposition(TestCase):
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        rng = np.random.RandomState(0)
+        t = np.arange(24 * 14)
+        self.series = pd.Series(100 + 0.1 * t + 10 * np.sin(2 * np.pi * t / 24) + rng.normal(0, 1, len(t)),
+                                index=pd.date_range('2015-01-01', periods=len(t), freq='H'))
+
+    def test_backends(self):
+        for name in ['decompose', 'periodic', 'r_stl', 'stl']:
+            ok_(name in backends())
+        ok_(get_backend('stl').robust)
+        ok_(get_backend('periodic').supports_nan)
+        ok_(not get_backend('r_stl').releases_gil)
+        ok_(get_backend('periodic').releases_gil)
+        enabled = kernels.ENABLED
+        try:
+            # stl only leaves the GIL in the compiled LOESS kernel
+            kernels.ENABLED = False
+            ok_(not get_backend('stl').releases_gil)
+            kernels.ENABLED = True
+            ok_(get_backend('stl').releases_gil)
+        finally:
+            kernels.ENABLED = enabled
+
+    @raises(ValueError)
+    def test_unknown_backend(self):
+        anomaly.detect_ts(self.raw_data, max_anoms=0.02, decomposition='loess')
+
+    def test_components(self):
+        for name in ['stl', 'periodic', 'decompose']:
+            result = get_backend(name)(self.series, 24)
+            eq_(list(result.columns), ['seasonal', 'trend', 'remainder'])
+            ok_(result.index.equals(self.series.index))
+            ok_(np.allclose(result.sum(axis=1), self.series))
+            # periodic seasonal components repeat exactly
+            seasonal = result['seasonal'].values
+            ok_(np.allclose(seasonal[:-24], seasonal[24:]))
+            ok_(result['remainder'].abs().max() < 5)
+
+    def test_stl_matches_r(self):
+        # the upstream R results, reproduced without R
+        results = anomaly.detect_ts(self.raw_data, max_anoms=0.02, direction='both',
+                                    only_last='day', decomposition='stl')
+        eq_(len(results['anoms']), 25)
+        results = anomaly.detect_ts(self.raw_data, max_anoms=0.02, direction='both',
+                                    longterm=True, e_value=True, decomposition='stl')
+        eq_(len(results['anoms']), 131)
+        results = anomaly.detect_vec(self.raw_data['count'], max_anoms=0.02, direction='both',
+                                     period=1440, threshold='med_max', e_value=True, decomposition='stl')
+        eq_(len(results['anoms']), 6)
+
+    def test_stl_windows(self):
+        # a non-periodic seasonal smoother lets the seasonal component drift
+        drifting = self.series * np.linspace(1, 2, len(self.series))
+        seasonal = stl(drifting, 7, np=24)['seasonal'].values
+        ok_(np.abs(seasonal[-24:]).max() > 1.5 * np.abs(seasonal[:24]).max())
+
+    def test_gaps(self):
+        data = self.series.copy()
+        data.iloc[100:110] = np.nan
+        result = periodic(data, 24)
+        ok_(result['remainder'].iloc[100:110].isnull().all())
+        ok_(not result['seasonal'].isnull().any())
+
+        frame = pd.DataFrame({'timestamp': data.index, 'count': data.values}, columns=['timestamp', 'count'])
+        frame = frame.drop(frame.index[100:110])
+        output = detect_anoms(frame, k=0.02, num_obs_per_period=24, decomposition='periodic')
+        eq_(len(output['counts']), len(data))
+        self.assertRaises(ValueError, detect_anoms, frame, k=0.02, num_obs_per_period=24,
+                          decomposition='stl')
+
+    def test_register_backend(self):
+        calls = []
+        def load():
+            calls.append(1)
+            return periodic
+        register_backend('test_periodic', load, supports_nan=True)
+        eq_(calls, [])
+        counts = self.series.values
+        expected = anomaly.detect_vec(counts, max_anoms=0.02, period=24, decomposition='periodic')
+        results = anomaly.detect_vec(counts, max_anoms=0.02, period=24, decomposition='test_periodic')
+        results = anomaly.detect_vec(counts, max_anoms=0.02, period=24, decomposition='test_periodic')
+        eq_(calls, [1])
+        eq_(list(results.positions), list(expected.positions))
+
+    def weekly_series(self, weeks):
+        # hourly, with a weekend dip and a smaller daily cycle at weekends
+        rng = np.random.RandomState(1)
+        timestamps = pd.date_range('2016-01-04', periods=24 * 7 * weeks, freq='H')
+        t = np.arange(len(timestamps))
+        weekend = (timestamps.dayofweek >= 5).astype(float)
+        seasonal = 30 * np.sin(2 * np.pi * t / 24) * (1 - 0.5 * weekend) - 60 * weekend
+        return pd.Series(200 + seasonal + rng.normal(0, 5, len(t)), index=timestamps), seasonal
+
+    def test_mstl(self):
+        data, seasonal = self.weekly_series(6)
+        for name in ['stl', 'periodic']:
+            result = mstl(data, [168, 24], get_backend(name))
+            eq_(list(result.columns), ['seasonal', 'trend', 'remainder', 'seasonal_24', 'seasonal_168'])
+            ok_(np.allclose(result[['seasonal', 'trend', 'remainder']].sum(axis=1), data))
+            ok_(np.allclose(result['seasonal_24'] + result['seasonal_168'], result['seasonal']))
+            error = result['seasonal'] - (seasonal - seasonal.mean())
+            ok_(np.sqrt(np.mean(error ** 2)) < 3)
+            # the weekend is left in the remainder with the daily period alone
+            ok_(result['remainder'].std() < 5)
+            ok_(get_backend(name)(data, 24)['remainder'].std() > 10)
+
+    def test_seasonal_periods(self):
+        data, _ = self.weekly_series(6)
+        frame = pd.DataFrame({'timestamp': data.index, 'count': data.values}, columns=['timestamp', 'count'])
+        spikes = [30, 200, 450, 700, 900]
+        frame.loc[spikes, 'count'] += 50
+        expected = set(np.asarray(frame['timestamp'][spikes]).view('i8'))
+        result = anomaly.detect_ts(frame, max_anoms=0.05, direction='both', decomposition='stl',
+                                   seasonal_periods='weekly')
+        ok_(expected <= set(result.timestamps.view('i8')))
+        ok_(len(result) <= len(spikes) + 2)
+        # the weekend dips are anomalies to the daily period alone
+        single = anomaly.detect_ts(frame, max_anoms=0.05, direction='both', decomposition='stl')
+        ok_(len(single) > 3 * len(result))
+
+        eq_(as_seasonal_periods('168,24'), (24, 168))
+        eq_(as_seasonal_periods([24]), (24,))
+        for periods in ('', 'a', [1, 24], 24):
+            self.assertRaises(ValueError, as_seasonal_periods, periods)
+        # a daily period is needed for 'weekly', and windows twice the longest period
+        self.assertRaises(ValueError, anomaly.detect_ts, frame.iloc[::24], seasonal_periods='weekly')
+        self.assertRaises(ValueError, anomaly.detect_ts, frame, seasonal_periods=(24, 168 * 2), longterm=True)
+        self.assertRaises(ValueError, anomaly.detect_vec, frame['count'], period=24, seasonal_periods='weekly')
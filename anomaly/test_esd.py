@@ -0,0 +1,97 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import numpy as np
+from anomaly import esd as esd_module
+from anomaly.esd import esd, esd_approx, critical_values, EarlyStop, as_early_stop
+
+class TestESD(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.values = rng.normal(0, 1, 2000)
+        self.values[[100, 700, 1500]] = [12, -9, 15]
+
+    def test_finds_injected_anomalies(self):
+        eq_(list(esd(self.values, 40, one_tail=False)), [1500, 100, 700])
+        eq_(list(esd(self.values, 40, one_tail=True, upper_tail=True)), [1500, 100])
+        eq_(list(esd(self.values, 40, one_tail=True, upper_tail=False)), [700])
+
+    def test_float32_agrees(self):
+        eq_(list(esd(self.values, 40, one_tail=False, dtype=np.float32)),
+            list(esd(self.values, 40, one_tail=False)))
+        assert_raises(ValueError, esd, self.values, 40, dtype=np.int32)
+
+    def test_nans_are_skipped(self):
+        values = self.values.copy()
+        values[:10] = np.nan
+        eq_(list(esd(values, 40, one_tail=False)), [1500, 100, 700])
+
+    def test_constant_series(self):
+        eq_(len(esd(np.ones(1000), 10, one_tail=False)), 0)
+
+    def test_critical_values(self):
+        lam = critical_values(100, 5, alpha=0.05, one_tail=False)
+        eq_(len(lam), 5)
+        ok_(np.all(np.diff(lam) < 0))
+
+    def test_approx_matches_exact(self):
+        rng = np.random.RandomState(3)
+        for kind in range(4):
+            values = [rng.standard_cauchy(20000), np.round(rng.normal(0, 3, 20000)),
+                      self.values.repeat(10), rng.exponential(1, 20000)][kind]
+            values[rng.randint(0, len(values), 5)] = np.nan
+            for one_tail, upper_tail in ((False, True), (True, True), (True, False)):
+                expected = list(esd(values, 400, one_tail=one_tail, upper_tail=upper_tail))
+                # sorted whole, and located from a small sample
+                for sample_size in (len(values), 1024):
+                    eq_(list(esd_approx(values, 400, one_tail=one_tail, upper_tail=upper_tail,
+                                        sample_size=sample_size, max_exact=0)), expected)
+
+    def test_approx_falls_back(self):
+        # a sample of only the points at the median misses every step, which are then computed over
+        # all the points, or by esd past max_exact of them
+        calls = []
+        exact = esd_module.esd
+        esd_module.esd = lambda *args, **kwargs: calls.append(1) or exact(*args, **kwargs)
+        try:
+            values = np.random.RandomState(1).normal(0, 1, 20000)
+            values[[5, 500, 9000]] = [12, -9, 15]
+            values[np.random.RandomState(0).randint(0, len(values), 64)] = 0
+            expected = list(exact(values, 200, one_tail=False))
+            eq_(len(expected), 3)
+            eq_(list(esd_approx(values, 200, one_tail=False, sample_size=64, max_exact=10**6)), expected)
+            eq_(calls, [])
+            eq_(list(esd_approx(values, 200, one_tail=False, sample_size=64)), expected)
+            eq_(calls, [1])
+        finally:
+            esd_module.esd = exact
+        eq_(len(esd_approx(np.ones(1000), 10, one_tail=False)), 0)
+
+    def test_early_stop(self):
+        rng = np.random.RandomState(4)
+        values = rng.normal(0, 1, 5000)
+        values[rng.randint(0, len(values), 20)] += 10
+        for one_tail in (True, False):
+            expected = list(esd(values, 500, one_tail=one_tail))
+            ok_(len(expected) >= 20)
+            eq_(list(esd(values, 500, one_tail=one_tail, early_stop=EarlyStop(10))), expected)
+
+        # a plateau of a fifth of the points inflates the MAD, so its first steps are below lambda_i and
+        # only the later ones above: stopping at the first steps loses it, unless the margin is wide enough
+        values = np.random.RandomState(0).normal(0, 1, 200)
+        values[::5] = 4.5
+        expected = list(esd(values, 60))
+        eq_(len(expected), 40)
+        for early_stop, count in (('1:0', 0), ('10:0.5', 0), ('25:0.5', 40), ('1:1', 40)):
+            result = list(esd(values, 60, early_stop=early_stop))
+            eq_(result, expected[:count])
+            eq_(list(esd_approx(values, 60, early_stop=early_stop)), result)
+
+    def test_early_stop_spec(self):
+        eq_(EarlyStop.parse('50'), EarlyStop(50, 1.0))
+        eq_(EarlyStop.parse('50:0.5'), EarlyStop(50, 0.5))
+        eq_(str(EarlyStop(50, 0.5)), '50:0.5')
+        eq_(as_early_stop(20), EarlyStop(20))
+        eq_(as_early_stop([20, 2]), EarlyStop(20, 2))
+        eq_(as_early_stop(None), None)
+        for spec in ('0', '10:-1', 'a', '1:2:3', True, 1.5):
+            assert_raises(ValueError, as_early_stop, spec)
@@ -0,0 +1,70 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import os
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly.hierarchy import rollup, triage_score
+
+class TestHierarchy(TestCase):
+    def setUp(self):
+        path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp'])
+        # hourly, to keep the runs short
+        raw_data['timestamp'] = raw_data['timestamp'].values.astype('M8[h]')
+        self.raw_data = raw_data.groupby('timestamp', as_index=False).mean()
+
+        rng = np.random.RandomState(0)
+        self.tree = {}
+        for cluster in ('east', 'west'):
+            hosts = {}
+            for host in ('a', 'b', 'c'):
+                df = self.raw_data.copy()
+                df['count'] = df['count'] * rng.uniform(0.5, 1.5) + rng.normal(0, 1, len(df))
+                hosts[host] = df
+            self.tree[cluster] = hosts
+        # a spike in the last day of one host
+        self.spiked = self.tree['west']['b']
+        self.spiked.loc[len(self.spiked) - 5, 'count'] += 400
+
+    def test_rollup(self):
+        a = (np.array([1, 2, 3], dtype=np.int64), np.array([1.0, np.nan, 3.0]))
+        b = (np.array([2, 4], dtype=np.int64), np.array([np.nan, 5.0]))
+        timestamps, values = rollup([a, b])
+        eq_(list(timestamps), [1, 2, 3, 4])
+        ok_(np.allclose(values, [1, np.nan, 3, 5], equal_nan=True))
+
+    def test_triage_score(self):
+        t = np.arange(24 * 10)
+        values = 10 * np.sin(2 * np.pi * t / 24) + np.random.RandomState(1).normal(0, 1, len(t))
+        ok_(triage_score(t, values, 24) < 5)
+        values[-3] += 20
+        ok_(triage_score(t, values, 24) > 10)
+        ok_(triage_score(t, values, 24, start=t[-3]) < 5)
+
+    def test_drill_down(self):
+        result = anomaly.detect_hierarchy(self.tree, max_anoms=0.02, direction='pos', only_last='day')
+        eq_(result.anomalous[0], 'west')
+        ok_('west/b' in result.anomalous)
+        spike = self.spiked['timestamp'].values[-5].view('i8')
+        ok_(spike in result['west/b'].timestamps)
+
+        # the quiet cluster's hosts are never detected on
+        ok_('east' in result)
+        ok_(not len(result['east']))
+        ok_('east/a' not in result)
+        eq_(result.leaf_evaluations + result.leaf_evaluations_avoided, 6)
+        ok_(result.leaf_evaluations_avoided >= 3)
+
+        # a parent is the sum of its children
+        expected = anomaly.detect_ts(pd.DataFrame({
+            'timestamp': self.raw_data['timestamp'],
+            'count': sum(self.tree['west'][host]['count'] for host in 'abc')}, columns=['timestamp', 'count']),
+            max_anoms=0.02, direction='pos', only_last='day')
+        eq_(list(result['west'].timestamps), list(expected.timestamps))
+
+    def test_bad_tree(self):
+        assert_raises(ValueError, anomaly.detect_hierarchy, self.raw_data)
+        assert_raises(ValueError, anomaly.detect_hierarchy, {'east': {}})
+        assert_raises(ValueError, anomaly.detect_hierarchy, {'a/b': self.raw_data})
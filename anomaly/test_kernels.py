@@ -0,0 +1,87 @@
+from nose.tools import eq_, ok_
+from unittest import TestCase
+from nose.plugins.skip import SkipTest
+import numpy as np
+import pandas as pd
+from anomaly import kernels
+from anomaly.esd import esd
+from anomaly.stl import stl
+
+class TestKernels(TestCase):
+    # without Numba the kernels run as plain Python, so they are checked against the NumPy code on small inputs
+
+    def setUp(self):
+        self.enabled = kernels.ENABLED
+
+    def tearDown(self):
+        kernels.ENABLED = self.enabled
+
+    def both(self, f):
+        kernels.ENABLED = False
+        expected = f()
+        kernels.ENABLED = True
+        return f(), expected
+
+    def test_esd_trajectory(self):
+        rng = np.random.RandomState(1)
+        # heavy tailed and rounded, so there are many anomalies and ties
+        for n in (300, 301):
+            values = np.round(rng.standard_cauchy(n), 1)
+            values[:5] = np.nan
+            for dtype in (np.float64, np.float32):
+                for one_tail, upper_tail in ((False, True), (True, True), (True, False)):
+                    result, expected = self.both(lambda: esd(values, 120, alpha=0.5, one_tail=one_tail,
+                                                             upper_tail=upper_tail, dtype=dtype))
+                    ok_(len(expected) > 10)
+                    eq_(list(result), list(expected))
+
+        result, expected = self.both(lambda: esd(np.ones(100), 10))
+        eq_(len(result), 0)
+
+        values = np.round(rng.standard_cauchy(300), 1)
+        for early_stop in ('1:0', '3:0.5', '10:1'):
+            result, expected = self.both(lambda: esd(values, 120, alpha=0.5, early_stop=early_stop))
+            eq_(list(result), list(expected))
+
+    def test_esd_statistics(self):
+        x = np.round(np.random.RandomState(3).standard_cauchy(200), 1)
+        R_idx, R = np.empty(50, dtype=np.int64), np.empty(50)
+        steps = kernels.esd_trajectory(x, np.arange(200), 50, False, True, np.array([0.5, 0.6745]), R_idx, R,
+                                       np.zeros(50), 0, 0.)
+        eq_(steps, 50)
+        remaining = list(range(200))
+        for i in range(50):
+            d = np.abs(x[remaining] - np.median(x[remaining]))
+            eq_(R_idx[i], remaining[int(np.argmax(d))])
+            ok_(np.isclose(R[i], d.max() / (np.median(d) / 0.6745)))
+            remaining.remove(R_idx[i])
+
+    def test_loess(self):
+        rng = np.random.RandomState(2)
+        t = np.arange(24 * 6)
+        data = pd.Series(10 * np.sin(2 * np.pi * t / 24) + 0.1 * t + rng.normal(0, 1, len(t)))
+        data[[30, 90]] += 25
+        for robust in (False, True):
+            result, expected = self.both(lambda: stl(data, 7, np=24, robust=robust, no=2 if robust else None))
+            ok_(np.allclose(result.values, expected.values, rtol=0, atol=1e-10))
+
+    def test_warm(self):
+        # the calls that compile the kernels, as plain Python without Numba
+        kernels.ENABLED = True
+        kernels.warm()
+
+    def test_warm_signatures(self):
+        # warm compiles the specializations detection calls, so none is added on the first detection
+        if kernels.numba is None or not self.enabled:
+            raise SkipTest("Numba is not available")
+        kernels.warm()
+        compiled = len(kernels.esd_trajectory.signatures), len(kernels.loess_fit.signatures)
+        rng = np.random.RandomState(0)
+        values = rng.standard_cauchy(300)
+        values[:3] = np.nan
+        for dtype in (np.float64, np.float32):
+            esd(values, 30, dtype=dtype)
+            esd(values, 30, one_tail=False, dtype=dtype, early_stop=(3, 1.0))
+        t = np.arange(24 * 6)
+        stl(pd.Series(np.sin(2 * np.pi * t / 24) + rng.normal(0, 0.1, len(t))), 7, np=24, robust=True)
+        eq_((len(kernels.esd_trajectory.signatures), len(kernels.loess_fit.signatures)), compiled)
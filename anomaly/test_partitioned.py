@@ -0,0 +1,113 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import shutil
+import tempfile
+import os
+import anomaly
+from anomaly.partitioned import PartitionedSeries, open_partitioned, detect_partitioned, \
+    group_partitions, WINDOW_BYTES_PER_OBS
+
+DAY_NS = 86400 * 10**9
+
+class TestPartitioned(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.dirname(os.path.realpath(__file__))
+        self.raw_data = pd.read_csv(os.path.join(path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        self.raw_data['timestamp'] = pd.to_datetime(self.raw_data['timestamp'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def split(self, df, name, days=1, npy=False):
+        # one file per ``days`` days, named in reverse time order
+        directory = os.path.join(self.dir, name)
+        os.makedirs(directory)
+        timestamps = df['timestamp'].values.view('i8')
+        paths = []
+        for i, part in df.groupby(timestamps // (days * DAY_NS)):
+            path = os.path.join(directory, '%d.%s' % (10**6 - i, 'npy' if npy else 'csv'))
+            if npy:
+                data = np.empty(len(part), dtype=[('timestamp', 'i8'), ('count', 'f8')])
+                data['timestamp'] = part['timestamp'].values.view('i8') // 10**9
+                data['count'] = part['count']
+                np.save(path, data)
+            else:
+                part.to_csv(path, index=False)
+            paths.append(path)
+        return paths
+
+    def hourly(self, days=120):
+        rng = np.random.RandomState(0)
+        t = np.arange(days * 24)
+        values = 100 + 20 * np.sin(2 * np.pi * t / 24) + rng.normal(0, 2, len(t))
+        values[rng.randint(0, len(t), 30)] += 50
+        return pd.DataFrame({'timestamp': pd.date_range('2015-01-01', periods=len(t), freq='H'),
+                             'count': values}, columns=['timestamp', 'count'])
+
+    def assert_same(self, result, expected):
+        eq_(list(result.timestamps), list(expected.timestamps))
+        ok_(np.allclose(result.values, expected.values))
+
+    def test_values(self):
+        df = self.hourly(days=30)
+        series = PartitionedSeries(self.split(df, 'hourly', days=4, npy=True), cache_bytes=2 * 96 * 8)
+        eq_(len(series.paths), 8)
+        ok_(np.array_equal(series.timestamps, df['timestamp'].values.view('i8')))
+        values = df['count'].values
+        for key in (slice(None), slice(50, 500), slice(-100, None), slice(90, 100), slice(5, 5)):
+            ok_(np.array_equal(series.values[key], values[key]))
+            ok_(series.values._cached_bytes <= series.values.cache_bytes)
+        eq_(series.values[-1], values[-1])
+        ok_(np.array_equal(np.asarray(series.values), values))
+
+    def test_detect_ts(self):
+        series = PartitionedSeries(self.split(self.raw_data, 'raw'))
+        for kwargs in ({}, {'only_last': 'day'}, {'longterm': True, 'e_value': True}):
+            expected = anomaly.detect_ts(self.raw_data, max_anoms=0.02, direction='both', **kwargs)
+            self.assert_same(anomaly.detect_ts(series, max_anoms=0.02, direction='both', **kwargs), expected)
+
+    def test_longterm_within_budget(self):
+        df = self.hourly()
+        paths = self.split(df, 'hourly', npy=True)
+        window = 14 * 24
+        # the timestamps, one window and a few days of cached partitions
+        budget = 8 * len(df) + WINDOW_BYTES_PER_OBS * window + 3 * 24 * 8
+        kwargs = dict(max_anoms=0.02, direction='both', longterm=True, decomposition='periodic')
+
+        (name, result), = detect_partitioned({'hourly': paths}, budget, **kwargs)
+        eq_(name, 'hourly')
+        expected = anomaly.detect_ts(df, **kwargs)
+        ok_(len(expected.window_stats) > 5)
+        self.assert_same(result, expected)
+
+        series = open_partitioned(paths, budget, **kwargs)
+        eq_(series.values.cache_bytes, 3 * 24 * 8)
+        anomaly.detect_ts(series, **kwargs)
+        ok_(series.values._cached_bytes <= series.values.cache_bytes)
+
+        # only_last only reads and analyses the windows that reach into the last day
+        last = anomaly.detect_ts(series, only_last='day', **kwargs)
+        eq_(len(last.window_stats), 1)
+        self.assert_same(last, anomaly.detect_ts(df, only_last='day', **kwargs))
+
+        assert_raises(ValueError, open_partitioned, paths, budget // 2, **kwargs)
+        # without longterm the whole series is one window
+        assert_raises(ValueError, open_partitioned, paths, budget, decomposition='periodic')
+
+    def test_bad_partitions(self):
+        paths = self.split(self.raw_data, 'raw')
+        overlapping = os.path.join(self.dir, 'overlap.csv')
+        self.raw_data.iloc[1000:1100].to_csv(overlapping, index=False)
+        assert_raises(ValueError, PartitionedSeries, paths + [overlapping])
+
+        unsorted = os.path.join(self.dir, 'unsorted.csv')
+        self.raw_data.iloc[::-1].to_csv(unsorted, index=False)
+        assert_raises(ValueError, PartitionedSeries, [unsorted])
+        assert_raises(ValueError, PartitionedSeries, [])
+
+    def test_group_partitions(self):
+        groups = group_partitions(['a/2.csv', 'b/1.npy', 'a/1.csv'])
+        eq_(groups, {'a': ['a/1.csv', 'a/2.csv'], 'b': ['b/1.npy']})
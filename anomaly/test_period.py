@@ -0,0 +1,72 @@
+from nose.tools import eq_, ok_, raises
+from unittest import TestCase
+import os
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly.period import detect_period, autocorrelation
+
+SECOND_NS = 10**9
+
+class TestPeriod(TestCase):
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+
+    def counters(self, step_seconds=10, days=3):
+        # network counters every step_seconds with a daily cycle and a few spikes
+        rng = np.random.RandomState(0)
+        n = days * 86400 // step_seconds
+        t = np.arange(n)
+        values = 100 + 30 * np.sin(2 * np.pi * t / (n // days)) + rng.normal(0, 2, n)
+        spikes = [n - 1000, n - 500, n - 100]
+        values[spikes] += 60
+        timestamps = (1420070400 + t * step_seconds).astype(np.int64) * SECOND_NS
+        df = pd.DataFrame({'timestamp': timestamps.view('M8[ns]'), 'count': values},
+                          columns=['timestamp', 'count'])
+        return df, timestamps[spikes]
+
+    def test_detect_period(self):
+        eq_(detect_period(self.raw_data['count'].values), 1440)
+        rng = np.random.RandomState(0)
+        eq_(detect_period(rng.normal(size=1000)), None)
+        weekly = np.tile([5.0, 1, 1, 1, 1, 1, 1], 20) + rng.normal(0, 0.1, 140)
+        eq_(detect_period(weekly), 7)
+        # a slow cycle's autocorrelation peak is broad, the preferred period settles it
+        t = np.arange(3 * 8640)
+        slow = np.sin(2 * np.pi * t / 8640) + rng.normal(0, 0.2, len(t))
+        eq_(detect_period(slow, preferred=[8640]), 8640)
+
+    def test_autocorrelation(self):
+        x = np.random.RandomState(0).normal(size=500)
+        acf = autocorrelation(x, 10)
+        eq_(acf[0], 1.0)
+        y = x - np.polyval(np.polyfit(np.arange(500), x, 1), np.arange(500))
+        ok_(np.isclose(acf[3], np.dot(y[:-3], y[3:]) / np.dot(y, y)))
+
+    def test_native_rate(self):
+        df, spikes = self.counters()
+        results = anomaly.detect_ts(df, max_anoms=0.01, direction='pos', period='auto')
+        ok_(set(spikes) <= set(results.timestamps))
+
+        fixed = anomaly.detect_ts(df, max_anoms=0.01, direction='pos', period=8640)
+        eq_(list(fixed.timestamps), list(results.timestamps))
+
+    def test_seconds_default_to_minutes(self):
+        # three days, since STL needs more than two periods of the 1440 minutes
+        df, spikes = self.counters(step_seconds=30, days=3)
+        results = anomaly.detect_ts(df, max_anoms=0.01, direction='pos')
+        ok_(len(results) > 0)
+        ok_(np.all(results.timestamps % (60 * SECOND_NS) == 0))
+        ok_(set(spikes - spikes % (60 * SECOND_NS)) <= set(results.timestamps))
+
+    @raises(ValueError)
+    def test_milliseconds_need_a_period(self):
+        df = pd.DataFrame({'timestamp': pd.date_range('2015-01-01', periods=5000, freq='100L'),
+                           'count': np.ones(5000)}, columns=['timestamp', 'count'])
+        anomaly.detect_ts(df)
+
+    def test_detect_vec_auto(self):
+        expected = anomaly.detect_vec(self.raw_data['count'], max_anoms=0.02, direction='both', period=1440)
+        results = anomaly.detect_vec(self.raw_data['count'], max_anoms=0.02, direction='both', period='auto')
+        eq_(list(results.positions), list(expected.positions))
@@ -0,0 +1,68 @@
+from nose.tools import eq_, ok_, raises
+from unittest import TestCase
+import os
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly.resample import regular_grid, na_runs, fill_gaps
+
+MINUTE_NS = 60 * 10**9
+
+class TestResample(TestCase):
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        self.raw_data['timestamp'] = pd.to_datetime(self.raw_data['timestamp'])
+
+    def test_regular_grid(self):
+        timestamps = np.array([0, 30, 60, 180, 240], dtype=np.int64) * 10**9 + 5 * 10**9
+        grid, values = regular_grid(timestamps, [1.0, 3.0, 5.0, 7.0, np.nan], MINUTE_NS)
+        eq_(list(grid - 5 * 10**9), [0, MINUTE_NS, 2 * MINUTE_NS, 3 * MINUTE_NS])
+        ok_(np.allclose(values, [2.0, 5.0, np.nan, 7.0], equal_nan=True))
+
+        # same as the pandas resample it replaces
+        series = self.raw_data.set_index('timestamp')['count'].iloc[::3]
+        grid, values = regular_grid(series.index.values.view('i8'), series.values, MINUTE_NS)
+        expected = series.resample('T')
+        eq_(list(grid), list(expected.index.values.view('i8')))
+        ok_(np.allclose(values, expected.values, equal_nan=True))
+
+    def test_na_runs(self):
+        starts, stops = na_runs([True, False, True, True, False, True])
+        eq_(list(starts), [0, 2, 5])
+        eq_(list(stops), [1, 4, 6])
+
+    def test_fill_gaps(self):
+        values = np.array([np.nan, 1.0, np.nan, np.nan, 4.0, np.nan, np.nan, np.nan, 8.0, np.nan])
+        filled, mask = fill_gaps(values, 2)
+        ok_(np.allclose(filled, [np.nan, 1, 2, 3, 4, np.nan, np.nan, np.nan, 8, np.nan], equal_nan=True))
+        eq_(list(np.flatnonzero(mask)), [2, 3])
+        filled, mask = fill_gaps(values, 3)
+        ok_(np.allclose(filled[5:8], [5, 6, 7]))
+        ok_(np.isnan(values[2]))
+
+    def test_seasonal_fill(self):
+        t = np.arange(24 * 5)
+        clean = 50 + 0.2 * t + 10 * np.sin(2 * np.pi * t / 24)
+        for gap in (slice(3, 9), slice(60, 66)):
+            values = clean.copy()
+            values[gap] = np.nan
+            seasonal, _ = fill_gaps(values, 6, 'seasonal', 24)
+            linear, _ = fill_gaps(values, 6, 'linear', 24)
+            ok_(np.allclose(seasonal, clean))
+            ok_(not np.allclose(linear, clean))
+
+    def test_detect_ts_gaps(self):
+        expected = anomaly.detect_ts(self.raw_data, max_anoms=0.02, direction='both')
+        data = self.raw_data.drop(self.raw_data.index[5000:5003])
+        self.assertRaises(ValueError, anomaly.detect_ts, data, max_anoms=0.02, direction='both')
+
+        results = anomaly.detect_ts(data, max_anoms=0.02, direction='both', max_gap=5)
+        reported = set(results.timestamps)
+        ok_(reported <= set(data['timestamp'].values.view('i8')))
+        ok_(len(reported ^ set(expected.timestamps)) <= 2)
+        self.assertRaises(ValueError, anomaly.detect_ts, data, max_anoms=0.02, direction='both', max_gap=2)
+
+    @raises(ValueError)
+    def test_bad_gap_fill(self):
+        anomaly.detect_ts(self.raw_data, max_anoms=0.02, max_gap=5, gap_fill='spline')
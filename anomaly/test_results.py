@@ -0,0 +1,38 @@
+from nose.tools import eq_, ok_
+from unittest import TestCase
+import numpy as np
+from anomaly.results import DetectionResult
+
+class TestResults(TestCase):
+    def setUp(self):
+        self.result = DetectionResult(e_value=True)
+        self.result.add_window([3, 1], [300, 100], [3.0, 1.0], [30.0, 10.0], 0, 10, 2)
+        # overlapping window reports timestamp 300 a second time
+        self.result.add_window([3, 5], [300, 500], [3.0, 5.0], [31.0, 50.0], 2, 10, 2)
+
+    def test_columns_are_sorted_and_deduplicated(self):
+        eq_(len(self.result), 3)
+        eq_(list(self.result.timestamps), [100, 300, 500])
+        eq_(list(self.result.positions), [1, 3, 5])
+        eq_(list(self.result.expected_values), [10.0, 30.0, 50.0])
+
+    def test_window_stats(self):
+        stats = self.result.window_stats
+        eq_(list(stats['num_obs']), [10, 8])
+        eq_(list(stats['num_reported']), [2, 2])
+
+    def test_lazy_frame(self):
+        frame = self.result['anoms']
+        eq_(list(frame.columns), ['timestamp', 'anoms', 'expected_value'])
+        ok_(self.result.to_frame() is frame)
+        ok_(self.result['plot'] is None)
+
+    def test_empty(self):
+        result = DetectionResult()
+        eq_(result.count, 0)
+        ok_(result['anoms'] is None)
+
+    def test_filter(self):
+        self.result.filter(self.result.values > 2)
+        eq_(list(self.result.timestamps), [300, 500])
+        eq_(len(self.result.to_frame()), 2)
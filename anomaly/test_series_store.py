@@ -0,0 +1,64 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import shutil
+import tempfile
+import os
+import anomaly
+from anomaly.series_store import SeriesStore
+
+class TestSeriesStore(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'series')
+        self.timestamps = np.arange(1000, dtype=np.int64) * 60 * 10**9
+        self.values = np.arange(1000, dtype=np.float64)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_append_and_reopen(self):
+        store = SeriesStore.create(self.path, dtype=np.float32, block_size=64)
+        store.append(self.timestamps[:500], self.values[:500])
+        store.append(self.timestamps[500:], self.values[500:])
+
+        store = SeriesStore(self.path)
+        eq_(len(store), 1000)
+        eq_(store.values.dtype, np.float32)
+        ok_(isinstance(store.timestamps, np.memmap))
+        ok_(np.array_equal(store.timestamps, self.timestamps))
+        ok_(np.array_equal(store.values, self.values))
+
+    def test_time_range_window(self):
+        store = SeriesStore.create(self.path, block_size=64)
+        store.append(self.timestamps, self.values)
+
+        eq_(store.locate(self.timestamps[100], self.timestamps[300]), (100, 300))
+        eq_(store.locate(self.timestamps[100] + 1), (101, 1000))
+        eq_(store.locate(end=-1), (0, 0))
+
+        timestamps, values = store.window(pd.Timestamp(self.timestamps[130]),
+                                          pd.Timestamp(self.timestamps[700]))
+        ok_(np.array_equal(values, self.values[130:700]))
+
+        frame = store.to_frame(self.timestamps[998])
+        eq_(list(frame.columns), ['timestamp', 'count'])
+        eq_(len(frame), 2)
+
+    def test_append_must_increase(self):
+        store = SeriesStore.create(self.path)
+        store.append(self.timestamps[:10], self.values[:10])
+        assert_raises(ValueError, store.append, self.timestamps[5:15], self.values[5:15])
+        assert_raises(ValueError, store.append, self.timestamps[20:10:-1], self.values[20:10:-1])
+        eq_(len(store), 10)
+
+    def test_detect_ts_from_store(self):
+        path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        store = SeriesStore.create(self.path)
+        store.append(raw_data['timestamp'], raw_data['count'])
+
+        from_store = anomaly.detect_ts(store, max_anoms=0.02, direction='both', only_last='day')
+        from_frame = anomaly.detect_ts(raw_data, max_anoms=0.02, direction='both', only_last='day')
+        ok_(np.array_equal(from_store.timestamps, from_frame.timestamps))
@@ -0,0 +1,131 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+import urllib2
+import pandas as pd
+import anomaly
+from anomaly import service as service_module
+from anomaly.service import DetectionService
+
+class TestService(TestCase):
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        # hourly sums keep the requests small
+        raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp']).values.astype('M8[h]')
+        self.raw_data = raw_data.groupby('timestamp', as_index=False).sum()
+        self.service = DetectionService(port=0, workers=2, pool='thread', max_delay=0.5).start()
+
+    def tearDown(self):
+        self.service.stop()
+
+    def request(self, path, body=None, content_type='application/json'):
+        request = urllib2.Request(self.service.url + path, body, {'Content-Type': content_type})
+        try:
+            response = urllib2.urlopen(request)
+            return response.getcode(), json.loads(response.read())
+        except urllib2.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_concurrent_requests_are_batched(self):
+        expected = anomaly.detect_ts(self.raw_data, max_anoms=0.05, direction='both')
+        body = json.dumps({
+            'timestamps': list(self.raw_data['timestamp'].values.astype('i8') // 10**9),
+            'values': list(self.raw_data['count']),
+            'params': {'max_anoms': 0.05, 'direction': 'both'}
+        })
+        csv = self.raw_data.to_csv(index=False)
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            responses = list(executor.map(lambda i: self.request('/detect', body), range(4)))
+            responses.append(self.request('/detect?max_anoms=0.05&direction=both',
+                                          csv, 'text/csv'))
+
+        ok_(len(expected) > 0)
+        for code, response in responses:
+            eq_(code, 200)
+            eq_(response['count'], len(expected))
+
+        code, stats = self.request('/stats')
+        eq_(stats['requests'], 5)
+        ok_(stats['batches'] < 5)
+        ok_(stats['latency_ms']['p99'] > 0)
+
+    def test_bad_requests(self):
+        code, response = self.request('/detect', json.dumps({'timestamps': [1, 2], 'values': [1]}))
+        eq_(code, 400)
+        code, response = self.request('/detect?direction=sideways', self.raw_data.to_csv(index=False), 'text/csv')
+        eq_(code, 400)
+        eq_(self.request('/health')[0], 200)
+
+    def test_decomposition(self):
+        # a service started with another backend preloads and defaults to it
+        service = DetectionService(port=0, workers=1, pool='thread', decomposition='stl').start()
+        try:
+            expected = anomaly.detect_ts(self.raw_data, max_anoms=0.05, direction='both',
+                                         decomposition='stl')
+            request = urllib2.Request(service.url + '/detect?max_anoms=0.05&direction=both',
+                                      self.raw_data.to_csv(index=False), {'Content-Type': 'text/csv'})
+            response = json.loads(urllib2.urlopen(request).read())
+            eq_(response['count'], len(expected))
+            eq_([anom['timestamp'] for anom in response['anoms']],
+                [t.isoformat() for t in pd.DatetimeIndex(expected.timestamps)])
+        finally:
+            service.stop()
+        assert_raises(ValueError, DetectionService, pool='thread', decomposition='loess')
+
+    def test_batches_are_spread_over_workers(self):
+        tasks = []
+        self.service._submit = tasks.append
+        self.service._dispatch(range(5))
+        eq_(tasks, [[0, 1, 2], [3, 4]])
+        self.service._dispatch(range(1))
+        eq_(tasks[-1], [0])
+
+    def test_failed_batch(self):
+        # anything that escapes the series fails its batch's requests at once, not after the timeout
+        class Abort(BaseException):
+            pass
+
+        def abort(*args, **kwargs):
+            raise Abort('worker going away')
+
+        detect_ts, service_module.detect_ts = service_module.detect_ts, abort
+        try:
+            started = time.time()
+            code, response = self.request('/detect', json.dumps({'timestamps': [1, 2], 'values': [1, 2]}))
+        finally:
+            service_module.detect_ts = detect_ts
+        eq_(code, 500)
+        ok_('Abort' in response['error'])
+        ok_(time.time() - started < 5)
+
+    def test_worker_dies(self):
+        # a process worker that dies fails its batch at once, and is replaced
+        def crash(df, **kwargs):
+            if df['count'].iloc[0] < 0:
+                os._exit(1)
+            return detect_ts(df, **kwargs)
+
+        detect_ts, service_module.detect_ts = service_module.detect_ts, crash
+        try:
+            service = DetectionService(port=0, workers=1, pool='process', decomposition='stl').start()
+        finally:
+            service_module.detect_ts = detect_ts
+        self.service.stop()
+        self.service = service
+
+        started = time.time()
+        code, response = self.request('/detect', json.dumps({'timestamps': [1, 2], 'values': [-1, 2]}))
+        eq_(code, 500)
+        ok_('WorkerDied' in response['error'])
+        ok_(time.time() - started < 30)
+
+        csv = self.raw_data.to_csv(index=False)
+        code, response = self.request('/detect?max_anoms=0.05&direction=both', csv, 'text/csv')
+        eq_(code, 200)
+        eq_(response['count'], len(anomaly.detect_ts(self.raw_data, max_anoms=0.05, direction='both',
+                                                     decomposition='stl')))
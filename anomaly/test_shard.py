@@ -0,0 +1,41 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import pandas as pd
+import os
+from anomaly.shard import ShardSpec, as_shard, shard_of, shard_path
+from anomaly.batch import detect_many
+
+class TestShard(TestCase):
+    def test_shard_of_is_stable(self):
+        # the same on every machine, so these must never change
+        eq_([shard_of(series, 7) for series in ['a', 'b', u'caf\xe9', 'hosts/web-01']], [6, 3, 4, 1])
+        eq_(shard_of(12, 7), shard_of('12', 7))
+
+    def test_shards_partition_the_series(self):
+        names = ['series-%d' % i for i in range(1000)]
+        shards = [ShardSpec(i, 4) for i in range(4)]
+        owners = [[shard for shard in shards if name in shard] for name in names]
+        ok_(all(len(owner) == 1 for owner in owners))
+        sizes = [sum(1 for owner in owners if owner[0] == shard) for shard in shards]
+        ok_(min(sizes) > 200)
+
+    def test_spec(self):
+        eq_(ShardSpec.parse('1/4'), ShardSpec(1, 4))
+        eq_(str(ShardSpec(1, 4)), '1/4')
+        eq_(as_shard((2, 3)), ShardSpec(2, 3))
+        eq_(as_shard(None), None)
+        for spec in ('4/4', '-1/4', '0/0', '1', 'a/b'):
+            assert_raises(ValueError, ShardSpec.parse, spec)
+        eq_(shard_path('out/anoms.csv', ShardSpec(0, 4)), 'out/anoms.shard-0-of-4.csv')
+
+    def test_detect_many(self):
+        path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        frames = dict(('series-%d' % i, raw_data) for i in range(6))
+        results = {}
+        for index in range(3):
+            shard = detect_many(frames, 2, shard='%d/3' % index, max_anoms=0.02)
+            ok_(all(name in ShardSpec(index, 3) for name in shard))
+            results.update(shard)
+        eq_(sorted(results), sorted(frames))
+        assert_raises(ValueError, detect_many, [raw_data], shard='0/2')
@@ -0,0 +1,65 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import os
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly.sketch import QuantileSketch, daily_max_sketch
+
+class TestSketch(TestCase):
+    def setUp(self):
+        self.values = np.random.RandomState(0).gamma(2, size=100000)
+
+    def rank(self, value):
+        return np.mean(self.values <= value)
+
+    def test_exact_while_small(self):
+        values = self.values[:1500]
+        sketch = QuantileSketch().update(values[:700]).merge(QuantileSketch().update(values[700:]))
+        eq_(sketch.count, 1500)
+        for q in (0, 0.5, 0.95, 0.99, 1):
+            eq_(sketch.quantile(q), np.percentile(values, 100 * q))
+        eq_(sketch.quantile(0.5), np.median(values))
+        ok_(np.isnan(QuantileSketch().quantile(0.5)))
+        assert_raises(ValueError, sketch.quantile, 95)
+
+    def test_bounded_and_mergeable(self):
+        streamed = QuantileSketch(200)
+        for block in np.array_split(self.values, 37):
+            streamed.update(block)
+        merged = QuantileSketch(200)
+        for block in np.array_split(self.values, 5):
+            merged.merge(QuantileSketch(200).update(block))
+
+        for sketch in (streamed, merged):
+            eq_(sketch.count, len(self.values))
+            ok_(sum(len(items) for items in sketch.levels) < 1000)
+            for q in (0.5, 0.95, 0.99):
+                ok_(abs(self.rank(sketch.quantile(q)) - q) < 0.01)
+
+        restored = QuantileSketch.from_dict(merged.to_dict())
+        eq_(restored.quantile(0.95), merged.quantile(0.95))
+
+    def test_daily_max_sketch(self):
+        path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp'])
+        timestamps = raw_data['timestamp'].values.view('i8')
+        values = raw_data['count'].values
+        daily_max = raw_data.set_index('timestamp')['count'].resample('D', how='max')
+
+        sketch = daily_max_sketch(timestamps, values, block_size=1000)
+        eq_(sketch.count, len(daily_max))
+        eq_(sketch.quantile(0.5), daily_max.median())
+
+        # shards split at a day boundary
+        split = np.searchsorted(timestamps, timestamps[0] - timestamps[0] % (86400 * 10**9) + 7 * 86400 * 10**9)
+        shards = daily_max_sketch(timestamps[:split], values[:split]).merge(
+            daily_max_sketch(timestamps[split:], values[split:]))
+        eq_(shards.quantile(0.95), sketch.quantile(0.95))
+
+        result = anomaly.detect_ts(raw_data.iloc[split:], max_anoms=0.02, direction='both', threshold='p95',
+                                   threshold_sketch=shards)
+        ok_(len(result) > 0)
+        ok_(np.all(result.values >= shards.quantile(0.95)))
+        assert_raises(ValueError, anomaly.detect_ts, raw_data, threshold='p95', threshold_sketch=0.5)
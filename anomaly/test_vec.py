@@ -1,37 +1,53 @@
-from nose.tools import eq_
+from nose.tools import eq_, ok_
 from unittest import TestCase
 import anomaly
+import numpy as np
+import pandas as pd
+import os
 
 class TestVec(TestCase):
     def setUp(self):
-        self.raw_data = []
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        self.raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])['count']
 
     def test_both_directions_with_plot(self):
         results = anomaly.detect_vec(self.raw_data, max_anoms=0.02,
                                      direction='both', period=1440,
                                      only_last=True, plot=True)
-        eq_(len(results['anoms']), 2)
-
-        # wtf, probably get rid of plotting
-        #eq_(len(results['anoms'][[2L]]), 25)
-        #   expect_equal(class(results$plot), c("gg", "ggplot"))
-        pass
+        eq_(len(results['anoms'].columns), 2)
+        eq_(len(results['anoms'].iloc[:,1]), 25)
 
     def test_both_directions_e_value_longterm(self):
         results = anomaly.detect_vec(self.raw_data, max_anoms=0.02,
-                                     direction='both', period=1440*14,
-                                     e_value=True)
-        #   expect_equal(length(results$anoms), 3)
-        #   expect_equal(length(results$anoms[[2L]]), 131)
-        #   expect_equal(results$plot, NULL)
-        # })
-        pass
+                                     direction='both', period=1440,
+                                     longterm_period=1440*14, e_value=True)
+        eq_(len(results['anoms'].columns), 3)
+        eq_(len(results['anoms'].iloc[:,1]), 131)
+        ok_(results['plot'] is None)
 
     def test_both_directions_e_value_threshold_med_max(self):
         results = anomaly.detect_vec(self.raw_data, max_anoms=0.02,
                                      direction='both', period=1440,
                                      threshold="med_max", e_value=True)
-        #   expect_equal(length(results$anoms), 3)
-        #   expect_equal(length(results$anoms[[2L]]), 6)
-        #   expect_equal(results$plot, NULL)
-        pass
+        eq_(len(results['anoms'].columns), 3)
+        eq_(len(results['anoms'].iloc[:,1]), 6)
+        ok_(results['plot'] is None)
+
+    def test_vector_inputs(self):
+        expected = anomaly.detect_vec(self.raw_data, max_anoms=0.02, direction='both', period=1440)
+        for data in (self.raw_data.values, list(self.raw_data), self.raw_data.to_frame()):
+            results = anomaly.detect_vec(data, max_anoms=0.02, direction='both', period=1440)
+            eq_(list(results.positions), list(expected.positions))
+        # positions index the input
+        eq_(list(expected.values), list(self.raw_data.values[expected.positions]))
+        eq_(list(expected['anoms'].index), list(expected.positions))
+
+    def test_longterm_windows(self):
+        from anomaly.detect_vec import _longterm_windows
+        eq_(_longterm_windows(10, 4), [(0, 4), (4, 8), (6, 10)])
+        eq_(_longterm_windows(8, 4), [(0, 4), (4, 8)])
+        eq_(_longterm_windows(3, 4), [(0, 3)])
+
+    def test_bad_input(self):
+        for data in ('abc', pd.DataFrame({'a': [1], 'b': [2]}), np.zeros((4, 2))):
+            self.assertRaises(ValueError, anomaly.detect_vec, data, period=2)
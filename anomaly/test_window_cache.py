@@ -0,0 +1,92 @@
+from nose.tools import eq_, ok_
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import anomaly
+from anomaly.window_cache import DirectoryWindowCache
+
+class TestWindowCache(TestCase):
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__))
+        raw_data = pd.read_csv(os.path.join(self.path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+        raw_data['timestamp'] = pd.to_datetime(raw_data['timestamp']).values.astype('M8[h]')
+        hourly = raw_data.groupby('timestamp', as_index=False).sum()
+
+        # repeat the hourly sums into about seven weeks, so longterm has several windows
+        span = hourly['timestamp'].iloc[-1] - hourly['timestamp'].iloc[0] + pd.Timedelta(hours=1)
+        self.data = pd.concat([
+            pd.DataFrame({'timestamp': hourly['timestamp'] + i * span, 'count': hourly['count']},
+                         columns=['timestamp', 'count'])
+            for i in range(5)
+        ], ignore_index=True)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def detect(self, data, cache):
+        return anomaly.detect_ts(data, max_anoms=0.02, direction='both', longterm=True,
+                                 e_value=True, cache=cache)
+
+    def assert_same(self, result, expected):
+        eq_(list(result.timestamps), list(expected.timestamps))
+        eq_(list(result.values), list(expected.values))
+        eq_(list(result.expected_values), list(expected.expected_values))
+
+    def test_unchanged_series_is_read_from_cache(self):
+        expected = anomaly.detect_ts(self.data, max_anoms=0.02, direction='both', longterm=True, e_value=True)
+        cache = {}
+        first = self.detect(self.data, cache)
+        ok_(len(first.window_stats) > 2)
+        ok_(not first.window_stats['cached'].any())
+        self.assert_same(first, expected)
+
+        second = self.detect(self.data, cache)
+        ok_(second.window_stats['cached'].all())
+        self.assert_same(second, expected)
+
+    def test_appended_data_only_recomputes_trailing_windows(self):
+        cache = DirectoryWindowCache(self.dir)
+        self.detect(self.data.iloc[:-24], cache)
+
+        result = self.detect(self.data, cache)
+        cached = result.window_stats['cached']
+        ok_(cached[:-1].all())
+        ok_(not cached[-1])
+        self.assert_same(result, self.detect(self.data, {}))
+
+    def test_parameters_are_part_of_the_key(self):
+        cache = {}
+        self.detect(self.data, cache)
+        result = anomaly.detect_ts(self.data, max_anoms=0.02, direction='pos', longterm=True, cache=cache)
+        ok_(not result.window_stats['cached'].any())
+        eq_(len(cache), 2 * len(result.window_stats))
+
+    def test_concurrent_writers(self):
+        # identical series write the same keys at once
+        cache = DirectoryWindowCache(self.dir)
+        entry = {'positions': np.arange(3), 'expected': np.ones(3), 'num_anoms': 3}
+
+        def write(i):
+            for key in ('a', 'b', 'c') * 50:
+                cache[key] = entry
+                ok_(cache.get(key) is not None)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(write, range(4)))
+        eq_(len(cache), 3)
+        eq_(sorted(os.listdir(self.dir)), ['a.npz', 'b.npz', 'c.npz'])
+        eq_(list(cache.get('a')['positions']), [0, 1, 2])
+
+        # an entry that can't be read is a miss
+        path = os.path.join(self.dir, 'a.npz')
+        with open(path, 'rb') as f:
+            truncated = f.read()[:100]
+        for contents in ('', 'not a zip file', truncated):
+            with open(path, 'wb') as f:
+                f.write(contents)
+            eq_(cache.get('a'), None)
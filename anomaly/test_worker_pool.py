@@ -0,0 +1,60 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import os
+import time
+from anomaly.worker_pool import WorkerPool, WorkerDied
+
+def square(x):
+    return x * x
+
+def fail(message):
+    raise ValueError(message)
+
+def die(code):
+    os._exit(code)
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+class TestWorkerPool(TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(2)
+
+    def tearDown(self):
+        self.pool.terminate()
+
+    def test_results(self):
+        futures = [self.pool.submit(square, i) for i in range(10)]
+        eq_([future.result(timeout=30) for future in futures], [i * i for i in range(10)])
+        error = self.pool.submit(fail, 'bad series').exception(timeout=30)
+        ok_(isinstance(error, ValueError))
+        eq_(str(error), 'bad series')
+        # unpicklable arguments fail their task only
+        ok_(self.pool.submit(square, lambda: 1).exception(timeout=30) is not None)
+        eq_(self.pool.submit(square, 3).result(timeout=30), 9)
+
+    def test_worker_dies(self):
+        started = time.time()
+        futures = [self.pool.submit(die, 3)] + [self.pool.submit(square, i) for i in range(4)]
+        error = futures[0].exception(timeout=30)
+        ok_(isinstance(error, WorkerDied))
+        ok_('code 3' in str(error))
+        ok_(time.time() - started < 30)
+        # the other tasks still run, the dead worker is replaced
+        eq_([future.result(timeout=30) for future in futures[1:]], [0, 1, 4, 9])
+        pids = set(future.result(timeout=30) for future in [self.pool.submit(sleep, 0.2) for _ in range(4)])
+        eq_(len(pids), 2)
+
+    def test_shutdown(self):
+        futures = [self.pool.submit(square, i) for i in range(4)]
+        self.pool.shutdown()
+        eq_([future.result() for future in futures], [0, 1, 4, 9])
+        assert_raises(RuntimeError, self.pool.submit, square, 1)
+
+        pool = WorkerPool(1)
+        futures = [pool.submit(sleep, 10), pool.submit(square, 2)]
+        time.sleep(0.5)
+        pool.terminate()
+        for future in futures:
+            ok_(isinstance(future.exception(timeout=5), WorkerDied))
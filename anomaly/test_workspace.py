@@ -0,0 +1,57 @@
+from nose.tools import eq_, ok_, assert_raises
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import os
+import anomaly
+from anomaly.esd import esd
+from anomaly.workspace import Workspace
+from anomaly.batch import detect_many
+
+class TestWorkspace(TestCase):
+    def setUp(self):
+        path = os.path.dirname(os.path.realpath(__file__))
+        self.raw_data = pd.read_csv(os.path.join(path, 'raw_data.csv'), usecols=['timestamp', 'count'])
+
+    def test_buffers(self):
+        workspace = Workspace(100)
+        a = workspace.get('a', 50)
+        eq_(len(a), 50)
+        ok_(np.may_share_memory(a, workspace.get('a', 100)))
+        eq_(workspace.get('a', 10, np.float32).dtype, np.float32)
+        eq_(workspace.allocations, 2)
+        # a larger series grows every buffer allocated after it
+        eq_(len(workspace.get('a', 200)), 200)
+        eq_(len(workspace.get('b', 10).base), 200)
+        ok_(np.array_equal(workspace.indices(5), np.arange(5)))
+
+    def test_esd(self):
+        rng = np.random.RandomState(2)
+        workspace = Workspace()
+        for n in (500, 300, 501):
+            values = rng.standard_cauchy(n)
+            values[:3] = np.nan
+            for dtype in (np.float64, np.float32):
+                for one_tail in (True, False):
+                    expected = esd(values, 100, one_tail=one_tail, dtype=dtype)
+                    result = esd(values, 100, one_tail=one_tail, dtype=dtype, workspace=workspace)
+                    eq_(list(result), list(expected))
+        allocations = workspace.allocations
+        esd(values, 100, workspace=workspace)
+        eq_(workspace.allocations, allocations)
+
+    def test_steady_state(self):
+        workspace = Workspace()
+        kwargs = dict(max_anoms=0.02, direction='both', e_value=True, longterm=True)
+        expected = anomaly.detect_ts(self.raw_data, **kwargs)
+        allocations = []
+        for _ in range(2):
+            result = anomaly.detect_ts(self.raw_data, workspace=workspace, **kwargs)
+            ok_(np.array_equal(result.timestamps, expected.timestamps))
+            ok_(np.array_equal(result.expected_values, expected.expected_values))
+            allocations.append(workspace.allocations)
+        # the second run reused the buffers of the first
+        ok_(allocations[0] > 0)
+        eq_(allocations[1], allocations[0])
+
+        assert_raises(ValueError, detect_many, [self.raw_data], workspace=workspace)
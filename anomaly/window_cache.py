@@ -0,0 +1,88 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+import numpy as np
+
+# bump when the cached entries or the detection they record change meaning
+CACHE_VERSION = 1
+
+
+def window_key(timestamps, values, params):
+    """
+    Cache key for one detection window.
+
+    The key starts with the window's first and last timestamps and its length,
+    followed by a SHA-1 of the window's timestamps and values and of every
+    parameter that changes the per-window result. A window whose history was
+    rewritten, or that was detected with different parameters, gets a new key.
+    """
+    digest = hashlib.sha1(repr((CACHE_VERSION, sorted(params.items()))).encode('utf-8'))
+    digest.update(np.ascontiguousarray(timestamps, dtype='<i8').view(np.uint8))
+    values = np.ascontiguousarray(values)
+    digest.update(values.dtype.str.encode('utf-8'))
+    digest.update(values.view(np.uint8))
+
+    if len(timestamps):
+        first, last = int(timestamps[0]), int(timestamps[-1])
+    else:
+        first = last = 0
+    return '%d-%d-%d-%s' % (first, last, len(timestamps), digest.hexdigest())
+
+
+class DirectoryWindowCache(object):
+    """
+    Window cache persisted as one .npz file per window in ``path``.
+
+    detect_ts accepts any object with ``get(key)`` and item assignment as its
+    ``cache``, so a plain dict works for a cache that only lives as long as the
+    process. This one survives between runs, e.g. for a periodic job that
+    re-scores a growing series with ``longterm=True``.
+
+    Entries are written to a temporary file of their own and renamed into
+    place, so an interrupted run never leaves a truncated entry behind and
+    concurrent writers of the same window (e.g. identical series) don't
+    collide; an entry that still can't be read is a miss. Entries for windows
+    that no longer occur are never read again; ``clear()`` removes everything.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key, default=None):
+        try:
+            with np.load(self._file(key)) as entry:
+                return {
+                    'positions': entry['positions'],
+                    'expected': entry['expected'],
+                    'num_anoms': int(entry['num_anoms'])
+                }
+        except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+            return default
+
+    def __setitem__(self, key, entry):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=key + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, positions=entry['positions'], expected=entry['expected'],
+                         num_anoms=entry['num_anoms'])
+            os.rename(tmp, self._file(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.path) if name.endswith('.npz')])
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.npz') or name.endswith('.tmp'):
+                os.remove(os.path.join(self.path, name))
@@ -0,0 +1,79 @@
+from collections import namedtuple
+from pandas import DataFrame
+import numpy as np
+from date_utils import timestamps_to_ns
+from detect_anoms import detect_anoms
+
+# The per-window core shared by detect_ts and detect_vec. Windows are (start, stop) positions into
+# int64 timestamp and value arrays; for detect_ts the timestamps are nanoseconds, for detect_vec
+# they're the observation positions themselves.
+
+Direction = namedtuple('Direction', ['one_tail', 'upper_tail'])
+
+
+def window_frame(timestamps, values, start, stop, dtype=np.float64, index_type='datetime'):
+    # only the window being analysed is copied out of the (possibly memory-mapped) arrays
+    timestamps = np.asarray(timestamps[start:stop])
+    if index_type == 'datetime':
+        timestamps = timestamps.view('M8[ns]')
+    return DataFrame({
+        'timestamp': timestamps,
+        'count': np.asarray(values[start:stop], dtype=dtype)
+    }, columns=['timestamp', 'count'])
+
+
+def locate(sorted_timestamps, timestamps):
+    # positions of timestamps within sorted_timestamps, dropping any that aren't present
+    if len(sorted_timestamps) == 0:
+        return np.empty(0, dtype=np.int64)
+    positions = np.searchsorted(sorted_timestamps, timestamps)
+    positions = np.minimum(positions, len(sorted_timestamps) - 1)
+    return positions[sorted_timestamps[positions] == timestamps]
+
+
+def _as_int64(timestamps, index_type):
+    if index_type == 'datetime':
+        return timestamps_to_ns(timestamps)
+    return np.asarray(timestamps, dtype=np.int64)
+
+
+def detect_window(timestamps, values, start, stop, max_anoms, alpha, period, anomaly_direction,
+                  verbose, dtype, index_type='datetime', decomposition='r_stl', max_gap=0,
+                  gap_fill='linear', step=None, approximate=False, early_stop=None,
+                  workspace=None, seasonal_periods=None):
+    # anomalies of one window, before the threshold filter, as stored in a window cache:
+    # positions relative to the window start, their expected values, and the S-H-ESD count,
+    # along with the full detect_anoms output
+    # detect_anoms actually performs the anomaly detection and returns the results in a list containing the anomalies
+    # as well as the decomposed components of the time series for further analysis.
+    output = detect_anoms(window_frame(timestamps, values, start, stop, dtype, index_type), k=max_anoms, alpha=alpha, num_obs_per_period=period, use_decomp=True, use_esd=False,
+                          one_tail=anomaly_direction.one_tail, upper_tail=anomaly_direction.upper_tail, verbose=verbose, dtype=dtype,
+                          decomposition=decomposition, max_gap=max_gap, gap_fill=gap_fill,
+                          step=step, approximate=approximate, early_stop=early_stop,
+                          workspace=workspace, seasonal_periods=seasonal_periods)
+
+    # store decomposed components in local variable and overwrite s_h_esd_timestamps to contain only the anom timestamps
+    data_decomp = output['stl']
+    s_h_esd_timestamps = output['anoms']
+
+    # -- Step 3: Use detected anomaly timestamps to extract the actual anomalies (timestamp and value) from the data
+    if s_h_esd_timestamps:
+        anom_timestamps = np.sort(_as_int64(s_h_esd_timestamps, index_type))
+    else:
+        anom_timestamps = np.empty(0, dtype=np.int64)
+
+    window_timestamps = timestamps[start:stop]
+    positions = locate(window_timestamps, anom_timestamps)
+    anom_timestamps = window_timestamps[positions]
+
+    # the seasonal + trend component at each anomaly, used as its expected value
+    decomp_timestamps = _as_int64(data_decomp.timestamp, index_type)
+    expected = np.asarray(data_decomp['count'], dtype=np.float64)[
+        locate(decomp_timestamps, anom_timestamps)]
+
+    entry = {
+        'positions': positions,
+        'expected': expected,
+        'num_anoms': len(s_h_esd_timestamps or [])
+    }
+    return entry, output
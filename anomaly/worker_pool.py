@@ -0,0 +1,158 @@
+import cPickle as pickle
+import threading
+from Queue import Queue
+from concurrent.futures import Future
+from multiprocessing import Pipe, Process, cpu_count
+
+# A process pool for the service and the batch CLI whose tasks fail, rather than hang, when the worker
+# running them dies. multiprocessing.Pool replaces a dead worker but never completes the task it took
+# with it, and the concurrent.futures backport for Python 2 has no BrokenProcessPool either. Here every
+# worker has a thread in the parent that hands it one task at a time over a pipe of its own, so a
+# worker that exits (killed for memory, or crashed in R) shows up as the end of its pipe: that task's
+# future fails with WorkerDied and a fresh worker takes its place.
+
+
+class WorkerDied(RuntimeError):
+    """The worker process running a task exited before returning its result."""
+
+
+def _work(conn, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv_bytes()
+        except (EOFError, IOError):
+            return
+        if not task:
+            return
+        fn, args, kwargs = pickle.loads(task)
+        try:
+            outcome = True, fn(*args, **kwargs)
+        except Exception as e:
+            outcome = False, e
+        try:
+            payload = pickle.dumps(outcome, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            payload = pickle.dumps((False, RuntimeError('%s: %s' % (type(e).__name__, e))),
+                                   pickle.HIGHEST_PROTOCOL)
+        conn.send_bytes(payload)
+
+
+class WorkerPool(object):
+    """
+    ``workers`` processes, each started with ``initializer(*initargs)``, that
+    run the functions given to ``submit`` and resolve the returned
+    concurrent.futures.Future with the result or the exception raised. A
+    task whose worker dies fails with WorkerDied, and the worker is replaced.
+    """
+
+    def __init__(self, workers=None, initializer=None, initargs=()):
+        self.workers = workers or cpu_count()
+        self._initializer = initializer
+        self._initargs = initargs
+        self._tasks = Queue()
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._closed = False
+        self._terminated = False
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._supervise, name='anomaly-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError("the pool is shut down")
+        future = Future()
+        self._tasks.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """Run the tasks already submitted, then stop the workers."""
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._tasks.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def terminate(self):
+        """Stop the workers now, failing every task that hasn't finished."""
+        self._terminated = True
+        self.shutdown(wait=False)
+        with self._lock:
+            for process in self._processes:
+                process.terminate()
+        for thread in self._threads:
+            thread.join()
+
+    def _spawn(self):
+        # under the lock, so no other worker is forked while it holds this one's end of the pipe, and
+        # this one's exit closes the pipe
+        with self._lock:
+            conn, child = Pipe()
+            process = Process(target=_work, args=(child, self._initializer, self._initargs))
+            process.daemon = True
+            process.start()
+            child.close()
+            self._processes.add(process)
+        return process, conn
+
+    def _retire(self, process, conn):
+        # workers forked later hold a copy of this end of the pipe too, so closing it isn't enough to
+        # tell the worker to stop
+        try:
+            conn.send_bytes('')
+        except (IOError, OSError):
+            pass
+        conn.close()
+        process.join()
+        with self._lock:
+            self._processes.discard(process)
+
+    def _supervise(self):
+        process, conn = self._spawn()
+        try:
+            while True:
+                item = self._tasks.get()
+                if item is None:
+                    return
+                future, fn, args, kwargs = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if self._terminated:
+                    future.set_exception(WorkerDied("the pool was terminated"))
+                    continue
+                try:
+                    task = pickle.dumps((fn, args, kwargs), pickle.HIGHEST_PROTOCOL)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+
+                try:
+                    conn.send_bytes(task)
+                    payload = conn.recv_bytes()
+                except (EOFError, IOError, OSError):
+                    self._retire(process, conn)
+                    future.set_exception(WorkerDied("worker %d exited with code %s" %
+                                                    (process.pid, process.exitcode)))
+                    process = conn = None
+                    if not self._terminated:
+                        process, conn = self._spawn()
+                    continue
+
+                try:
+                    ok, value = pickle.loads(payload)
+                except Exception as e:
+                    ok, value = False, RuntimeError('%s: %s' % (type(e).__name__, e))
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        finally:
+            if process is not None:
+                self._retire(process, conn)
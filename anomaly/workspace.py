@@ -0,0 +1,67 @@
+import threading
+import numpy as np
+
+# Buffers for the array core, kept from one detection to the next so that a fleet run doesn't allocate
+# (and collect) the remainder and the ESD working set again for every series. Only arrays that never leave
+# a call live here: the resampled counts, the decomposition and the results are still allocated per
+# series, since they are returned.
+
+
+class Workspace(object):
+    """
+    Named NumPy buffers that grow to the largest series they have been used
+    for, or ``size`` observations up front, and are then reused. Pass one to
+    detect_ts, detect_vec or esd.esd with ``workspace``.
+
+    A Workspace serves one detection at a time; give each thread its own, e.g.
+    with ThreadWorkspaces.
+
+    allocations : int
+        How many buffers were allocated so far, so steady state can be checked.
+    """
+
+    def __init__(self, size=0):
+        self.size = int(size)
+        self.allocations = 0
+        self._buffers = {}
+        self._indices = np.arange(0, dtype=np.int64)
+
+    def reserve(self, size):
+        """Make every buffer allocated from now on hold at least ``size`` observations."""
+        self.size = max(self.size, int(size))
+
+    def get(self, name, length, dtype=np.float64):
+        """
+        The first ``length`` elements of buffer ``name`` of ``dtype``. Its
+        contents are left over from the last use.
+        """
+        key = (name, np.dtype(dtype))
+        buf = self._buffers.get(key)
+        if buf is None or len(buf) < length:
+            self.size = max(self.size, length)
+            buf = self._buffers[key] = np.empty(self.size, dtype=dtype)
+            self.allocations += 1
+        return buf[:length]
+
+    def indices(self, length):
+        """0, 1, ..., length - 1, read-only."""
+        if len(self._indices) < length:
+            self.size = max(self.size, length)
+            self._indices = np.arange(self.size, dtype=np.int64)
+            self._indices.flags.writeable = False
+            self.allocations += 1
+        return self._indices[:length]
+
+    @property
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self._buffers.values()) + self._indices.nbytes
+
+    def __repr__(self):
+        return '<Workspace: %d buffers, %d bytes>' % (len(self._buffers), self.nbytes)
+
+
+class ThreadWorkspaces(threading.local):
+    """A Workspace per thread, as ``.workspace``, for detections on a thread pool."""
+
+    def __init__(self, size=0):
+        self.workspace = Workspace(size)